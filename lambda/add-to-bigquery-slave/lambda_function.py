@@ -6,11 +6,12 @@
 #   temp file. Not very pleseant for multiple calls in a local machine.
 
 import json
-from google.cloud import storage
 from google.cloud import bigquery
 import boto3
 import os
+import gzip
 from bigquery_schema_generator.generate_schema import SchemaGenerator
+import cloud_clients
 
 # To run locally (not in AWS):
 local = False
@@ -19,25 +20,22 @@ debug = False
 # Option from where to get data for schema:
 read_from_aws = False
 
-# Get authentication key for google cloud:
 client = boto3.client('s3')
-a = client.get_object(
-                  Bucket='config-lambda', 
-                  Key='layers/google-cloud-storage/gabinete-compartilhado.json')
-open('/tmp/key.json', 'w').write(a['Body'].read().decode('utf-8'))
 
-def add_bigquery(temp_data, table_name, table_path, dataset_name, schema):
+def add_bigquery(temp_data, table_name, table_path, dataset_name, schema, output_format='njson'):
     """
     Given a dataset name and a table_name (in bigquery), create
     a table in bigquery with schema given in 'schema' and 
     the data stored in Google Storage path 'table_path'.
     
-    It deduces the file format (NJSON or CSV) from temp_data.
+    The file format follows the captures' `output_format`: 'parquet' 
+    files have their schema autodetected (and 'schema' is ignored), 
+    'njson.gz' files are read as compressed NJSON. For 'njson' it 
+    deduces the file format (NJSON or CSV) from temp_data.
     """
 
-    if local:
-        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = '/tmp/key.json'
-    bq = bigquery.Client(project='gabinete-compartilhado')
+    # Client (and Google credentials) reused across invocations:
+    bq = cloud_clients.bigquery_client()
     
     ds = bq.dataset(dataset_name)
     
@@ -52,18 +50,28 @@ def add_bigquery(temp_data, table_name, table_path, dataset_name, schema):
     table = bigquery.Table(table_ref)
     
     # Configure the bigquery table:
-    if os.path.exists(temp_data):
+    if output_format == 'parquet':
+        external_config = bigquery.ExternalConfig('PARQUET')
+    elif output_format == 'njson.zst':
+        raise Exception('BigQuery external tables do not support zstd-compressed files.')
+    elif os.path.exists(temp_data):
         external_config = bigquery.ExternalConfig('NEWLINE_DELIMITED_JSON')
+        if output_format == 'njson.gz':
+            external_config.compression = 'GZIP'
     elif os.path.exists(temp_data.replace('.json', '.csv')):
         external_config = bigquery.ExternalConfig('CSV')
     else:
         raise Exception('unknown temp_data file extension')
 
     
-    external_config.schema = schema
-    # external_config.autodetect = True
-    external_config.ignore_unknown_values = True
-    external_config.max_bad_records = 100
+    if output_format == 'parquet':
+        # Parquet files carry their own schema:
+        external_config.autodetect = True
+    else:
+        external_config.schema = schema
+        # external_config.autodetect = True
+        external_config.ignore_unknown_values = True
+        external_config.max_bad_records = 100
     source_uris = [table_path] 
     external_config.source_uris = source_uris
     table.external_data_configuration = external_config
@@ -142,6 +150,19 @@ def append_first_lines(temp_data, file, max_bytes):
     else:
         raise Exception('Unknown file type.')
 
+def decompress(name, content):
+    """
+    Given a file `name` (str) and its `content` (bytes), return the 
+    content decompressed according to the file extension ('.gz' or '.zst').
+    """
+    if name.endswith('.gz'):
+        return gzip.decompress(content)
+    if name.endswith('.zst'):
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj().decompress(content)
+    return content
+
+
 def save_raw_data_to_local_GCP(temp_data, bucket, prefix):
     """
     Save the first 100 entries (i.e. files) in the database to a temp file
@@ -154,9 +175,7 @@ def save_raw_data_to_local_GCP(temp_data, bucket, prefix):
     # Open temp file and save the first 100 items in it:
     open(temp_data, 'w').write('')
 
-    if local:
-        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = '/tmp/key.json'
-    gcp_storage = storage.Client(project='gabinete-compartilhado')
+    gcp_storage = cloud_clients.storage_client()
 
     b = gcp_storage.get_bucket(bucket)
     blob_iterator = b.list_blobs(prefix=prefix)  
@@ -168,7 +187,7 @@ def save_raw_data_to_local_GCP(temp_data, bucket, prefix):
         if debug:
             print(obj)
         
-        a = obj.download_as_string().decode('utf-8')
+        a = decompress(obj.name, obj.download_as_string()).decode('utf-8')
         if len(a) > 0:
             open(temp_data, 'a+').write(a + '\n')
         # DEBUG:
@@ -193,7 +212,7 @@ def save_raw_data_to_local_AWS(temp_data, bucket, prefix):
         if debug:
             print(obj)
         
-        a = client.get_object(Bucket=bucket, Key=obj['Key'])['Body'].read().decode()
+        a = decompress(obj['Key'], client.get_object(Bucket=bucket, Key=obj['Key'])['Body'].read()).decode()
         open(temp_data, 'a+').write(a + '\n')
         # DEBUG:
         #return a
@@ -312,11 +331,19 @@ def lambda_handler(event, context):
     
     RAW_DATA = '/tmp/raw.json'
     
-    # Pre-save first few data entries to a tempo file to create the schema afterwards:
-    save_raw_data_to_local(RAW_DATA, event['bucket_name'], event['prefix'], event['max_bytes'])
+    # Format of the captured files (see add-to-bigquery):
+    output_format = event.get('output_format', 'njson')
+    
+    # Parquet files already contain their schema:
+    if output_format == 'parquet':
+        schema = None
+    
+    else:
+        # Pre-save first few data entries to a tempo file to create the schema afterwards:
+        save_raw_data_to_local(RAW_DATA, event['bucket_name'], event['prefix'], event['max_bytes'])
     
-    # Create the schema:
-    schema = generate_schema(RAW_DATA, extra_types=event['extra_types'])
+        # Create the schema:
+        schema = generate_schema(RAW_DATA, extra_types=event['extra_types'])
 
     # Add to bigquery:
-    add_bigquery(RAW_DATA, event['name'], event['path'], event['dataset_name'], schema)
\ No newline at end of file
+    add_bigquery(RAW_DATA, event['name'], event['path'], event['dataset_name'], schema, output_format)
\ No newline at end of file
@@ -1,19 +1,8 @@
 import json
-from google.cloud import storage
-from google.cloud import bigquery
 import boto3
 import os
 from bigquery_schema_generator.generate_schema import SchemaGenerator
-
-
-client = boto3.client('s3')
-a = client.get_object(
-                  Bucket='config-lambda', 
-                  Key='layers/google-cloud-storage/gabinete-compartilhado.json')
-open('/tmp/key.json', 'w').write(a['Body'].read().decode('utf-8'))
-
-bq = bigquery.Client(project='gabinete-compartilhado')
-storage = storage.Client(project='gabinete-compartilhado')
+import cloud_clients
 
 lambd = boto3.client('lambda')
 
@@ -22,13 +11,27 @@ RAW_DATA = '/tmp/raw.json'
 SCHEMA =   '/tmp/schema.json'
 
 
+def blob_output_format(name):
+    """
+    Given a file `name` (str), return its output format (as set in the 
+    capture configs) according to its extension.
+    """
+    if name.endswith('.json.gz'):
+        return 'njson.gz'
+    if name.endswith('.json.zst'):
+        return 'njson.zst'
+    if name.endswith('.parquet'):
+        return 'parquet'
+    return 'njson'
+
+
 def lambda_handler(event, context):
     
     bucket_name = event['bucket-name']
     prefix = event['prefix']
     dataset_name = event['dataset_name']
     
-    bucket = storage.get_bucket(bucket_name)
+    bucket = cloud_clients.storage_client().get_bucket(bucket_name)
     
     blobs = bucket.list_blobs(prefix=prefix)
 
@@ -41,16 +44,28 @@ def lambda_handler(event, context):
                       'prefix': '/'.join([
                               prefix[:-1], 
                               x.name.split(prefix)[1].split('/')[0], '']),
-                      'name': x.name.split(prefix)[1].split('/')[0].replace('-', '_')},
+                      'name': x.name.split(prefix)[1].split('/')[0].replace('-', '_'),
+                      'output_format': blob_output_format(x.name)},
                     blobs)
                     
     
+    # One entry per table, with all formats found in its files:
+    tables  = list(tables)
+    formats = {}
+    for t in tables:
+        formats.setdefault(t['name'], set()).add(t['output_format'])
     tables = list({v['name']:v for v in tables}.values())
                     
     print(tables)
     
+    # A BigQuery external table reads all files under its prefix in a single format:
+    mixed = [t['name'] for t in tables if len(formats[t['name']]) > 1]
+    
     for t in tables:
         
+        if t['name'] in mixed:
+            print('Skipping table', t['name'], 'with mixed file formats:', sorted(formats[t['name']]))
+            continue
         
         lambd.invoke(FunctionName='arn:aws:lambda:us-east-1:085250262607:function:add-to-bigquery-slave:PROD',
                      InvocationType='Event',
@@ -60,7 +75,11 @@ def lambda_handler(event, context):
                           "name": t['name'],
                           "path": t['path'],
                           "dataset_name": dataset_name,
+                          "output_format": t['output_format'],
                           "extra_types": []
                      }))
 
        
+
+    if len(mixed) > 0:
+        raise Exception('Tables with mixed file formats (not added to BigQuery): ' + ', '.join(mixed))
@@ -1,29 +1,22 @@
 import json
 import boto3
-import google.auth
-from google.cloud import bigquery
 from collections import defaultdict
+import cloud_clients
+import keyword_matcher as km
+import sql_filters
 
 # Switch for turn on debugging messages.
 debug = False
-
-s3 = boto3.client('s3')
-a = s3.get_object(
-                  Bucket='config-lambda', 
-                  Key='layers/google-cloud-storage/gabinete-compartilhado.json')
-open('/tmp/key.json', 'w').write(a['Body'].read().decode('utf-8'))
-
-# Create credentials with Drive & BigQuery API scopes
-# Both APIs must be enabled for your project before running this code
-credentials, project = google.auth.default(scopes=[
-    'https://www.googleapis.com/auth/drive',
-    'https://www.googleapis.com/auth/bigquery',
-])
-bq = bigquery.Client(credentials=credentials, project=project)
+# Evaluate the filters with pandas (if available) instead of keyword_matcher
+# (same results, see vectorized_filters):
+vectorized = True
 
 
 def query_bigquery(query):
-        
+    
+    # BigQuery client with Drive & BigQuery API scopes (reused across invocations):
+    bq = cloud_clients.bigquery_client()
+    
     result = bq.query(
         query,
         # Location must match that of the dataset(s) referenced in the query.
@@ -152,37 +145,42 @@ def get_relevant_results(bot_info, results):
     # To combine filters with OR, create a new bot_info with a different list of filters.
     """
     
-    filters = bot_info['filters']
-    
-    if len(filters):
-        print('name:', bot_info['nome'])
-        print('len results', len(results))
+    return get_relevant_results_all([bot_info], results)[0]
 
-        
-        for f in filters:
-           
-            if debug:
-                print('f', f)
-            
-            # Delete None
-            # Select all desired columns that actually exist in the bigquery results:
-            results = list(filter(lambda x: x[f['column_name']] is not None, results))
-                
-            if 'positive_filter' in f.keys():
-                results = list(filter(lambda x: 
-                    any([var.lower() in x[f['column_name']].lower() 
-                        for var in f['positive_filter']]), results))
-                        
-            # Changed on 2019-05-21 from elif to if:
-            if 'negative_filter' in f.keys():
-                results = list(filter(lambda x: 
-                    all([var.lower() not in x[f['column_name']].lower() 
-                        for var in f['negative_filter']]), results))
-                        
-            print('len results', len(results))
-    
-    return results
+def get_relevant_results_all(bot_infos, results):
+    """
+    Filter the query result 'results' for each bot_info in the list 'bot_infos'
+    (see get_relevant_results) and return a list with the selected results for
+    each bot_info. The filters of all bot_infos are compiled together, so each 
+    result is scanned only once (see keyword_matcher and vectorized_filters).
+    """
+    try:
+        import vectorized_filters
+    except ImportError:
+        vectorized_filters = None
+    
+    if vectorized and vectorized_filters != None:
+        selected = vectorized_filters.select(bot_infos, results)
+    else:
+        selected = km.FilterSets(bot_infos).select(results)
+    
+    for bot_info, partial_results in zip(bot_infos, selected):
+        if len(bot_info['filters']):
+            print('name:', bot_info['nome'])
+            print('len results', len(results), '->', len(partial_results))
+    
+    return selected
     
+def selected_to_sns(bot_info, partial_results):
+    """
+    Takes the dicionary with search keywords 'bot_info' and the data selected by 
+    it 'partial_results', format to slack style and send it to Amazon's SNS.
+    """
+    # Format to slack structure:
+    payload = to_slack_format(bot_info, partial_results)
+    # Send the post to Amazon's SNS (notification system):
+    post_to_sns(bot_info, payload)
+
 def data_to_sns(bot_info, results):
     """
     Takes the dicionary with search keywords 'bot_info' and all new data in BigQuery
@@ -191,10 +189,66 @@ def data_to_sns(bot_info, results):
     """
     # Filter the results (select what we want to track):
     partial_results = get_relevant_results(bot_info, results)
-    # Format to slack structure:
-    payload = to_slack_format(bot_info, partial_results)
-    # Send the post to Amazon's SNS (notification system):
-    post_to_sns(bot_info, payload)
+    selected_to_sns(bot_info, partial_results)
+
+def results_index(casa):
+    """
+    Return the position in the list of queries (see lambda_handler) of the 
+    results filtered by the bot_infos of 'casa', or None if there is none.
+    """
+    if 'dou' in casa:
+        return 2
+    elif 'senado' in casa:
+        return 1
+    elif 'camara' in casa:
+        return 0
+    return None
+
+def use_pushdown(metadata, event):
+    """
+    Return True if the results of the query described in 'metadata' (an entry
+    of the list of queries, see lambda_handler) should be filtered inside 
+    BigQuery (see sql_filters). This is set by the query's 'pushdown' key, 
+    unless the Lambda input 'event' has a 'pushdown' key, e.g. {"pushdown": true},
+    that applies to all queries.
+    """
+    if isinstance(event, dict) and event.get('pushdown') != None:
+        return event['pushdown'] == True
+    return metadata.get('pushdown') == True
+
+def filter_queries(bot_infos, queries_metadata, event):
+    """
+    Select, for each bot_info in 'bot_infos', the results of the query (see 
+    lambda_handler) in 'queries_metadata' it filters (see results_index). 
+    The results of each query are filtered for all its bot_infos at once,
+    either after downloading them or inside BigQuery (see use_pushdown).
+    
+    Returns a dict from the position of the bot_info in 'bot_infos' to its
+    list of selected results (bot_infos without a query are left out).
+    """
+    
+    # Group the selection criteria by the results they filter:
+    groups = defaultdict(list)
+    for i, bot_info in enumerate(bot_infos):
+        index = results_index(bot_info['casa'])
+        if index != None:
+            groups[index].append(i)
+    
+    # Filter each query's results for all its selection criteria at once:
+    selected = {}
+    for index, bot_ids in groups.items():
+        metadata    = queries_metadata[index]
+        query_infos = [bot_infos[i] for i in bot_ids]
+        if use_pushdown(metadata, event):
+            partial_results = sql_filters.select(query_infos, metadata['query'])
+            for bot_info, results in zip(query_infos, partial_results):
+                print('name:', bot_info['nome'])
+                print('len results', len(results))
+        else:
+            partial_results = get_relevant_results_all(query_infos, query_bigquery(metadata['query']))
+        selected.update(zip(bot_ids, partial_results))
+    
+    return selected
 
 # Functions to load Gabi filters:
 
@@ -288,31 +342,27 @@ def lambda_handler(event, context):
     #filters_raw = query_bigquery('SELECT * FROM `gabinete-compartilhado.gabi_bot.gabi_filters`')
     filters_raw = query_bigquery("SELECT * FROM `gabinete-compartilhado.gabi_bot.gabi_filters` WHERE casa != 'dou'")
     # Each entry in the list below is a bot_info:
-    event = format_filters(filters_raw)
-    print('Loaded {} filters from Google sheets.'.format(len(event)))
+    bot_infos = format_filters(filters_raw)
+    print('Loaded {} filters from Google sheets.'.format(len(bot_infos)))
 
-    # Will get every new entry in BigQuery that appeared in the last 30min:
+    # Will get every new entry in BigQuery that appeared in the last 30min
+    # ('pushdown': filter the results inside BigQuery, see `filter_queries`):
     queries_metadata = [
         {'casa': 'camara',
-        'query': "SELECT * FROM `gabinete-compartilhado.gabi_bot.camara_tramitacao_last30minutos`"},
-        #'query': "SELECT * FROM `gabinete-compartilhado.gabi_bot.teste`"},
+        'query': "SELECT * FROM `gabinete-compartilhado.gabi_bot.camara_tramitacao_last30minutos`",
+        #'query': "SELECT * FROM `gabinete-compartilhado.gabi_bot.teste`",
+        'pushdown': False},
         {'casa': 'senado',
-        'query': "SELECT * FROM `gabinete-compartilhado.gabi_bot.senado_tramitacao_last30minutos`"}#,
+        'query': "SELECT * FROM `gabinete-compartilhado.gabi_bot.senado_tramitacao_last30minutos`",
+        'pushdown': False}#,
         #{'casa': 'dou',
         #'query': "SELECT * FROM `gabinete-compartilhado.gabi_bot.artigos_dou_last30minutos`"}
         ]
     
-    for metadata in queries_metadata:
-        metadata['results'] = query_bigquery(metadata['query'])
+    # Select the results for each bot_info:
+    selected = filter_queries(bot_infos, queries_metadata, event)
     
     # LOOP over the different selection criteria:
-    for bot_info in event:
-        
-        if 'dou' in bot_info['casa']:
-            data_to_sns(bot_info, queries_metadata[2]['results'])
-            
-        elif 'senado' in bot_info['casa']:
-            data_to_sns(bot_info, queries_metadata[1]['results'])
-
-        elif 'camara' in bot_info['casa']:
-            data_to_sns(bot_info, queries_metadata[0]['results'])
\ No newline at end of file
+    for i, bot_info in enumerate(bot_infos):
+        if i in selected:
+            selected_to_sns(bot_info, selected[i])
\ No newline at end of file
@@ -0,0 +1,107 @@
+"""
+Gabi bot filters (see keyword_matcher) compiled into Google BigQuery SQL,
+so the filtering runs inside BigQuery and only the selected rows are
+downloaded.
+
+Each bot_info becomes a predicate: for each filter, the column is not
+NULL, its lowered value contains at least one positive keyword
+(STRPOS > 0) and none of the negative keywords. Keywords are passed as
+query parameters. All bot_infos are evaluated in one query, that
+returns one line per (bot, selected row) pair:
+
+    SELECT gabi_bot_id, t.* EXCEPT (gabi_bot_ids)
+    FROM (SELECT *, [IF(<predicate 0>, 0, NULL), ...] AS gabi_bot_ids
+          FROM (<query>)) AS t
+    CROSS JOIN UNNEST(t.gabi_bot_ids) AS gabi_bot_id
+    WHERE gabi_bot_id IS NOT NULL
+"""
+
+import re
+import cloud_clients
+
+# Column names allowed in the predicates (they come from the Gabi filters sheet):
+valid_column = re.compile('^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def keyword_test(column, keyword, params):
+    """
+    Return the SQL (str) that tests if the lowered `column` contains the
+    (lowered) `keyword` (str), adding the keyword to the dict `params`
+    (keyword -> query parameter name) if needed.
+    """
+    # Every text contains the empty keyword:
+    if keyword == '':
+        return 'TRUE'
+    if keyword not in params:
+        params[keyword] = 'kw' + str(len(params))
+    return 'STRPOS(LOWER(CAST(`%s` AS STRING)), @%s) > 0' % (column, params[keyword])
+
+
+def filters_predicate(filters, params):
+    """
+    Return the SQL predicate (str) equivalent to the list of `filters` of
+    a bot_info (see get_relevant_results), adding the keywords used to
+    `params` (dict from keyword to query parameter name).
+    """
+    conditions = []
+    for f in filters:
+        column = f['column_name']
+        if not valid_column.match(column):
+            raise Exception('Invalid column name in filter: ' + str(column))
+
+        conditions.append('`%s` IS NOT NULL' % column)
+        # Keywords in positive filters are combined with OR:
+        if 'positive_filter' in f:
+            tests = [keyword_test(column, var.lower(), params) for var in f['positive_filter']]
+            conditions.append('(' + ' OR '.join(tests) + ')' if len(tests) > 0 else 'FALSE')
+        # Keywords in negative filters must not appear:
+        if 'negative_filter' in f:
+            tests = [keyword_test(column, var.lower(), params) for var in f['negative_filter']]
+            conditions = conditions + ['NOT (' + test + ')' for test in tests]
+
+    if len(conditions) == 0:
+        return 'TRUE'
+    return '(' + ' AND '.join(conditions) + ')'
+
+
+def build_query(bot_infos, query):
+    """
+    Return the SQL (str) that selects, from the results of `query` (str),
+    the rows that pass the filters of each bot_info in `bot_infos` (list
+    of dicts), along with the bot_info's position in the list (column
+    'gabi_bot_id'). Also returns the dict from keyword to query parameter
+    name.
+    """
+    params  = {}
+    flags   = ['IF(%s, %d, NULL)' % (filters_predicate(bot_info['filters'], params), i)
+               for i, bot_info in enumerate(bot_infos)]
+    sql     = ('SELECT gabi_bot_id, t.* EXCEPT (gabi_bot_ids)\n'
+               'FROM (SELECT *, [' + ', '.join(flags) + '] AS gabi_bot_ids\n'
+               '      FROM (' + query + ')) AS t\n'
+               'CROSS JOIN UNNEST(t.gabi_bot_ids) AS gabi_bot_id\n'
+               'WHERE gabi_bot_id IS NOT NULL')
+    return sql, params
+
+
+def select(bot_infos, query):
+    """
+    Run `query` (str) in Google BigQuery, with the filters of all
+    `bot_infos` (list of dicts) applied inside BigQuery, and return,
+    for each bot_info, the list of selected rows (dicts).
+    """
+    selected = [[] for bot_info in bot_infos]
+    if len(bot_infos) == 0:
+        return selected
+
+    from google.cloud import bigquery
+    sql, params = build_query(bot_infos, query)
+    config      = bigquery.QueryJobConfig(query_parameters=[bigquery.ScalarQueryParameter(name, 'STRING', keyword)
+                                                           for keyword, name in params.items()])
+
+    # Location must match that of the dataset(s) referenced in the query:
+    result = cloud_clients.bigquery_client().query(sql, job_config=config, location="US")
+    for r in result:
+        row = dict(r.items())
+        selected[row.pop('gabi_bot_id')].append(row)
+
+    return selected
@@ -0,0 +1,93 @@
+"""
+Vectorized evaluation of Gabi bot filters (see keyword_matcher) with
+pandas and NumPy.
+
+The query results are loaded into a DataFrame and each column used by
+the filters is lowered once. The match of each (column, keyword) pair
+over all rows is computed once and reused by all bots that use it. The
+filters of each bot are then combined with boolean array operations,
+giving a bot x row match matrix.
+
+pandas would treat some values differently from keyword_matcher: NaN
+as a missing value (like None), values that are not strings (e.g.
+numbers) as strings, and a column missing from some rows as None in
+those rows. So `select` only uses pandas if all the values in the
+filtered columns are text or None; otherwise, the results are filtered
+by keyword_matcher, so they are always the same as keyword_matcher's.
+"""
+
+import numpy as np
+import pandas as pd
+import keyword_matcher as km
+
+
+def match_matrix(bot_infos, frame):
+    """
+    Return a NumPy bool array with one line per bot_info in `bot_infos`
+    (list of dicts) and one column per row of `frame` (pandas DataFrame),
+    telling whether the row passes all the bot_info's filters.
+    """
+    n_rows = len(frame)
+    # Memoized not-null masks, lowered columns and keyword masks:
+    not_null = {}
+    lowered  = {}
+    masks    = {}
+
+    def has_value(column):
+        if column not in not_null:
+            not_null[column] = frame[column].notna().to_numpy(dtype=bool)
+        return not_null[column]
+
+    def contains(column, keyword):
+        if column not in lowered:
+            lowered[column] = frame[column].astype('string').str.lower()
+        if (column, keyword) not in masks:
+            found = lowered[column].str.contains(keyword, regex=False)
+            masks[(column, keyword)] = found.fillna(False).to_numpy(dtype=bool)
+        return masks[(column, keyword)]
+
+    matrix = np.ones((len(bot_infos), n_rows), dtype=bool)
+    for i, bot_info in enumerate(bot_infos):
+        for f in bot_info['filters']:
+            column = f['column_name']
+            matrix[i] &= has_value(column)
+            # Keywords in positive filters are combined with OR:
+            if 'positive_filter' in f:
+                positive = np.zeros(n_rows, dtype=bool)
+                for var in f['positive_filter']:
+                    positive |= contains(column, var.lower())
+                matrix[i] &= positive
+            # Keywords in negative filters must not appear:
+            if 'negative_filter' in f:
+                for var in f['negative_filter']:
+                    matrix[i] &= ~contains(column, var.lower())
+
+    return matrix
+
+
+def is_text(bot_infos, results):
+    """
+    Return True if all the `results` (list of dicts) have, in every column
+    used by the filters of `bot_infos` (list of dicts), a str or None.
+    """
+    columns = {f['column_name'] for bot_info in bot_infos for f in bot_info['filters']}
+    for result in results:
+        for column in columns:
+            if column not in result or not (result[column] is None or isinstance(result[column], str)):
+                return False
+    return True
+
+
+def select(bot_infos, results):
+    """
+    Return, for each bot_info in `bot_infos` (list of dicts), the list of
+    query `results` (list of dicts) that pass all its filters (in the same
+    order as in `results`).
+    """
+    if len(results) == 0:
+        return [[] for bot_info in bot_infos]
+    if not is_text(bot_infos, results):
+        return km.FilterSets(bot_infos).select(results)
+
+    matrix = match_matrix(bot_infos, pd.DataFrame(results))
+    return [[results[j] for j in np.flatnonzero(line)] for line in matrix]
@@ -1,6 +1,12 @@
 import requests
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 # This project's functions:
 import global_settings as gs
+import http_sessions as hs
 import get_articles_url as gu
 import parse_dou_article as pa
 import write_article as wa
@@ -9,6 +15,11 @@ import structure_article as sa
 import post_to_slack as ps
 
 
+# Per host: semaphore limiting simultaneous GETs and time when the next GET may start:
+host_semaphores = {}
+host_next_start = {}
+host_lock       = threading.Lock()
+
 
 def this_extra_edition_number(edicao):
     """
@@ -50,6 +61,100 @@ def captured_article_ok(save_option, saved, post_option, posted):
     return False
 
 
+def polite_get(session, url, timeout=15):
+    """
+    GET `url` (str) with the requests `session`, with at most `gs.max_per_host`
+    simultaneous GETs to the same host and at least `gs.politeness_delay` 
+    seconds between the start of two GETs to the same host.
+    """
+    host = urlparse(url).netloc
+    
+    with host_lock:
+        if host not in host_semaphores:
+            host_semaphores[host] = threading.Semaphore(gs.max_per_host)
+        semaphore = host_semaphores[host]
+    
+    with semaphore:
+        # Reserve the next start time for this host:
+        with host_lock:
+            now   = time.time()
+            start = max(now, host_next_start.get(host, now))
+            host_next_start[host] = start + gs.politeness_delay
+        time.sleep(max(start - now, 0))
+        
+        try:
+            return session.get(url, timeout=timeout)
+        except requests.exceptions.SSLError:
+            return session.get(url, timeout=timeout, verify=False)
+
+
+def fetch_article(session, url_file):
+    """
+    GET the DOU article at `url_file['url']` using the requests `session`.
+    Returns the response, or None if the GET crashed.
+    """
+    try:
+        return polite_get(session, url_file['url'])
+    # Warn if GET crashes:
+    except requests.exceptions.ReadTimeout:
+        print('ReadTimeout in GET ' + url_file['url'])
+    except requests.exceptions.ConnectTimeout:
+        print('ConnectTimeout in GET ' + url_file['url'])
+    except:
+        print('Error in GET ' + url_file['url'])
+    
+    return None
+
+
+def save_and_register(config, url_file, raw_article):
+    """
+    Write the parsed article `raw_article` (if requested in `config`) and
+    record its URL in the list of captured articles if everything went well.
+    """
+    
+    # Write raw article's file to database:
+    wrote_return = 2   # (Preset status of 'save article' operation)
+    if config['save_articles']:
+        if gs.debug:
+            print("Saving article...")
+        if gs.local:
+            wa.write_local_article(config, raw_article, url_file['filename'])
+            wrote_return = 200
+        else:
+            write_return = wa.write_to_s3(config, raw_article, url_file['filename'])
+            if write_return == 200:
+                wrote_return = wa.copy_s3_to_storage_gcp(config['bucket'], wa.s3_key(config, url_file['filename']))
+                if wrote_return != 200 and gs.debug:
+                    print('Copy_s3_to_storage_gcp failed.') 
+            elif gs.debug:
+                print('Write_to_s3 failed.')
+    
+    # Record URL in list of captured articles (for now, we will assume that the article always was posted):
+    if captured_article_ok(config['save_articles'], wrote_return==200, config['post_articles'], True):
+        gu.register_captured_url(config['url_list'], url_file['url'])
+    elif gs.debug:
+        print('Failed to record as done: ' + url_file['url'])
+
+
+def write_stage(config, to_write, errors):
+    """
+    Take (url_file, raw_article) tuples from the queue `to_write` and save 
+    them with `save_and_register`, until a None is found in the queue.
+    Errors do not stop the other articles from being saved: each one is 
+    appended to the list `errors` as a tuple (url, exception), so the
+    driver can raise it after the writer is done.
+    """
+    while True:
+        task = to_write.get()
+        if task == None:
+            break
+        try:
+            save_and_register(config, *task)
+        except Exception as e:
+            print('Error saving ' + task[0]['url'] + ':', e)
+            errors.append((task[0]['url'], e))
+
+
 def capture_DOU_driver(event):
     """
     This is the driver that runs DOU articles' capture.
@@ -107,94 +212,82 @@ def capture_DOU_driver(event):
     bot_infos = list(filter(lambda bot_info: len(fa.secao_left(config['secao'], bot_info))>0, bot_infos))
     if gs.debug:
         print("Removed " + str(Nfilters - len(bot_infos)) + " filters.")
+    # Compile all filters once, so each article is scanned once for all bots:
+    filter_sets = fa.compile_filters(bot_infos)
 
-    # Specifies number of retries for GET:
-    session = requests.Session()
-    session.mount('http://www.in.gov.br', requests.adapters.HTTPAdapter(max_retries=3))
+    # Shared session (with retries and kept-alive connections) for DOU's host:
+    session = hs.get_session('http://www.in.gov.br')
     
     # The lists inside relevant_articles will receive the articles selected by each filter set:
     relevant_articles = [[]]*len(bot_infos)
     
+    # Articles are processed in three stages running at the same time: 
+    # - GET: `gs.fetch_workers` threads download the articles (politely, see `polite_get`);
+    # - parse & filter: this thread reads the downloads in order, parses and filters them;
+    # - write: a thread takes parsed articles from the `to_write` queue and saves them.
+    to_write     = queue.Queue()
+    write_errors = []
+    writer       = threading.Thread(target=write_stage, args=(config, to_write, write_errors))
+    writer.start()
+    
     # Loop over urls to get articles:
     if gs.debug:
         counter = 0
-        print("LOOP over URLs:")        
-    for url_file in url_file_list:
-        
-        # GET one DOU article:
-        if gs.debug:
-            counter = counter + 1
-            print("Get article...", counter)
-        try:
-            get_ok   = False
-            try:
-                response = session.get(url_file['url'], timeout=15)
-            except requests.exceptions.SSLError:
-                response = session.get(url_file['url'], timeout=15, verify=False)
-            get_ok   = True      
-        # Warn if GET crashes:
-        except requests.exceptions.ReadTimeout:
-            print('ReadTimeout in GET ' + url_file['url'])
-        except requests.exceptions.ConnectTimeout:
-            print('ConnectTimeout in GET ' + url_file['url'])
-        except:
-            print('Error in GET ' + url_file['url'])
-        
-        if get_ok:
-            if response.status_code == 200:
-                # SUCCESS in GET!
+        print("LOOP over URLs:")
+    try:
+        with ThreadPoolExecutor(max_workers=gs.fetch_workers) as fetchers:
+            responses = fetchers.map(lambda url_file: fetch_article(session, url_file), url_file_list)
+            
+            for url_file, response in zip(url_file_list, responses):
                 
-                # Parse article into a flexible structure that reads every key (html tag class) in the file:
+                # GET one DOU article:
                 if gs.debug:
-                    print("Parse article...")
-                raw_article = pa.parse_dou_article(response, url_file['url'])
-
-                # Organize article by capturing selected fields:
-                if gs.debug:
-                    print("Select relevant fields...")        
-                article = sa.structure_article(raw_article)
+                    counter = counter + 1
+                    print("Got article...", counter)
+                if response == None:
+                    continue
                 
-                # Write raw article's file to database:
-                wrote_return = 2   # (Preset status of 'save article' operation)
-                if config['save_articles']:
+                if response.status_code == 200:
+                    # SUCCESS in GET!
+                    
+                    # Parse article into a flexible structure that reads every key (html tag class) in the file:
                     if gs.debug:
-                        print("Saving article...")
-                    if gs.local:
-                        wa.write_local_article(config, raw_article, url_file['filename'])
-                        wrote_return = 200
-                    else:
-                        write_return = wa.write_to_s3(config, raw_article, url_file['filename'])
-                        if write_return == 200:
-                            wrote_return = wa.copy_s3_to_storage_gcp(config['bucket'], config['key'] + url_file['filename'])
-                            if wrote_return != 200 and ds.debug:
-                                print('Copy_s3_to_storage_gcp failed.') 
-                        elif ds.debug:
-                            print('Write_to_s3 failed.')
-                            
-                # Loop over filters:
-                if gs.debug:
-                    print("Filtering article...")
-                for i in range(len(bot_infos)):
-                    # Filter article:
-                    relevant_articles[i] = relevant_articles[i] + fa.get_relevant_articles(bot_infos[i], [article])
-                    # Slack crashes if message has more than 50 blocks.
-                    # Avoid this by pre-posting long messages:
-                    if config['post_articles'] and len(relevant_articles[i]) > 20:
-                        if gs.debug:
-                            print('Selected more than 20 articles.')
-                        ps.post_article(config, bot_infos[i], relevant_articles[i])
-                        relevant_articles[i] = []
-
-                # Record URL in list of captured articles (for now, we will assume that the article always was posted):
-                if captured_article_ok(config['save_articles'], wrote_return==200, config['post_articles'], True):
-                    gu.register_captured_url(config['url_list'], url_file['url'])
-                elif gs.debug:
-                    print('Failed to record as done: ' + url_file['url'])
-                  
-            else:
-                # GET ran but returned BAD STATUS:
-                print('Bad status in GET ' + url_file['url'])  
-    # End of Loop over URLs.
+                        print("Parse article...")
+                    raw_article = pa.parse_dou_article(response, url_file['url'])
+    
+                    # Organize article by capturing selected fields:
+                    if gs.debug:
+                        print("Select relevant fields...")        
+                    article = sa.structure_article(raw_article)
+                    
+                    # Write raw article's file to database and register it as captured:
+                    to_write.put((url_file, raw_article))
+                                
+                    # Loop over filters:
+                    if gs.debug:
+                        print("Filtering article...")
+                    selected = filter_sets.matches(article)
+                    for i in range(len(bot_infos)):
+                        # Filter article:
+                        if selected[i]:
+                            relevant_articles[i] = relevant_articles[i] + [article]
+                        # Slack crashes if message has more than 50 blocks.
+                        # Avoid this by pre-posting long messages:
+                        if config['post_articles'] and len(relevant_articles[i]) > 20:
+                            if gs.debug:
+                                print('Selected more than 20 articles.')
+                            ps.post_article(config, bot_infos[i], relevant_articles[i])
+                            relevant_articles[i] = []
+                      
+                else:
+                    # GET ran but returned BAD STATUS:
+                    print('Bad status in GET ' + url_file['url'])  
+        # End of Loop over URLs.
+    finally:
+        # Wait for all articles to be written:
+        to_write.put(None)
+        writer.join()
+        gu.flush_captured_urls(config['url_list'])
 
     if config['post_articles']:
         # Send the selected articles to Slack:
@@ -202,5 +295,11 @@ def capture_DOU_driver(event):
             if len(relevant_articles[i]) > 0:
                 ps.post_article(config, bot_infos[i], relevant_articles[i])
 
+    # Articles not saved are not registered as captured, so the capture fails
+    # (after posting the selected articles) and they are captured next time:
+    if len(write_errors) > 0:
+        url, error = write_errors[0]
+        raise Exception(str(len(write_errors)) + ' article(s) could not be saved (first: ' + url + ').') from error
+
     # Return the config for next capture try:
     return next_config
@@ -1,36 +1,19 @@
 import json
 import global_settings as gs
+import cloud_clients
+import keyword_matcher as km
 from collections import defaultdict
 
 def query_bigquery(query):
-    import boto3
-    import google.auth
-    from google.cloud import bigquery
     """
     Runs a query in Google BigQuery and returns the result as a list of dicts
     (each line is an element in the list, and each column is an entry in the dict,
     with column names as keys).
     """ 
-    # Get & set Google credentials to fetch filters from BigQuery:
-    s3 = boto3.client('s3')
-    a = s3.get_object(
-                      Bucket='config-lambda', 
-                      Key='layers/google-cloud-storage/gabinete-compartilhado.json')
-    open('/tmp/key.json', 'w').write(a['Body'].read().decode('utf-8'))
-    if gs.local:
-        # Must set this environment variable:
-        import os
-        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = "/tmp/key.json"
-    
-    # Create credentials with Drive & BigQuery API scopes
-    # Both APIs must be enabled for your project before running this code
-    credentials, project = google.auth.default(scopes=[
-        'https://www.googleapis.com/auth/drive',
-        'https://www.googleapis.com/auth/bigquery',
-    ])
+    # BigQuery client with Drive & BigQuery API scopes (reused across invocations):
+    bq = cloud_clients.bigquery_client()
     
     # Run the query:
-    bq = bigquery.Client(credentials=credentials, project=project)
     result = bq.query(query, location="US") # Location must match that of the dataset(s) referenced in the query.
     # Translate the query result into a list of dicts:
     result = [dict(r.items()) for r in result] 
@@ -223,6 +206,17 @@ def secao_left(config_secao, bot_info):
 # End.
 
 
+def compile_filters(bot_infos):
+    """
+    Compile the filters of all `bot_infos` (list of dicts, see
+    get_relevant_articles) into a keyword_matcher.FilterSets, whose 
+    method `matches(article)` returns a list of bools telling which 
+    bot_infos select the article (and `select(articles)` the list of 
+    selected articles for each bot_info).
+    """
+    return km.FilterSets(bot_infos)
+
+
 def get_relevant_articles(bot_info, articles):
     """
     Filter the query result 'articles' that gets the last 30 minutes new stuff
@@ -240,39 +234,13 @@ def get_relevant_articles(bot_info, articles):
     # To combine filters with OR, create a new bot_info with a different list of filters.
     """
     
-    filters = bot_info['filters']
+    if gs.debug and len(bot_info['filters']):
+        print('name:', bot_info['nome'])
+        print('# articles:', len(articles))
     
-    if len(filters):
-        if gs.debug:
-            print('name:', bot_info['nome'])
-            print('# articles:', len(articles))
-
-        # Loop over filters in a filter set:
-        for f in filters:
-           
-            if gs.debug:
-                print('f', f)
-            
-            # Delete None
-            # Select all desired columns that actually exist in the bigquery results:
-            articles = list(filter(lambda x: x[f['column_name']] is not None, articles))
-                
-            if 'positive_filter' in f.keys():
-                articles = list(filter(lambda x: 
-                    any([var.lower() in x[f['column_name']].lower() 
-                        for var in f['positive_filter']]), articles))
-                        
-            # Changed on 2019-05-21 from elif to if:
-            if 'negative_filter' in f.keys():
-                articles = list(filter(lambda x: 
-                    all([var.lower() not in x[f['column_name']].lower() 
-                        for var in f['negative_filter']]), articles))
-
-            Narticles = len(articles)
-            if gs.debug:
-                print('# filtered articles:', Narticles)
-            # Exit early if current filter has already removed all articles:
-            if Narticles == 0:
-                return articles
+    articles = compile_filters([bot_info]).select(articles)[0]
+    
+    if gs.debug and len(bot_info['filters']):
+        print('# filtered articles:', len(articles))
                 
     return articles
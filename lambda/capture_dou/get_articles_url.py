@@ -6,12 +6,22 @@ import json
 import datetime as dt
 import global_settings as gs
 import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import cloudscraper
+import captured_urls as cu
 
 if not gs.local:
     import boto3                                  
     from dynamodb_json import json_util as dyjson
 
+# Scraper shared by all DOU listing requests (and kept between warm invocations):
+scraper      = None
+scraper_lock = threading.Lock()
+# Opening tag of the element holding the listing's JSON:
+params_tag   = re.compile(rb'<[^>]+\bid\s*=\s*["\']params["\'][^>]*>')
+
 
 def daterange(start_date, end_date):
     """
@@ -22,6 +32,40 @@ def daterange(start_date, end_date):
         yield start_date + dt.timedelta(n)
 
 
+def get_scraper():
+    """
+    Return the cloudscraper session used to GET DOU listings, creating
+    it if it does not exist yet.
+    """
+    global scraper
+    with scraper_lock:
+        if scraper == None:
+            # Using cloudscraper as a workaround for the CloudFlare protection:
+            scraper = cloudscraper.create_scraper(delay=10,   browser={'custom': 'ScraperBot/1.0',})
+    return scraper
+
+
+def extract_json_array(content):
+    """
+    Return the 'jsonArray' list found in the element with id="params"
+    in the DOU listing page `content` (bytes). The element's text is
+    located with a direct scan of the page; if that fails, the page is
+    parsed with lxml.
+    """
+    match = params_tag.search(content)
+    if match != None:
+        end = content.find(b'</', match.end())
+        if end != -1:
+            try:
+                return json.loads(content[match.end():end])['jsonArray']
+            except ValueError:
+                pass
+    
+    tree  = html.fromstring(content)
+    xpath = '//*[@id="params"]/text()'
+    return json.loads(tree.xpath(xpath)[0])['jsonArray']
+
+
 def get_artigos_do(data, secao):
     """
     For a date (datetime) 'data' and a DOU section 'secao', 
@@ -43,15 +87,11 @@ def get_artigos_do(data, secao):
     # Example of URL: 'http://www.in.gov.br/leiturajornal?data=13-05-2019&secao=do1'
     url = url_prefix + data_string + url_sec_sel + str(secao)
     
-    # Using cloudscraper as a workaround for the CloudFlare protection:
-    scraper = cloudscraper.create_scraper(delay=10,   browser={'custom': 'ScraperBot/1.0',})
-    res = scraper.get(url)
+    res = get_scraper().get(url)
 
     if res.status_code != 200:
         raise Exception('http GET request failed with code '+str(res.status_code)+'!')
-    tree  = html.fromstring(res.content)
-    xpath = '//*[@id="params"]/text()'
-    return json.loads(tree.xpath(xpath)[0])['jsonArray']
+    return extract_json_array(res.content)
 
 
 def fix_filename(urlTitle):
@@ -71,73 +111,18 @@ def brasilia_day():
     return (dt.datetime.utcnow() + dt.timedelta(hours=-3)).replace(hour=0, minute=0, second=0, microsecond=0)
 
 
-def load_captured_urls_aws(table_name):
-    """
-    Load items from the AWS dynamoDB table `table_name` as entries in a list
-    and return list.
-    """
-    # Pega a referência (pointer) da tabela do dynamo:    
-    dynamodb = boto3.resource('dynamodb')
-    table    = dynamodb.Table(table_name)
-
-    # Get all items (following pagination if necessary):
-    response = table.scan()
-    data = response['Items']
-    while 'LastEvaluatedKey' in response:
-        response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
-        data.extend(response['Items'])
-    
-    # Format data as a list of URLs:
-    url_list = [d['url'] for d in data]
-    
-    return url_list
-
-
-def load_captured_urls_local(filename):
-    """
-    Load lines in the file `filename` as entries in a list
-    and return list. Return empty list if file is not found.
-    """
-    if os.path.isfile(filename) == False:
-        return []
-    
-    with open(filename, 'r') as f:
-        return f.read().splitlines()
-
-
 def load_captured_urls(url_list):
     """
-    Load list of urls from local or remote (AWS) source, according to 
-    global variable gs.local. `url_list` is string that is either 
-    a file path or a DynamoDB table name.
-    """
-    if gs.local:
-        result = load_captured_urls_local(url_list)
-    else:
-        result = load_captured_urls_aws(url_list)
-    return result
-
-
-def register_captured_url_aws(table_name, url):
-    """
-    Put the `url` (str) as a new item in AWS DynamoDB table 
-    `table_name` (str).
-    """
-    # Pega a referência (pointer) da tabela do dynamo:    
-    dynamodb = boto3.resource('dynamodb')
-    table    = dynamodb.Table(table_name)
-
-    # Escreve os dicionários criados pela função generate_body na tabela do dynamo: 
-    with table.batch_writer() as batch:
-        batch.put_item(Item={'url': url})
-        
-
-def register_captured_url_local(filename, url):
-    """
-    Append `url` (str) as a new line to the file `filename`.
+    Load the set of captured urls from local or remote (AWS) source, 
+    according to global variable gs.local. `url_list` is string that 
+    is either a file path or a DynamoDB table name.
+    
+    Returns the `captured_urls.CapturedURLs` store, which supports `in`.
     """
-    with open(filename, 'a') as f:
-        f.write(url + '\n')
+    store = cu.get_store(url_list, gs.local)
+    # Reload, since other invocations might have captured URLs since the last load:
+    store.load()
+    return store
 
 
 def register_captured_url(url_list, url):
@@ -145,41 +130,19 @@ def register_captured_url(url_list, url):
     Append `url` (str) to `url_list`, which is either 
     a local file or an AWS DynamoDB table (according to 
     global variable gs.local).
-    """    
-    if gs.local:
-        register_captured_url_local(url_list, url)
-    else:
-        register_captured_url_aws(url_list, url)
     
-        
-def erase_captured_urls_aws(table_name):
-    """
-    Erase all items found in DynamoDB table with name 
-    `table_name`.
-    """
-    # Pega a referência (pointer) da tabela do dynamo:    
-    dynamodb = boto3.resource('dynamodb')
-    table    = dynamodb.Table(table_name)
-
-    # Get all items (following pagination if necessary):
-    response = table.scan()
-    data = response['Items']
-    while 'LastEvaluatedKey' in response:
-        response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
-        data.extend(response['Items'])
-
-    # Delete all items:
-    with table.batch_writer() as batch:
-        for each in data:
-            batch.delete_item(Key=each)
+    The URLs are written in batches: call `flush_captured_urls`
+    after the last one.
+    """    
+    cu.get_store(url_list, gs.local).add(url)
 
 
-def erase_captured_urls_local(filename):
+def flush_captured_urls(url_list):
     """
-    Erase the contant of `filename`.
+    Write the URLs registered with `register_captured_url` that are 
+    still buffered to `url_list`.
     """
-    with open(filename, 'w') as f:
-        f.write('')
+    cu.get_store(url_list, gs.local).flush()
 
         
 def erase_captured_urls(url_list):
@@ -188,10 +151,7 @@ def erase_captured_urls(url_list):
     might be a local filename or a DynamoDB table name
     (according to global variable gs.local).
     """
-    if gs.local:
-        erase_captured_urls_local(url_list)
-    else:
-        erase_captured_urls_aws(url_list)
+    cu.get_store(url_list, gs.local).erase()
 
         
 def filter_captured_urls(urls_files, url_list_file):
@@ -296,22 +256,22 @@ def get_articles_url(config):
     secoes = secoes if type(secoes) == list else [secoes]
     secoes = [str(s) for s in secoes]
     
-    # LOOP over dates:
-    url_file_list = []
+    # All (date, section) listings to download:
     start_date = end_date + timedelta
+    listings   = [(date, s) for date in daterange(start_date, end_date + dt.timedelta(days=1)) for s in secoes]
+    
+    # Download the listings concurrently (results come in the same order as `listings`):
     if gs.debug == True:
-        print('Will enter loop over config date and section range:')    
-    for date in daterange(start_date, end_date + dt.timedelta(days=1)):
-        if gs.debug == True:
-            print('-- '+date.strftime('%Y-%m-%d'))
-        # LOOP over DOU sections:
-        for s in secoes:
+        print('Will download', len(listings), 'listings for config date and section range...')
+    with ThreadPoolExecutor(max_workers=max(1, min(gs.listing_workers, len(listings)))) as executor:
+        listed = executor.map(lambda listing: get_artigos_do(*listing), listings)
+    
+        # LOOP over dates and DOU sections:
+        url_file_list = []
+        for (date, s), jsons in zip(listings, listed):
             if gs.debug == True:
-                print('   -- s'+str(s))
-            jsons = get_artigos_do(date, s)
+                print('-- '+date.strftime('%Y-%m-%d')+' s'+str(s))
             # LOOP over downloaded URL list:
-            if gs.debug == True:
-                print('      Looping over URLs...')            
             for j in jsons:
                 url      = url_prefix + j['urlTitle']
                 filename = date.strftime('%Y-%m-%d') + '_s' + str(s) + '_' + fix_filename(j['urlTitle']) + '.json'
@@ -1,3 +1,8 @@
 # Global variables (settings):
 local = False   # Specifies if installation uses local or remote (AWS) resources.
 debug = False   # Specifies if we want debugging messages.
+gcp_copy_queue_url = None   # SQS queue URL for copying files to GCP in batches (if None, invoke write-to-storage-gcp per file).
+fetch_workers    = 8     # Number of DOU articles downloaded at the same time.
+max_per_host     = 4     # Maximum number of simultaneous GETs to the same host.
+politeness_delay = 0.1   # Minimum time (in seconds) between the start of two GETs to the same host.
+listing_workers  = 4     # Number of DOU section/date listings downloaded at the same time.
@@ -1,7 +1,10 @@
-from lxml import html
+from lxml import html, etree
 from datetime import datetime
-from collections import defaultdict
 import re
+import structure_article as sa
+
+# Values must have at least one of these characters:
+has_alnum = re.compile('[a-zA-Z0-9]')
 
 
 def select_article(response):
@@ -31,111 +34,66 @@ def branch_text(branch):
     return text
 
 
-def add_to_data(branch, data, key):
-    """
-    Given a dict 'data' and a key, add the text (see branch_text function) 
-    found in a branch to its value.
-    """
-    if key in data:
-        if data[key] is None:
-            data[key] = branch_text(branch)
-        else:
-            data[key] = data[key] + ' | %s' % branch_text(branch)            
-    else:
-        data[key] = branch_text(branch)        
-    return data
-
-
-def recurse_over_nodes(tree, parent_key, data):
+def collect_texts(article):
     """
-    Recursevely gets the text of the html leafs and saves
-    its classes and keys and text as values
+    Walk once (without recursion) over the html elements inside 'article'
+    and collect their texts (see branch_text function) under the path of 
+    their classes (e.g. 'texto-dou_identifica'), in document order.
     
     input: 
-        tree: lxml.html.HtmlElement
-        parent_key: lxml.html.HtmlElement
-        data: dict
-    return: dict
-    """            
-    for branch in tree:
-        key = '-'.join(list(branch.classes))
+        article: lxml.html.HtmlElement
+    return: dict of path (str) -> list of texts (str); paths whose elements
+            have no text get an empty list.
+    """
+    texts = {}
+    # Paths of the elements being visited (None for the article itself):
+    paths = []
+    
+    for event, branch in etree.iterwalk(article, events=('start', 'end')):
+        if event == 'end':
+            paths.pop()
+            continue
+        if branch is article:
+            paths.append(None)
+            continue
         
-        if branch.getchildren():
-            if parent_key:
-                key = '%s_%s' % (parent_key, key)    
-            add_to_data(branch, data, key) 
-            data = recurse_over_nodes(branch, key, data)
+        key = '-'.join(list(branch.classes))
+        if paths[-1]:
+            key = '%s_%s' % (paths[-1], key)
+        paths.append(key)
         
-        else:            
-            if parent_key:
-                key = '%s_%s' % (parent_key, key)            
-            add_to_data(branch, data, key)
+        text  = branch_text(branch)
+        parts = texts.setdefault(key, [])
+        if len(parts) > 0:
+            # Texts used to be concatenated with ' | %s', so missing ones became 'None':
+            parts.append(text if text is not None else 'None')
+        elif text is not None:
+            parts.append(text)
     
-    return data
+    return texts
 
 
-def decode(data, encoding= 'iso-8859-1', decoding='utf8'):
+def decode(text, encoding= 'iso-8859-1', decoding='utf8'):
     """
     Change enconding from string with secure error handling
     
     input:
-        data: dict
+        text: string
         encoding: string
         decoding: string
-    return: dict
-    """    
-    final = {}
-    
-    for k, v in data.items():        
-        try:
-            final[k] = v.encode('iso-8859-1').decode('utf8')
-        except Exception as e:
-            print("Error", e)
-            final[k] = v
-    
-    return final
-
-
-def filter_keys(data):
-    """
-    Filter keys paths to get only last class from html
-    
-    input:
-        data: dict
-    return: dict
-    """
-
-    final = defaultdict(lambda: '')
-
-    for k, v in data.items():
-        if v is not None:            
-            k_new = k.split('_')[-1]
-            final[k_new] =  ' | '.join([final[k_new], v]) if len(final[k_new]) > 0 else v
-            
-    return final
-
-
-def filter_values(data):
-    """
-    Filter values that do not have letters or numbers
-    
-    input:
-        data: dict
-    return: dict
+    return: string
     """    
-    final = {}
-    
-    for k, v in data.items():        
-        if re.search('[a-zA-Z0-9]', v):        
-            final[k] = v
-            
-    return final
+    try:
+        return text.encode(encoding).decode(decoding)
+    except Exception as e:
+        print("Error", e)
+        return text
 
 
 def get_data(article):
     """
-    Get relevant data from html. It recursevely gets leaf text from html
-    and saves theirs classes as keys. 
+    Get relevant data from html. It gets the text from html elements in a
+    single pass and saves theirs classes as keys. 
     It also creates an item in dict's key 'full-text' with all text 
     in the html, without tags.
     
@@ -143,15 +101,21 @@ def get_data(article):
         article: lxml.html.HtmlElement
     return: dict
     """
-    data = recurse_over_nodes(article, None, {})
-
-    # filtra None e melhora keys
-    data = filter_keys(data)
-    data = filter_values(data)
-    data = {k: v for k,v in data.items() if len(k) != 0}
-
-    # encoding para utf-8
-    data = decode(data)
+    # Keep only the last class in the path as key, joining the texts of 
+    # paths with the same last class:
+    joined = {}
+    for path, parts in collect_texts(article).items():
+        if len(parts) == 0:
+            continue
+        key   = path.split('_')[-1]
+        value = ' | '.join(parts)
+        joined[key] = joined[key] + ' | ' + value if len(joined.get(key, '')) > 0 else value
+    
+    # Filter out empty keys and values without letters or numbers, and encode to utf-8:
+    data = {}
+    for key, value in joined.items():
+        if len(key) != 0 and has_alnum.search(value):
+            data[key] = decode(value)
     
     # Include full-text:
     try:
@@ -210,7 +174,7 @@ def structure_data(data, url, article):
         data: dict
         url: string
         artigo: lxml.html.HtmlElement
-    return: list of dict
+    return: sa.ArticleRecords (list of dict)
     """    
     url_certificado = get_url_certificado(article)
     
@@ -218,7 +182,7 @@ def structure_data(data, url, article):
     for key, value in data.items():        
         final.append(data_schema(key, value, url, url_certificado))
         
-    return final
+    return sa.ArticleRecords(final)
         
 
 def parse_dou_article(response, url):
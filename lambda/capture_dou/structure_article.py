@@ -1,13 +1,37 @@
+class ArticleRecords(list):
+    """
+    List of dicts with keywords key, value, capture_date, url and 
+    url_certificado that represent a DOU article (this list is what gets
+    saved to storage), along with the dict `fields` that maps each key to 
+    its value, for direct access to the article's fields.
+    """
+    __slots__ = ('fields',)
+    
+    def __init__(self, records=()):
+        super().__init__(records)
+        self.fields = {}
+        for record in self:
+            # If a key is repeated, keep the first value:
+            self.fields.setdefault(record['key'], record['value'])
+
+
+def article_fields(article_raw):
+    """
+    Return a dict from the keys to the values in the DOU article 
+    'article_raw' (an ArticleRecords or a list of dicts).
+    """
+    if isinstance(article_raw, ArticleRecords):
+        return article_raw.fields
+    return ArticleRecords(article_raw).fields
+
+
 def get_key_value(key, article_raw):
     """
     Searches for an entry in article_raw (which is a list of dicts) that
     has the 'key'. Then it returns the value associated to that key. 
     If the key is not found, return None.
     """ 
-    sel = list(filter(lambda d: d['key']==key, article_raw))
-    if len(sel)==0:
-        return None
-    return sel[0]['value']
+    return article_fields(article_raw).get(key)
 
 
 def make_resumo(fulltext):
@@ -60,7 +84,8 @@ def structure_article(article_raw):
                      'edicao', 'italico', 'ementa', 'strong', 'ato_orgao', 'subtitulo', 
                      'paragraph', 'pub_date', 'assinaPr', 'fulltext']
     
-    relevant_values = [get_key_value(key, article_raw) for key in relevant_keys]
+    fields          = article_fields(article_raw)
+    relevant_values = [fields.get(key) for key in relevant_keys]
     struct = dict(zip(new_keys, relevant_values))
     
     # Join with identifying fields:
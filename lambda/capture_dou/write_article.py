@@ -1,13 +1,31 @@
 import json
 import datetime as dt
 import os
+import threading
 import global_settings as gs
+import output_formats as of
+import structure_article as sa
 
 from botocore.exceptions import EndpointConnectionError
 
 if not gs.local:
     import boto3
 
+# AWS clients, created once under a lock (boto3's default session is not 
+# thread-safe and articles are written in a separate thread):
+aws_clients = {}
+aws_lock    = threading.Lock()
+
+
+def get_client(service):
+    """
+    Return the (cached) boto3 client for the AWS `service` (str).
+    """
+    with aws_lock:
+        if service not in aws_clients:
+            aws_clients[service] = boto3.client(service)
+    return aws_clients[service]
+
 
 def last_slash(path):
     """
@@ -24,15 +42,15 @@ def get_pub_date(article_raw):
     returns a string that states the article's date of publication. If the hard-coded key 
     is not found, return capture date instead (with the 'capt' prefix).
     """
-    # Find dict in list that contains publication date:
-    pub_date_entry = list(filter(lambda d: d['key']=='publicado-dou-data', article_raw))
+    # Find publication date:
+    fields = sa.article_fields(article_raw)
     
-    if len(pub_date_entry)==0:
+    if 'publicado-dou-data' not in fields:
         # If no publication date was found, use capture date instead
         pub_date_entry = 'capt_' + article_raw[0]['capture_date'].split()[0]
     else:
         # If it was found, format it to '%Y-%m-%d':
-        pub_date_entry = dt.datetime.strptime(pub_date_entry[0]['value'], '%d/%m/%Y').strftime('%Y-%m-%d')
+        pub_date_entry = dt.datetime.strptime(fields['publicado-dou-data'], '%d/%m/%Y').strftime('%Y-%m-%d')
     
     return pub_date_entry
 
@@ -66,10 +84,20 @@ def write_local_article(config, article_raw, filename):
         json.dump(article_raw, f)
 
 
+def s3_key(config, filename):
+    """
+    Return the AWS S3 key (str) for the article's file `filename` (str),
+    given the path (key) and output format set in `config` (dict).
+    """
+    return of.output_key(config['key'] + filename, of.get_format(config))
+
+
 def write_to_s3(config, article_raw, filename):
     """
     Given the input:
-    * config      -- a dict that contains the S3 bucket and path for the article (key);
+    * config      -- a dict that contains the S3 bucket and path for the article (key),
+                     and optionally its 'output_format' and 'output_schema' 
+                     (see output_formats);
     * article_raw -- a list of dicts that stores the information in an article;
     * filename    -- the name for the article's file.    
     It prepares a json ('body') and save it to AWS S3. It returns the S3 
@@ -84,15 +112,15 @@ def write_to_s3(config, article_raw, filename):
     # (json is a string):
     print ('Creating json list...')
     result = [json.dumps(record, ensure_ascii=False) for record in article_raw] 
-    # Cria um arquivo texto com vários jsons:
-    body = '\n'.join(result)
+    # Cria um arquivo texto com vários jsons (no formato de output pedido):
+    body = of.encode_lines(result, of.get_format(config), of.get_schema(config))
     
     # Salva no S3 os jsons:
-    client = boto3.client('s3')
+    client = get_client('s3')
     s3_log = client.put_object(
                   Body=body,
                   Bucket=config['bucket'], 
-                  Key=config['key']+filename)
+                  Key=s3_key(config, filename))
     
     return s3_log['ResponseMetadata']['HTTPStatusCode']
 
@@ -104,12 +132,24 @@ def copy_s3_to_storage_gcp(bucket, key):
     - 'key': the "file path" of the file.
     
     This function calls the lambda function that copies the file from AWS
-    to GCP storage.
+    to GCP storage (or, if `gs.gcp_copy_queue_url` is set, sends the file to 
+    the queue of files that write-to-storage-gcp copies in batches).
     """
     
     params = {'bucket': bucket, 'key': key}
     
-    lambd = boto3.client('lambda')
+    if gs.gcp_copy_queue_url != None:
+        if gs.debug:
+            print('Queueing copy to GCP storage...')
+        try:
+            sqs = get_client('sqs')
+            sqs.send_message(QueueUrl=gs.gcp_copy_queue_url, MessageBody=json.dumps(params))
+        except(EndpointConnectionError):
+            print('Failed to queue copy to GCP storage')
+            return 2
+        return 200
+    
+    lambd = get_client('lambda')
     
     if gs.debug:
         print('Invoking write-to-storage-gcp...')
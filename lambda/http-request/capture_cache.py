@@ -0,0 +1,124 @@
+"""
+Small key-value cache with information about the last capture of each
+URL (e.g. its ETag and Last-Modified validators and the next page link),
+so http-request can send conditional GETs and skip unchanged data. It
+also holds the hash of the content last saved to each S3 file (with keys
+like 's3://<bucket>/<key>'), to avoid saving identical data again.
+
+Entries are dicts of str values, stored in the DynamoDB table
+`cache_table` (hash key 'url'). If `local` is True or the table does
+not exist, entries are kept in memory instead (i.e. only during the
+Lambda container's life). Other DynamoDB errors (e.g. throttling or
+missing permissions) are logged and that call uses the in-memory cache
+(the next calls try DynamoDB again): `get` returns the entry saved in
+memory, if any, so the capture proceeds with a normal GET otherwise.
+"""
+
+import threading
+from urllib.parse import urlencode
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+# DynamoDB table holding the cache:
+cache_table = 'capture-cache'
+# Keep the cache in memory instead of DynamoDB:
+local = False
+
+# In-memory cache (used when `local` is True, the table does not exist or DynamoDB fails):
+memory      = {}
+# DynamoDB client (created once, under a lock, since boto3's default session is not thread-safe):
+dynamodb    = None
+client_lock = threading.Lock()
+
+
+def get_dynamodb():
+    """
+    Return the DynamoDB client, or None if the in-memory cache is in use.
+    """
+    global dynamodb
+    if local:
+        return None
+    with client_lock:
+        if dynamodb == None:
+            dynamodb = boto3.session.Session().client('dynamodb')
+    return dynamodb
+
+
+def use_memory(error):
+    """
+    Switch to the in-memory cache after the DynamoDB `error`.
+    """
+    global local
+    print('Capture cache table not available, using memory instead:', error)
+    local = True
+
+
+def cache_key(event):
+    """
+    Return the cache key (str) for the GET described in `event`: its url
+    followed by its query parameters, if any.
+    """
+    if event.get('params'):
+        return event['url'] + '?' + urlencode(sorted(event['params'].items()))
+    return event['url']
+
+
+def get(url):
+    """
+    Return the cache entry (dict) for `url` (str), or None if there is none.
+    """
+    client = get_dynamodb()
+    if client != None:
+        try:
+            response = client.get_item(TableName=cache_table, Key={'url': {'S': url}})
+        except client.exceptions.ResourceNotFoundException as e:
+            use_memory(e)
+        except (ClientError, BotoCoreError) as e:
+            print('Could not read capture cache for ' + url + ' (using memory):', e)
+        else:
+            if 'Item' not in response:
+                return None
+            return {name: value['S'] for name, value in response['Item'].items() if name != 'url'}
+
+    with client_lock:
+        entry = memory.get(url)
+        return None if entry == None else dict(entry)
+
+
+def update(url, values):
+    """
+    Set the entries in `values` (dict of str; None values are removed) in
+    the cache entry for `url` (str), keeping the entry's other values.
+    """
+    to_set    = {name: value for name, value in values.items() if value != None}
+    to_remove = [name for name, value in values.items() if value == None]
+
+    client = get_dynamodb()
+    if client != None:
+        names      = {'#a' + str(i): name for i, name in enumerate(list(to_set) + to_remove)}
+        aliases    = {name: alias for alias, name in names.items()}
+        expression = []
+        if len(to_set) > 0:
+            expression.append('SET ' + ', '.join([aliases[name] + ' = :' + aliases[name][1:] for name in to_set]))
+        if len(to_remove) > 0:
+            expression.append('REMOVE ' + ', '.join([aliases[name] for name in to_remove]))
+        if len(expression) == 0:
+            return
+        try:
+            kwargs = dict(TableName=cache_table, Key={'url': {'S': url}},
+                          UpdateExpression=' '.join(expression), ExpressionAttributeNames=names)
+            if len(to_set) > 0:
+                kwargs['ExpressionAttributeValues'] = {':' + aliases[name][1:]: {'S': str(value)}
+                                                       for name, value in to_set.items()}
+            client.update_item(**kwargs)
+            return
+        except client.exceptions.ResourceNotFoundException as e:
+            use_memory(e)
+        except (ClientError, BotoCoreError) as e:
+            print('Could not update capture cache for ' + url + ' (using memory):', e)
+
+    with client_lock:
+        entry = memory.setdefault(url, {})
+        entry.update({name: str(value) for name, value in to_set.items()})
+        for name in to_remove:
+            entry.pop(name, None)
@@ -1,5 +1,5 @@
-import requests
 from bs4 import BeautifulSoup
+import http_sessions
 
 
 def html_table_to_dict_list(soup_table):
@@ -153,9 +153,8 @@ def get_folha_remuneracao_data(comissionado_url):
         their values (float).
     """
 
-    # Start session:
-    session = requests.Session()
-    session.mount('https://', requests.adapters.HTTPAdapter(max_retries=3))
+    # Reuse the session (with retries and kept-alive connections) for camara's host:
+    session = http_sessions.get_session(comissionado_url)
 
     # Use Beatiful soup to find salary table in a comissionado's page:
     response         = session.get(comissionado_url, timeout=5)
@@ -1,20 +1,66 @@
 import json
+import hashlib
+import time
 import requests
 import boto3
-from botocore.exceptions import EndpointConnectionError
+from botocore.exceptions import EndpointConnectionError, ClientError
 import xmltodict
-from collections import MutableMapping
+from collections.abc import MutableMapping
 from datetime import datetime
-from dynamodb_json import json_util as dyjson 
 import re
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 sys.path.insert(0, "external_modules")
 import importlib
+import http_sessions
+import s3_aggregator
+import output_formats
+import work_queue
+import capture_cache
+import captured_urls
 
 # For debugging (print out more comments during execution):
 debug = True
 # To run it locally (not in AWS), set to True:
 local = False
+# To copy files to GCP in batches, set to the SQS queue URL drained by write-to-storage-gcp
+# (if None, write-to-storage-gcp is invoked once per file):
+gcp_copy_queue_url = None
+
+# Allow conditional GETs (with the ETag and Last-Modified of the last capture, see 
+# `capture_cache`), skipping data that was not modified, for the captures that 
+# set 'conditional_get' to true in their config (set to False to turn them all off):
+conditional_get = True
+
+# Skip saving data identical to the last capture saved to the same S3 key (if the
+# file is still there), for the captures that set 'deduplicate' to true in their
+# config (set to False to turn it off for all captures):
+deduplicate     = True
+# Status returned by `write_to_s3` when the data is identical to the last capture:
+unchanged_status = 304
+
+# Defaults for batch mode (when `params` has a 'batch_size'):
+default_max_workers  = 8       # Number of items downloaded concurrently.
+default_max_per_host = 4       # Maximum number of simultaneous GETs to the same host.
+min_remaining_ms     = 120000  # Do not start a new batch if the Lambda has less time than this left.
+default_chunk_size   = 10      # Number of orders claimed at a time in shared cursor mode.
+
+# boto3's default session is not thread-safe, so clients are created under a lock
+# and reused afterwards (clients themselves are thread-safe):
+aws_clients = {}
+aws_lock    = threading.Lock()
+
+# Number of files skipped (unchanged) and written per capture name, for the
+# deduplication metric (see `emit_dedup_metrics`):
+dedup_counts = {}
+dedup_lock   = threading.Lock()
+
+# Semaphores that limit the number of simultaneous GETs to each host, keyed by
+# host and limit (events with different 'max_per_host' get their own semaphore):
+host_semaphores = {}
+host_lock       = threading.Lock()
 
 
 def get_nested_dict(data, keys):
@@ -24,6 +70,30 @@ def get_nested_dict(data, keys):
         data = data[key]
     
     return data
+
+
+def get_client(service):
+    """
+    Return a cached boto3 client for `service` (str), e.g. 's3' or 'lambda'.
+    The client is created only once, under a lock, so it can be safely 
+    shared by the threads in batch mode.
+    """
+    with aws_lock:
+        if service not in aws_clients:
+            aws_clients[service] = boto3.client(service)
+    return aws_clients[service]
+
+
+def host_semaphore(url, max_per_host):
+    """
+    Return the semaphore that limits the number of simultaneous 
+    GETs to the host in `url` (str) to `max_per_host` (int).
+    """
+    key = (urlparse(url).netloc, max_per_host)
+    with host_lock:
+        if key not in host_semaphores:
+            host_semaphores[key] = threading.BoundedSemaphore(max_per_host)
+    return host_semaphores[key]
     
     
 def add_url_and_capture_date(in_json, event):
@@ -191,9 +261,11 @@ def filter_data(event, data):
     return in_json, save_to_s3
 
         
-def response_to_dict_list(event, response):
+def response_to_dict_list(event, response, data=None):
     """
-    Translate the GET response to a list of dictionaries.
+    Translate the GET response to a list of dictionaries. If the 
+    `response` was already parsed by `load_as_json`, the parsed `data` 
+    can be passed to avoid parsing it again.
     """
     # Caso o dado seja de um tipo especial (e.g. html do DOU):
     if event['data_type'] == 'external_module':
@@ -211,8 +283,9 @@ def response_to_dict_list(event, response):
         
     # Caso o dado seja dos dados abertos do congresso e tal:
     else:   
-        # Prepara o arquivo baixado (response) em json:
-        data = load_as_json(event, response)
+        # Prepara o arquivo baixado (response) em json (se ainda não foi feito):
+        if data is None:
+            data = load_as_json(event, response)
     
         # Seleciona os dados desejados e joga outros fora:
         # (in_json é uma lista de dicionários).
@@ -221,19 +294,96 @@ def response_to_dict_list(event, response):
     return in_json, save_to_s3
 
 
-def write_to_s3(event, response):
+def records_hash(in_json):
+    """
+    Return a hash (str) of the records `in_json` (list of dicts), ignoring 
+    their 'capture_date' (which changes on every capture) and the order of 
+    their keys.
+    """
+    content = hashlib.sha256()
+    for record in in_json:
+        normalized = {key: value for key, value in record.items() if key != 'capture_date'} \
+                     if isinstance(record, dict) else record
+        content.update(json.dumps(normalized, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8'))
+        content.update(b'\n')
+    
+    return content.hexdigest()
+
+
+def count_dedup(name, unchanged):
+    """
+    Count one file of the capture `name` (str) as `unchanged` (bool) or written.
+    """
+    with dedup_lock:
+        counts = dedup_counts.setdefault(name, [0, 0])
+        counts[0 if unchanged else 1] = counts[0 if unchanged else 1] + 1
+
+
+def emit_dedup_metrics():
+    """
+    Print (in CloudWatch's Embedded Metric Format, so CloudWatch turns them 
+    into metrics) the number of files skipped because they were unchanged 
+    and the number of files written, per capture name, since the last call.
+    """
+    with dedup_lock:
+        counts = dict(dedup_counts)
+        dedup_counts.clear()
+    
+    for name, (n_unchanged, n_written) in counts.items():
+        print(json.dumps({'_aws': {'Timestamp': int(time.time() * 1000),
+                                   'CloudWatchMetrics': [{'Namespace': 'capturaAWS/http-request',
+                                                          'Dimensions': [['name']],
+                                                          'Metrics': [{'Name': 'UnchangedFiles', 'Unit': 'Count'},
+                                                                      {'Name': 'WrittenFiles', 'Unit': 'Count'}]}]},
+                          'name': name, 'UnchangedFiles': n_unchanged, 'WrittenFiles': n_written}))
+
+
+def finish_invocation():
+    """
+    Save buffered records (aggregation mode) to S3 and buffered captured 
+    URLs to DynamoDB, and emit metrics. Must be called before the 
+    invocation ends.
+    """
+    s3_aggregator.flush_all()
+    captured_urls.flush_all()
+    emit_dedup_metrics()
+
+
+def saved_object_exists(event, etag):
+    """
+    Return True if the S3 file described in `event` exists and has the 
+    ETag `etag` (str) saved after the last capture, i.e. it was not deleted
+    or overwritten since then.
+    """
+    if etag == None:
+        return False
+    
+    try:
+        head = get_client('s3').head_object(Bucket=event['bucket'], Key=event['key'])
+    except ClientError as e:
+        if debug:
+            print('Last capture not found in S3:', e)
+        return False
+    
+    return head.get('ETag') == etag
+
+
+def write_to_s3(event, response, data=None):
     """
     Teoricamente deveriam ser duas funções:
     -- Select data;
     -- Prepare data;
     -- To json;
     -- write to s3 mesmo.
+    
+    Retorna o status code do S3, ou `unchanged_status` se os dados são iguais
+    aos da última captura salva no mesmo key (nesse caso, não salva nada).
     """
     if debug:
         print(event['bucket'], event['key'])
     
     # Translate the response from GET to a list of dictionaries:
-    in_json, save_to_s3 = response_to_dict_list(event, response)
+    in_json, save_to_s3 = response_to_dict_list(event, response, data)
     
     # Se não for pra salvar ou dados estiverem vazios, vai embora:
     if not save_to_s3:
@@ -252,13 +402,40 @@ def write_to_s3(event, response):
         print ('Creating json list...')
     result = [json.dumps(record, ensure_ascii=False) for record in in_json] 
     
-    # Cria um arquivo texto com vários jsons:
-    body = '\n'.join(result)
+    # Aggregation mode: buffer the jsons to be saved with other items' jsons 
+    # in a single S3 file (see s3_aggregator):
+    if event.get('aggregate') != None:
+        if debug:
+            print('Buffering records for aggregated S3 file...')
+        writer = s3_aggregator.get_writer(event['bucket'], event['aggregate']['prefix'], 
+                                          event['aggregate'].get('max_bytes'),
+                                          output_formats.get_format(event),
+                                          output_formats.get_schema(event),
+                                          on_flush=copy_aggregated)
+        writer.add(event.get('url'), event['key'], result, event['aux_data'].get('url_list'))
+        return 200
+    
+    # Compare with the last capture saved to the same key:
+    dedup = deduplicate and event.get('deduplicate') == True
+    if dedup:
+        location = 's3://' + event['bucket'] + '/' + event['key']
+        content_hash = records_hash(in_json)
+        last_capture = capture_cache.get(location)
+        if last_capture != None and last_capture.get('content_hash') == content_hash and \
+           saved_object_exists(event, last_capture.get('etag')):
+            if debug:
+                print('Data unchanged since last capture: do not save to S3.')
+            count_dedup(event.get('name'), True)
+            return unchanged_status
+    
+    # Cria um arquivo texto com vários jsons (no formato de output pedido,
+    # e.g. comprimido ou parquet):
+    body = output_formats.encode_lines(result, output_formats.get_format(event), output_formats.get_schema(event))
     
     # Salva no S3 os jsons:
     if debug:
         print('Putting object in S3 bucket...')
-    client = boto3.client('s3')
+    client = get_client('s3')
     s3_log = client.put_object(
                   Body=body,
                   Bucket=event['bucket'], 
@@ -266,37 +443,81 @@ def write_to_s3(event, response):
     if debug:
         print('s3_log:', s3_log)
     
+    # Remember the content saved (and the S3 object's ETag):
+    if dedup and s3_log['ResponseMetadata']['HTTPStatusCode'] == 200:
+        capture_cache.update(location, {'content_hash': content_hash, 'etag': s3_log.get('ETag')})
+        count_dedup(event.get('name'), False)
+    
     return s3_log['ResponseMetadata']['HTTPStatusCode']
 
 
 def load_params(event):
     """
-    Pega no dynamo um dicionário especificado pelo order no 
-    event.
+    Pega na fila de trabalho (ver `work_queue`) um dicionário especificado 
+    pelo order no event.
     
     Sample input : dict
-        {'dynamo_table_name': 'temp-capture-camara-tramitacoes-live-2020-06-23-16-30-26', 'order': 5}
-        (the dict containing the DynamoDB temp table and the Item's key 'order')
+        {'queue_backend': 'temp_table', 'queue_id': 'temp-capture-camara-tramitacoes-live-2020-06-23-16-30-26-0', 'order': 5}
+        or {'dynamo_table_name': 'temp-capture-camara-tramitacoes-live-2020-06-23-16-30-26', 'order': 5}
+        (the dict describing the work queue and the Item's key 'order')
     """
-    # Similar a um Client de dynamo, para acessar as tabelas:
-    dynamodb = boto3.resource('dynamodb')
-    
-    # Pega a tabela do dynamo especificada em event:
-    table = dynamodb.Table(event['dynamo_table_name'])
+    # A fila (e seu client) é reutilizada entre chamadas:
+    queue = work_queue.get_queue(work_queue.get_backend(event))
     
-    # Pega a "linha" da tabela do dynamo dada pela 'order' no `event`: 
-    # (linha é um dicionário, na verdade):
-    response = table.get_item(Key={'order': event['order']})
-
-    # Carrega o dicionário para `response`:
-    response = dyjson.loads(response)
+    # Pega o item da fila dado pela 'order' no `event`: 
+    # (item é um dicionário):
+    item = queue.get_item(work_queue.get_queue_id(event), event['order'])
+    if item == None:
+        raise Exception('Item ' + str(event['order']) + ' not found in queue ' + str(work_queue.get_queue_id(event)) + '.')
     
-    # Além do item, o .get_item também devolve metadados. Aqui 
-    # pegamos apenas o item mesmo:
-    return response['Item']
+    return item
     # Essa função retorna um dicionário com estrutura similar a descrita 
     # no docstring da função `lambda_handler`, na parte "For testing purposes".
 
+
+def batch_load_params(params, orders):
+    """
+    Load from the work queue described in `params` the items whose keys are 
+    listed in `orders` (list of ints), in as few requests as possible.
+    
+    Returns a list of items (dicts like the one returned by `load_params`) 
+    in the same order as `orders`. Missing items are returned as None.
+    """
+    queue = work_queue.get_queue(work_queue.get_backend(params))
+    
+    return queue.get_items(work_queue.get_queue_id(params), orders)
+
+
+def order_ranges(first_order, batch_size):
+    """
+    Generator of the lists of orders (ints) to be captured in batch mode, 
+    from `first_order` down to 0, each one with at most `batch_size` orders.
+    """
+    for start in range(first_order, -1, -batch_size):
+        yield list(range(start, max(start - batch_size, -1), -1))
+
+
+def prefetch_params(params, ranges):
+    """
+    Generator that yields, for each list of orders in `ranges`, a tuple 
+    with that list and the corresponding items in the DynamoDB temp table. 
+    While the caller processes one list, the items for the next one are
+    loaded in the background, so downloads never wait for DynamoDB.
+    """
+    ranges = iter(ranges)
+    orders = next(ranges, None)
+    if orders == None:
+        return
+    
+    with ThreadPoolExecutor(max_workers=1) as loader:
+        future = loader.submit(batch_load_params, params, orders)
+        for next_orders in ranges:
+            events = future.result()
+            future = loader.submit(batch_load_params, params, next_orders)
+            yield orders, events
+            orders = next_orders
+        yield orders, future.result()
+
   
 def copy_s3_to_storage_gcp(order, bucket, key):
     """
@@ -306,11 +527,24 @@ def copy_s3_to_storage_gcp(order, bucket, key):
     - 'key': the "file path" of the file.
     
     This function calls the lambda function that copies the file from AWS
-    to GCP storage.
+    to GCP storage (or, if `gcp_copy_queue_url` is set, sends the file to 
+    the queue of files that write-to-storage-gcp copies in batches).
     """
     params = {'order': order, 'bucket': bucket, 'key': key}
     
-    lambd = boto3.client('lambda')
+    lambd = get_client('lambda')
+    
+    if params['order'] >= 0 and gcp_copy_queue_url != None:
+        if debug:
+            print('Queueing copy to GCP storage...')
+        try:
+            get_client('sqs').send_message(QueueUrl=gcp_copy_queue_url, 
+                                           MessageBody=json.dumps({'bucket': bucket, 'key': key}))
+        except(EndpointConnectionError):
+            print('Failed to queue copy to GCP storage')
+            return 2
+        
+        return 200
     
     if params['order'] >= 0:
         if debug:
@@ -330,23 +564,223 @@ def copy_s3_to_storage_gcp(order, bucket, key):
     # order < 0:
     print('Should never get here')
     return 3
+
+
+def copy_aggregated(bucket, key, manifest):
+    """
+    Called by `s3_aggregator` after an aggregated file `key` (str) is written
+    to the AWS S3 `bucket` (str): copy it to GCP storage and, if successful, 
+    register as captured the urls in its `manifest` (list of dicts) that 
+    have a 'url_list'.
+    """
+    status_code_gcp = copy_s3_to_storage_gcp(0, bucket, key)
+    
+    for entry in manifest:
+        if entry.get('url_list') == None:
+            continue
+        if status_code_gcp == 200:
+            captured_urls.get_store(entry['url_list']).add(entry['url'])
+        elif debug:
+            print('Capture failed for ' + entry['url'])
+    
+
+def use_validators(event):
+    """
+    Return True if conditional GETs are requested (and can be used) for the 
+    capture described in `event`. External modules get the data themselves 
+    and aggregated items do not have their own file, so they always download 
+    the data.
+    """
+    return conditional_get and event.get('conditional_get') == True and 'url' in event.keys() and \
+           event['data_type'] != 'external_module' and event.get('aggregate') == None
+
+
+def load_validators(event):
+    """
+    Return the `capture_cache` entry (dict) of the last capture of the url in
+    `event`, if it can be used for a conditional GET (i.e. it was saved to the
+    same key), or None otherwise.
+    """
+    if not use_validators(event):
+        return None
+    
+    validators = capture_cache.get(capture_cache.cache_key(event))
+    if validators == None or validators.get('key') != event['key']:
+        return None
     
+    return validators
 
-def register_captured_url_aws(table_name, url):
+
+def conditional_headers(headers, validators):
+    """
+    Return a copy of the HTTP `headers` (dict or None) with the conditional 
+    GET headers for the ETag and Last-Modified in `validators` (dict or None,
+    see `load_validators`).
     """
-    Put the `url` (str) as a new item in AWS DynamoDB table 
-    `table_name` (str).
+    if validators == None:
+        return headers
     
-    The purpose of this function is to keep track of files (urls) already
-    downloaded.
+    headers = dict(headers) if headers != None else {}
+    if 'etag' in validators:
+        headers['If-None-Match'] = validators['etag']
+    if 'last_modified' in validators:
+        headers['If-Modified-Since'] = validators['last_modified']
+    
+    return headers
+
+
+def store_validators(event, response, validators, next_page):
+    """
+    Save to `capture_cache` the ETag and Last-Modified of the `response` to 
+    the GET described in `event`, along with the `next_page` (dict or None, 
+    see `get_next_page`) so it can be followed even if this page is not 
+    modified next time. `validators` are the ones used in the GET (or None).
     """
-    # Pega a referência (pointer) da tabela do dynamo:    
-    dynamodb = boto3.resource('dynamodb')
-    table    = dynamodb.Table(table_name)
+    if not use_validators(event) or response == None:
+        return
+    
+    etag          = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    # Nothing to validate with (and nothing to update):
+    if etag == None and last_modified == None and validators == None:
+        return
+    
+    capture_cache.update(capture_cache.cache_key(event), 
+                         {'key': event['key'], 'etag': etag, 'last_modified': last_modified, 
+                          'next_url': next_page['url'] if next_page != None else None,
+                          'next_key': next_page['key'] if next_page != None else None})
+
+
+def download(params, event, validators=None):
+    """
+    Send the HTTP GET request described in `event` (see `get_and_save`) and 
+    return its response, or None if `event` does not have an 'url' (e.g. tweets).
+    If `validators` (see `load_validators`) are given, the GET is conditional
+    and the response status may be 304 (not modified).
+    """
+    
+    # Pega o arquivo especificado pelo url no event:
+    if 'url' in event.keys():
+        if debug:
+            print('GET file...')
+        # Reuse the session (with retries and kept-alive connections) for this host:
+        session = http_sessions.get_session(event['url'])
+        # Limit the number of simultaneous GETs to the same host (batch mode):
+        with host_semaphore(event['url'], params.get('max_per_host', default_max_per_host)):
+            try:
+                response = session.get(event['url'], 
+                                       params=event['params'], 
+                                       headers=conditional_headers(event['headers'], validators), # configs para HTTP GET.
+                                       timeout=30)
+            except requests.exceptions.SSLError:
+                response = session.get(event['url'], 
+                                       params=event['params'], 
+                                       headers=conditional_headers(event['headers'], validators), # configs para HTTP GET.
+                                       timeout=30,
+                                       verify=False)
+
+    # Algumas capturas (e.g. tweets) não possuem url. Nesse caso, apenas 
+    # continua abaixo:
+    else:
+        response = None
+    
+    return response
+
+
+def parse_response(event, response):
+    """
+    Parse the `response` from `download` with `load_as_json` so it can be 
+    used both to save the data and to look for the next page. Returns None 
+    if the data is not parsed this way (external modules, failed GETs and 
+    captures without url).
+    """
+    if response == None or response.status_code != 200 or event['data_type'] == 'external_module':
+        return None
+    
+    return load_as_json(event, response)
+
+
+def fetch(params, event):
+    """
+    Same as `download`, but the GET is conditional if the url was captured 
+    before (see `load_validators`). Returns the response and the validators 
+    used (or None).
+    """
+    validators = load_validators(event)
+    
+    return download(params, event, validators), validators
+
+
+def register_url(event):
+    """
+    Register the url in `event` as captured in the table (or file) 
+    `event['aux_data']['url_list']`, if there is one.
+    """
+    # Registra url capturado em tabela do dynamo, se tal ação for requisitada.
+    # Isso acontece no caso da captura de matérias do DOU. O motivo para 
+    # guardarmos quais matérias foram baixadas é que as matérias podem ser 
+    # publicadas em horários diferentes e o site do DOU pode sair do ar.
+    # Para não perder nenhuma matéria, vamos registrando quais do dia de hoje 
+    # já baixamos:
+    if 'url_list' in event['aux_data'].keys():
+        if debug:
+            print('Register sucessful capture on table' + event['aux_data']['url_list'])
+        captured_urls.get_store(event['aux_data']['url_list']).add(event['url'])
+
+
+def save(params, event, response, data=None):
+    """
+    Save the `response` from `download` (or its already parsed version 
+    `data`) to AWS S3 and Google Storage, and register the captured url 
+    if requested. See `get_and_save` for a description of the inputs.
+    
+    Returns True if the data was saved to both AWS S3 and Google Storage.
+    """
+        
+    # Se captura ocorreu bem ou se ainda vai capturar (no caso sem url),
+    # salva na AWS S3 e Google Storage:
+    if response == None or (response != None and response.status_code == 200):
+        if debug:
+            if response != None:
+                print('GET successful. Writing to S3...')
+            else:
+                print('Will obtain non-http-get data...')
+        # Salva arquivo baixado no S3 (Amazon), além de outras coisas:
+        # (também registra o destino do arquivo)
+        status_code_s3 = write_to_s3(event, response, data)
+        if debug:
+            print('write_to_s3 status code:', status_code_s3)
+        
+        # Same data as the last capture (already in S3 and GCP):
+        if status_code_s3 == unchanged_status:
+            register_url(event)
+            return True
+
+        # Aggregated records are only buffered: the file is copied to GCP 
+        # and the url registered after the file is written (see `copy_aggregated`):
+        if event.get('aggregate') != None:
+            return status_code_s3 == 200
+
+        # Copy the result to GCP storage:
+        status_code_gcp = 10
+        if status_code_s3 == 200:
+            status_code_gcp = copy_s3_to_storage_gcp(params['order'], event['bucket'], event['key'])
+
+        # Registra url capturado (ver `register_url`):
+        if status_code_gcp == 200:
+            register_url(event)
+        elif debug and 'url_list' in event['aux_data'].keys():
+            print('Capture failed for ' + event['url'])
 
-    # Registra o `url` como um novo item na tabela do DynamoDB: 
-    with table.batch_writer() as batch:
-        batch.put_item(Item={'url': url})
+        return status_code_s3 == 200 and status_code_gcp == 200
+
+    # Not modified since the last capture (conditional GET), which was saved:
+    if response.status_code == 304:
+        register_url(event)
+        return False
+
+    # TODO: colocar como lidar com erros no GET.
+    return False
 
 
 def get_and_save(params, event):
@@ -385,77 +819,22 @@ def get_and_save(params, event):
     `event['key']` (in bucket `event['bucket']`).
     """ 
     
-    # Set max_retries for HTTP GET to 3 (instead of one):
-    # This makes the download more robust.
-    session = requests.Session()
-    session.mount('http', requests.adapters.HTTPAdapter(max_retries=3))
-    
     # Pega o arquivo especificado pelo url no event:
-    if 'url' in event.keys():
-        if debug:
-            print('GET file...')
-        try:
-            response = session.get(event['url'], 
-                                   params=event['params'], 
-                                   headers=event['headers'], # configs para HTTP GET.
-                                   timeout=30)
-        except requests.exceptions.SSLError:
-            response = session.get(event['url'], 
-                                   params=event['params'], 
-                                   headers=event['headers'], # configs para HTTP GET.
-                                   timeout=30,
-                                   verify=False)
-
-    # Algumas capturas (e.g. tweets) não possuem url. Nesse caso, apenas 
-    # continua abaixo:
-    else:
-        response = None
-        
-    # Se captura ocorreu bem ou se ainda vai capturar (no caso sem url),
-    # salva na AWS S3 e Google Storage:
-    if response == None or (response != None and response.status_code == 200):
-        if debug:
-            if response != None:
-                print('GET successful. Writing to S3...')
-            else:
-                print('Will obtain non-http-get data...')
-        # Salva arquivo baixado no S3 (Amazon), além de outras coisas:
-        # (também registra o destino do arquivo)
-        status_code_s3 = write_to_s3(event, response)
-        if debug:
-            print('write_to_s3 status code:', status_code_s3)
-
-        # Copy the result to GCP storage:
-        status_code_gcp = 10
-        if status_code_s3 == 200:
-            status_code_gcp = copy_s3_to_storage_gcp(params['order'], event['bucket'], event['key'])
-
-        # Registra url capturado em tabela do dynamo, se tal ação for requisitada.
-        # Isso acontece no caso da captura de matérias do DOU. O motivo para 
-        # guardarmos quais matérias foram baixadas é que as matérias podem ser 
-        # publicadas em horários diferentes e o site do DOU pode sair do ar.
-        # Para não perder nenhuma matéria, vamos registrando quais do dia de hoje 
-        # já baixamos:
-        if 'url_list' in event['aux_data'].keys():
-            if status_code_gcp == 200:
-                if debug:
-                    print('Register sucessful capture on table' + event['aux_data']['url_list'])
-                register_captured_url_aws(event['aux_data']['url_list'], event['url'])
-            elif debug:
-                print('Capture failed for ' + event['url'])
-
-        # TODO: colocar como lidar com erros no GET.
+    response = download(params, event)
+    
+    # Salva na AWS S3 e Google Storage:
+    save(params, event, response)
     
     # Retorna a resposta do http GET para poder pegar as próximas levas (páginas)
     # dos dados, caso eles estejam paginados (como é o caso da API da câmara):
     return response
     
 
-def get_next_page(event, response):
+def get_next_page(event, raw_data):
     """
     Input:
     - 'event':    a dict with all info about the data to be captured and saved;
-    - 'response': a response from a HTTP GET request.
+    - 'raw_data': the response from a HTTP GET request, parsed by `parse_response`.
     
     For APIs that return paginated data, get from the last request response the 
     next page to be downloaded.
@@ -468,11 +847,8 @@ def get_next_page(event, response):
     if debug:
         print('Checking for pagination in data.')
     
-    # Parse JSON:
-    raw_data = load_as_json(event, response)
-    
     # Case Dados Abertos da câmara dos deputados:
-    if 'links' in raw_data.keys():
+    if isinstance(raw_data, dict) and 'links' in raw_data.keys():
         
         # Look for next page link:
         next_url_set = {d['href'] for d in filter(lambda d: d['rel'] == 'next', raw_data['links'])}
@@ -481,8 +857,10 @@ def get_next_page(event, response):
         # If found, get link and set its key:
         elif len(next_url_set) == 1:
             next_url = list(next_url_set)[0]
-            page_num = re.search('pagina=(\d+)', next_url).group(1)
-            next_key = re.sub('(_p\d+)?\.json', '_p' + page_num + '.json', event['key'])
+            page_num = re.search(r'pagina=(\d+)', next_url).group(1)
+            # Page number goes before the file extension (see output_formats), e.g. 
+            # 'x.json.gz' -> 'x_p2.json.gz' and 'x_p2.parquet' -> 'x_p3.parquet':
+            next_key = re.sub(r'(_p\d+)?(\.json\.gz|\.json\.zst|\.json|\.parquet)$', '_p' + page_num + r'\2', event['key'])
             
             return {'key': next_key, 'url': next_url}
     
@@ -493,7 +871,7 @@ def get_next_page(event, response):
 def call_next_step(params):
     """
     According to the configuration in params:
-    -- If this is the last entry in dynamo temp table, finish and delete temp table;
+    -- If this is the last entry in the work queue, finish and delete the queue;
     -- Else, restart the process (call Lambda 'http-request') with lower order
        (order = order - 1)
     (next GET target).
@@ -507,22 +885,26 @@ def call_next_step(params):
     """
     
     # Instantiate a Lambda client (to call a Lambda function):
-    lambd = boto3.client('lambda')
+    lambd = get_client('lambda')
     
-    # If this is the last Item, delete temp table:
+    # If this is the last Item, delete the work queue:
     if params['order'] <= 0:
         
         # debug:
         #return 0
         
         if debug:
-            print('Deleting DynamoDB')
+            print('Deleting work queue')
         
         # Call delete dynamodb table (temp):
-        lambd.invoke(
-            FunctionName='arn:aws:lambda:us-east-1:085250262607:function:dynamodb-delete-table:JustLambda',
-            InvocationType='Event',
-            Payload=json.dumps(params))    
+        if work_queue.get_backend(params) == 'temp_table':
+            lambd.invoke(
+                FunctionName='arn:aws:lambda:us-east-1:085250262607:function:dynamodb-delete-table:JustLambda',
+                InvocationType='Event',
+                Payload=json.dumps(params))    
+        # Other backends are cleaned right here (no table to delete):
+        else:
+            work_queue.get_queue(work_queue.get_backend(params)).delete(work_queue.get_queue_id(params))
     
     # If this is not the last Item in the dynamoDB table, get the next one.
     else:
@@ -544,11 +926,240 @@ def call_next_step(params):
              Payload=json.dumps(params))    
 
             
+def capture_event(params, event):
+    """
+    Download the data described in `event` (dict loaded from the DynamoDB
+    temp table) and save it to AWS S3 and Google Storage, following the 
+    pagination of the data if there is one. `params` is the dict with the 
+    DynamoDB temp table name and the item's 'order'.
+    """
+    
+    # Download data (conditional GET if captured before):
+    response, validators = fetch(params, event)
+    
+    # A API dos dados abertos da Câmara retorna os dados paginados (máximo de 
+    # 100 dados por vez, se não me engano. Se for esse caso, pega próximas
+    # páginas até esgotar os dados solicitados. Cada página é lida (parsed) uma
+    # única vez, e a próxima página é baixada enquanto a atual é salva:
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        while True:
+            # Not modified since the last capture: nothing to parse or save, 
+            # but the next pages (known from the last capture) may have changed:
+            if response != None and response.status_code == 304 and validators != None:
+                if debug:
+                    print('Not modified:', event['url'])
+                data      = None
+                next_page = None
+                if validators.get('next_url') != None:
+                    next_page = {'url': validators['next_url'], 'key': validators['next_key']}
+            else:
+                data      = parse_response(event, response)
+                next_page = get_next_page(event, data)
+            
+            # Start downloading the next page:
+            if next_page != None:
+                next_event = dict(event, key=next_page['key'], url=next_page['url'])
+                next_fetch = prefetcher.submit(fetch, params, next_event)
+            
+            # Save current page to AWS and GCP (and remember its validators):
+            if save(params, event, response, data):
+                store_validators(event, response, validators, next_page)
+            
+            if next_page == None:
+                break
+            event = next_event
+            response, validators = next_fetch.result()
+
+
+def capture_order_safely(params, event):
+    """
+    Same as `capture_event`, but print any error instead of raising it, 
+    so one failed item does not stop the other items in a batch.
+    """
+    try:
+        capture_event(params, event)
+    except Exception as e:
+        print('Capture failed for order', params['order'], ':', e)
+
+
+def remaining_ms(context):
+    """
+    Return the number of milliseconds left before the Lambda `context` 
+    times out, or None if running locally (without a Lambda context).
+    """
+    if hasattr(context, 'get_remaining_time_in_millis'):
+        return context.get_remaining_time_in_millis()
+    return None
+
+
+def capture_batch(params, context):
+    """
+    Batch mode: instead of capturing a single item and invoking this Lambda 
+    again, claim the range of 'order' keys from `params['order']` down to 
+    `params['order'] - params['batch_size'] + 1` in the DynamoDB temp table
+    and capture them concurrently (at most `params['max_workers']` at a time 
+    and at most `params['max_per_host']` simultaneous GETs to the same host). 
+    
+    While there is enough time left in the Lambda `context`, keep claiming 
+    the next ranges. The `params['order']` is updated after each range 
+    (checkpoint) so `call_next_step` continues from where this invocation 
+    stopped.
+    
+    Sample input
+    ------------
+    
+    params : dict
+        {'dynamo_table_name': 'temp-capture-camara-tramitacoes-live-2020-06-23-16-30-26', 'order': 500,
+         'batch_size': 100, 'max_workers': 8, 'max_per_host': 4}
+    """
+    
+    batch_size  = params['batch_size']
+    max_workers = params.get('max_workers', default_max_workers)
+    
+    # Claim ranges of orders (the items of the next range are prefetched from 
+    # DynamoDB while the current range is being captured):
+    for orders, events in prefetch_params(params, order_ranges(params['order'], batch_size)):
+        if debug:
+            print('Capturing orders', orders[0], 'to', orders[-1])
+        
+        # Capture the items concurrently:
+        work = [(dict(params, order=order), event) for order, event in zip(orders, events) if event != None]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda item: capture_order_safely(*item), work))
+        
+        # Checkpoint: the lowest order already captured.
+        params['order'] = orders[-1]
+        
+        # Stop if there is not enough time for another range:
+        time_left = remaining_ms(context)
+        if time_left != None and time_left < min_remaining_ms:
+            break
+    
+    return params
+    
+    
+def capture_shared(params, context):
+    """
+    Shared cursor mode: many invocations of this Lambda (workers) capture the 
+    same work queue. Each worker claims the next `params['chunk_size']` orders 
+    (see `work_queue.claim`), captures them concurrently (as in `capture_batch`) 
+    and claims again, until all `params['n_items']` orders are claimed. So a 
+    slow chunk only delays its own worker, and the others keep taking the 
+    remaining work.
+    
+    Each claimed chunk has a lease of `params['lease_seconds']` seconds: chunks 
+    of workers that stopped before finishing them (e.g. timed out) are claimed 
+    again when their lease expires. The worker that claims the first chunk past 
+    the end of the queue becomes the watcher: it waits for the unfinished chunks 
+    and claims the ones whose lease expires, so the queue is always completed.
+    
+    The worker that finishes the last item deletes the queue. A worker with 
+    little time left invokes a new one to continue in its place.
+    
+    Sample input
+    ------------
+    
+    params : dict
+        {'queue_backend': 'partitioned', 'queue_id': 'capture-dou-live-2020-06-23-16-30-26-0',
+         'scheduler': 'shared_cursor', 'chunk_size': 10, 'n_items': 2000, 
+         'max_workers': 8, 'max_per_host': 4}
+    """
+    
+    queue       = work_queue.get_queue(work_queue.get_backend(params))
+    queue_id    = work_queue.get_queue_id(params)
+    n_items     = params['n_items']
+    chunk_size  = params.get('chunk_size', default_chunk_size)
+    max_workers = params.get('max_workers', default_max_workers)
+    lease_time  = params.get('lease_seconds', work_queue.lease_seconds)
+    
+    while True:
+        # Claim the next chunk (or one whose lease expired):
+        start, lease = work_queue.claim(queue, queue_id, chunk_size, n_items, lease_time)
+        if start >= n_items:
+            # Only the watcher waits for the chunks still being captured:
+            if params.get('watcher') != True and start != work_queue.n_chunks(n_items, chunk_size) * chunk_size:
+                if debug:
+                    print('No more items to claim in', queue_id)
+                return
+            params['watcher'] = True
+            if not wait_for_leases(params, context, queue, chunk_size):
+                return
+            continue
+        orders = list(range(start, min(start + chunk_size, n_items)))
+        if debug:
+            print('Capturing orders', orders[0], 'to', orders[-1])
+        
+        # Capture the items concurrently:
+        events = batch_load_params(params, orders)
+        work   = [(dict(params, order=order), event) for order, event in zip(orders, events) if event != None]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda item: capture_order_safely(*item), work))
+        
+        # The worker that completes the queue deletes it (if the lease was lost, 
+        # the chunk is reported by the worker that claimed it again):
+        n_done = work_queue.mark_done(queue, queue_id, start, chunk_size, lease, len(orders))
+        if n_done != None and n_done >= n_items:
+            if debug:
+                print('Deleting work queue', queue_id)
+            if work_queue.get_backend(params) == 'temp_table':
+                get_client('lambda').invoke(
+                    FunctionName='arn:aws:lambda:us-east-1:085250262607:function:dynamodb-delete-table:JustLambda',
+                    InvocationType='Event',
+                    Payload=json.dumps(params))
+            else:
+                queue.delete(queue_id)
+            return
+        
+        # Pass the remaining work to a new worker if there is not enough time for another chunk:
+        time_left = remaining_ms(context)
+        if time_left != None and time_left < min_remaining_ms:
+            if debug:
+                print('Invoking a new worker for', queue_id)
+            get_client('lambda').invoke(
+                FunctionName='arn:aws:lambda:us-east-1:085250262607:function:http-request:JustLambda',
+                InvocationType='Event',
+                Payload=json.dumps(params))
+            return
+
+
+def wait_for_leases(params, context, queue, chunk_size):
+    """
+    Used by the watcher in shared cursor mode (see `capture_shared`): wait 
+    until the first lease of the unfinished chunks of the queue in `params` 
+    expires (or while there is time left in the Lambda `context`). Returns 
+    False if there is nothing to wait for (all chunks are finished) or if 
+    there is no time left: in this case, a new watcher is invoked.
+    """
+    queue_id = work_queue.get_queue_id(params)
+    pending  = work_queue.pending_leases(queue, queue_id, chunk_size, params['n_items'])
+    if len(pending) == 0:
+        return False
+    
+    # Wait at most until there is just enough time left to capture a chunk:
+    wait      = max(min(pending) - time.time() + 1, 0)
+    time_left = remaining_ms(context)
+    if time_left != None:
+        if time_left <= min_remaining_ms:
+            if debug:
+                print('Invoking a new watcher for', queue_id)
+            get_client('lambda').invoke(
+                FunctionName='arn:aws:lambda:us-east-1:085250262607:function:http-request:JustLambda',
+                InvocationType='Event',
+                Payload=json.dumps(params))
+            return False
+        wait = min(wait, (time_left - min_remaining_ms) / 1000)
+    
+    if debug:
+        print('Waiting', wait, 's for unfinished chunks of', queue_id)
+    time.sleep(wait)
+    return True
+
+
 def lambda_handler(params, context):
     """
     Downloads the data mentioned in an Item identified by the key 'order' of a 
-    DynamoDB's temp table (created by Lambda function 'parametrize-API-requests').
-    The temp table and 'order' are described in `params`. The data is saved 
+    work queue (see `work_queue`, created by Lambda function 'parametrize-API-requests').
+    The queue and 'order' are described in `params`. The data is saved 
     to AWS S3 and Google Storage. In some rarer cases, the data is processed by 
     python scripts in folder `external_modules` before saving it. 
     
@@ -556,8 +1167,9 @@ def lambda_handler(params, context):
     ------------
     
     params : dict
-        {'dynamo_table_name': 'temp-capture-camara-tramitacoes-live-2020-06-23-16-30-26', 'order': 5}
-        (the dict containing the DynamoDB temp table and the Item's key 'order')
+        {'queue_backend': 'temp_table', 'queue_id': 'temp-capture-camara-tramitacoes-live-2020-06-23-16-30-26-0', 'order': 5}
+        (the dict containing the work queue and the Item's key 'order'; old payloads with
+        only 'dynamo_table_name' refer to a DynamoDB temp table)
     
         For testing purposes, the `params` input can be the dict that would be stored 
         in a DynamoDB table item, directly, e.g.:
@@ -575,52 +1187,65 @@ def lambda_handler(params, context):
         "records_keys": None,
         "url": "https://www.camara.leg.br/deputados/137070/pessoal-gabinete?ano=2020"}
     
-    context : empty dict 
-        {} (not used)
+        If `params` contains 'batch_size', runs in batch mode (see `capture_batch`).
+        If `params['scheduler']` is 'shared_cursor', runs as one of many workers 
+        sharing the same queue (see `capture_shared`).
+        Items with an 'aggregate' entry are buffered and saved to S3 together with 
+        other items, in larger files (see `s3_aggregator`).
+    
+    context : Lambda context or empty dict 
+        Only used in batch mode, to check the remaining execution time.
     """
     
     print(params)
     
+    # Shared cursor mode (workers claim chunks of the queue until it is exhausted;
+    # there is no chain of invocations to continue):
+    if params.get('scheduler') == 'shared_cursor':
+        try:
+            capture_shared(params, context)
+        except Exception as e:
+            print(e)
+        finish_invocation()
+        return
+    
     # Para poder identificar os erros que acontecerão no dynamo:
-    dynamo_exceptions = boto3.client('dynamodb').exceptions
+    dynamo_exceptions = get_client('dynamodb').exceptions
         
     try:
-        # Input `params` default (temp table):
-        if 'dynamo_table_name' in params.keys():           
+        # Batch mode (capture many items concurrently in this invocation):
+        if work_queue.get_queue_id(params) != None and 'batch_size' in params.keys():
             if debug:
-                print('Loading params from dynamo temp table...')
-            # Carrega dicionário do dynamo:
-            event = load_params(params)
-        # For debugging:
-        else:
-            if debug:
-                print('Assuming `params` is a typical data in dynamo temp table item.')
-            # Se não existe referência à tabela no dynamo, assume que esse é o próprio dicionário
-            # (opção para debugging):
-            event = params
-            params = {'order': 0}
-
-        # Download data and save it to AWS and GCP:
-        response  = get_and_save(params, event)
+                print('Batch mode: capturing', params['batch_size'], 'items at a time...')
+            params = capture_batch(params, context)
         
-        # A API dos dados abertos da Câmara retorna os dados paginados (máximo de 
-        # 100 dados por vez, se não me engano. Se for esse caso, pega próximas
-        # páginas até esgotar os dados solicitados:
-        next_page = get_next_page(event, response)
-        # While there are more pages, get it and repeat the capture process:
-        while next_page != None:
-            # Update event for next page:
-            event['key'] = next_page['key']
-            event['url'] = next_page['url']
-    
-            # Get next page of data:
-            response  = get_and_save(params, event)
-            next_page = get_next_page(event, response) 
+        else:
+            # Input `params` default (work queue):
+            if work_queue.get_queue_id(params) != None:           
+                if debug:
+                    print('Loading params from work queue...')
+                # Carrega dicionário do dynamo:
+                event = load_params(params)
+                # Aggregated files are only written in batch or shared cursor mode:
+                if event.get('aggregate') != None:
+                    raise Exception("Config error: 'aggregate' requires batch mode or the 'shared_cursor' scheduler.")
+            # For debugging:
+            else:
+                if debug:
+                    print('Assuming `params` is a typical data in dynamo temp table item.')
+                # Se não existe referência à tabela no dynamo, assume que esse é o próprio dicionário
+                # (opção para debugging):
+                event = params
+                params = {'order': 0}
+
+            # Download data (all pages) and save it to AWS and GCP:
+            capture_event(params, event)
     
     # Possível erro: não encontrou a tabela temp no DynamoDB:
     except dynamo_exceptions.ResourceNotFoundException:
         
         print('DynamoDB Table does not exist')    
+        finish_invocation()
         return # force exit 
     
     # Algum outro possível erro:
@@ -629,6 +1254,9 @@ def lambda_handler(params, context):
         # Raise error somewhere, maybe slack
         print(e)
 
+    # Save buffered records (aggregation mode) to S3 and emit metrics:
+    finish_invocation()
+
     # A função abaixo chama este Lambda recursivamente, reduzindo o key 'order',
     # até esgotar todos os arquivos listados na tabela temp do DynamoDB:
     call_next_step(params)
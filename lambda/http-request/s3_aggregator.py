@@ -0,0 +1,188 @@
+"""
+Aggregated writing of captured data to AWS S3.
+
+Instead of one small nJSON file per captured item, the records of many
+items (with the same destination prefix) are buffered and written as
+size-bounded objects (in the requested output format, see `output_formats`). Large objects are sent with S3 multipart
+upload. For each object, a manifest (also nJSON) is written under
+`manifest_root` mapping each source URL to the lines that hold its
+records in the object. The URLs of the items (to be registered as
+captured, see `captured_urls`) are only known to be saved after their
+object is written, so the manifest entries are passed to the `on_flush`
+callback.
+
+This is meant to be used in http-request's batch mode (many items per
+invocation). The buffers must be flushed with `flush_all` before the
+invocation ends.
+"""
+
+import io
+import json
+import threading
+import uuid
+from datetime import datetime
+import boto3
+from boto3.s3.transfer import TransferConfig
+import output_formats
+
+# Default maximum size of an aggregated object, in bytes:
+default_max_bytes   = 64 * 1024 ** 2
+# Objects larger than this are sent with multipart upload:
+multipart_threshold = 8 * 1024 ** 2
+# Manifests are saved under this root + the data prefix:
+manifest_root       = 'manifests/'
+
+# Writers, keyed by (bucket, prefix, output format):
+writers      = {}
+writers_lock = threading.Lock()
+
+# S3 client (created once, under a lock, since boto3's default session is not thread-safe):
+s3_client    = None
+client_lock  = threading.Lock()
+
+
+class AggregatedWriter:
+    """
+    Buffer nJSON lines of many captured items that go to the same S3 `bucket`
+    and `prefix`, and write them to a new object whenever the buffer reaches
+    `max_bytes` (measured before encoding the lines in `output_format`,
+    with the parquet `column_types`, see `output_formats`).
+    After each object is written, `on_flush(bucket, key, manifest)` is
+    called (if provided), e.g. to copy it to Google Storage and register
+    the URLs in `manifest` (list of dicts, one per item) as captured.
+    """
+
+    def __init__(self, bucket, prefix, max_bytes=default_max_bytes, output_format='njson', column_types=None,
+                 on_flush=None):
+        self.bucket    = bucket
+        self.prefix    = prefix
+        self.max_bytes = max_bytes
+        self.format    = output_format
+        self.types     = column_types
+        self.on_flush  = on_flush
+        self.lock      = threading.Lock()
+        self.lines     = []
+        self.manifest  = []
+        self.n_bytes   = 0
+        self.n_objects = 0
+
+    def add(self, url, key, lines, url_list=None):
+        """
+        Add the nJSON `lines` (list of str) captured from `url` (str) to the
+        buffer. `key` (str) is the S3 key the item would have if it were not
+        aggregated, and is also recorded in the manifest. `url_list` (str) is
+        the store of captured URLs where `url` should be registered once the
+        object is written (or None).
+        """
+        with self.lock:
+            first_line = len(self.lines)
+            self.lines.extend(lines)
+            self.n_bytes = self.n_bytes + sum(len(line.encode('utf-8')) + 1 for line in lines)
+            entry = {'url': url, 'key': key, 'first_line': first_line, 'last_line': len(self.lines) - 1}
+            if url_list != None:
+                entry['url_list'] = url_list
+            self.manifest.append(entry)
+            buffered = self.take() if self.n_bytes >= self.max_bytes else None
+        # Other threads keep adding to the (new) buffer during the upload:
+        if buffered != None:
+            self.write(*buffered)
+
+    def flush(self):
+        """
+        Write the buffered lines (if any) to S3. Returns the key of the
+        object written (or None).
+        """
+        with self.lock:
+            buffered = self.take()
+        if buffered == None:
+            return None
+        return self.write(*buffered)
+
+    def take(self):
+        """
+        Empty the buffer and return its lines, manifest and object number
+        (or None, if it is empty). Must be called with `self.lock` acquired.
+        """
+        if len(self.lines) == 0:
+            return None
+
+        self.n_objects = self.n_objects + 1
+        buffered       = (self.lines, self.manifest, self.n_objects)
+        self.lines     = []
+        self.manifest  = []
+        self.n_bytes   = 0
+
+        return buffered
+
+    def write(self, lines, manifest, number):
+        """
+        Write the `lines` (list of str) taken from the buffer to a new S3 
+        object (the `number`-th one, an int) and its `manifest` (list of 
+        dicts), and call `on_flush`. Returns the object's key.
+        """
+        # Name for the aggregated object:
+        name = '_'.join(['aggregated', datetime.strftime(datetime.now(), '%Y-%m-%d-%H-%M-%S'),
+                         uuid.uuid4().hex[:8], str(number)]) + '.json'
+        key  = output_formats.output_key(self.prefix + name, self.format)
+
+        # Write data:
+        put_object(self.bucket, key, output_formats.encode_lines(lines, self.format, self.types))
+
+        # Write manifest (line numbers are record numbers in parquet files):
+        manifest = [dict(entry, object=key) for entry in manifest]
+        content  = '\n'.join([json.dumps(entry, ensure_ascii=False) for entry in manifest])
+        put_object(self.bucket, manifest_root + key, content.encode('utf-8'))
+
+        if self.on_flush != None:
+            self.on_flush(self.bucket, key, manifest)
+
+        return key
+
+
+def put_object(bucket, key, body):
+    """
+    Save `body` (bytes) to `key` in S3 `bucket`, using multipart upload
+    if it is larger than `multipart_threshold`.
+    """
+    global s3_client
+    with client_lock:
+        if s3_client == None:
+            s3_client = boto3.client('s3')
+    client = s3_client
+
+    if len(body) < multipart_threshold:
+        client.put_object(Body=body, Bucket=bucket, Key=key)
+    else:
+        config = TransferConfig(multipart_threshold=multipart_threshold,
+                                multipart_chunksize=multipart_threshold)
+        client.upload_fileobj(io.BytesIO(body), bucket, key, Config=config)
+
+
+def get_writer(bucket, prefix, max_bytes=None, output_format='njson', column_types=None, on_flush=None):
+    """
+    Return the `AggregatedWriter` for `bucket`, `prefix` and `output_format`,
+    creating it if needed. Raise an error if the writer already exists with 
+    other `max_bytes`, `column_types` or `on_flush` (e.g. two captures with 
+    the same prefix and different parquet schemas).
+    """
+    max_bytes = max_bytes if max_bytes != None else default_max_bytes
+    with writers_lock:
+        if (bucket, prefix, output_format) not in writers:
+            writers[(bucket, prefix, output_format)] = AggregatedWriter(bucket, prefix, max_bytes, output_format,
+                                                                        column_types, on_flush)
+        writer = writers[(bucket, prefix, output_format)]
+
+    if (writer.max_bytes, writer.types, writer.on_flush) != (max_bytes, column_types, on_flush):
+        raise Exception('Aggregated writer for s3://' + bucket + '/' + prefix + ' (' + output_format + 
+                        ') already exists with other max_bytes, output_schema or on_flush.')
+    return writer
+
+
+def flush_all():
+    """
+    Write the buffered lines of all writers to S3.
+    """
+    with writers_lock:
+        all_writers = list(writers.values())
+    for writer in all_writers:
+        writer.flush()
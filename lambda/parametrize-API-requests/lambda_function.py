@@ -1,22 +1,30 @@
 import boto3
 from dynamodb_json import json_util as dyjson 
-from pyathena import connect
-from datetime import timedelta, date, datetime
+from datetime import timedelta, date, datetime, timezone
 from collections import defaultdict
 import time
 import json
 import random
+import re
 import sys
-import google.auth
-from google.cloud import bigquery
 import os
 sys.path.insert(0, "external_modules")
 import importlib
+from concurrent.futures import ThreadPoolExecutor
+import output_formats
+import cloud_clients
+import work_queue
 
 # Switch for printing messages to log:
 debug = True
 # Wheter this code is ran locally or on AWS:
 local = False
+# Number of items claimed at a time by each http-request worker (shared cursor scheduler):
+default_chunk_size = 10
+# Maximum number of items held in memory for each queue before writing them:
+write_chunk_size = 500
+# Time (ms) kept for writing the queues and invoking http-request after waiting for the queues to be created:
+queue_margin_ms = 60000
 
 
 def query_bigquery(query):
@@ -25,23 +33,8 @@ def query_bigquery(query):
     a list of dictionaries.
     """
     
-    if local:
-        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = '/tmp/key.json'
-    
-    # Get key for accessing BigQuery:
-    s3 = boto3.client('s3')
-    a  = s3.get_object(
-                  Bucket='config-lambda', 
-                  Key='layers/google-cloud-storage/gabinete-compartilhado.json')
-    open('/tmp/key.json', 'w').write(a['Body'].read().decode('utf-8'))
-
-    # Create credentials with Drive & BigQuery API scopes
-    # Both APIs must be enabled for your project before running this code
-    credentials, project = google.auth.default(scopes=[
-        'https://www.googleapis.com/auth/drive',
-        'https://www.googleapis.com/auth/bigquery',
-    ])
-    bq = bigquery.Client(credentials=credentials, project=project)
+    # BigQuery client with Drive & BigQuery API scopes (reused across invocations):
+    bq = cloud_clients.bigquery_client()
         
     result = bq.query(
         query,
@@ -54,84 +47,170 @@ def query_bigquery(query):
     return result
 
 
-def forms_bigquery(par, item, forms):
+def query_bigquery_columns(query):
+    """
+    Runs a `query` (str) on Google BigQuery, fetching the results in bulk
+    (Arrow format). Returns a tuple: the list of column names and a dict
+    from column name to the list of values in that column.
+    """
+    
+    # BigQuery client with Drive & BigQuery API scopes (reused across invocations):
+    bq = cloud_clients.bigquery_client()
+    
+    # Location must match that of the dataset(s) referenced in the query:
+    table = bq.query(query, location="US").to_arrow()
+    
+    return table.column_names, table.to_pydict()
+
+
+def query_athena_columns(query):
+    """
+    Runs a `query` (str) on AWS Athena, fetching the results in bulk with
+    pyathena's ArrowCursor (or with the default cursor, in older pyathena
+    versions). Returns a tuple: the list of column names and a dict from
+    column name to the list of values in that column.
+    """
+    
+    try:
+        from pyathena.arrow.cursor import ArrowCursor
+    except ImportError:
+        ArrowCursor = None
+    
+    # Conecta à Athena com pacote do Joe (conexão reutilizada entre chamadas):
+    if ArrowCursor != None:
+        table = cloud_clients.athena_cursor(ArrowCursor).execute(query).as_arrow()
+        return table.column_names, table.to_pydict()
+    
+    cursor = cloud_clients.athena_cursor()
+    data   = cursor.execute(query).fetchall()
+    names  = [column[0] for column in cursor.description]
+    values = list(zip(*data)) if len(data) > 0 else [()] * len(names)
+    
+    return names, {name: list(column) for name, column in zip(names, values)}
+
+
+def count_rows(columns):
+    """
+    Return the number of rows in `columns` (dict from column name to list 
+    of values).
+    """
+    if len(columns) == 0:
+        return 0
+    return len(next(iter(columns.values())))
+
+
+def fill_template(template, columns):
+    """
+    Return the list of strings `template % row` for each row in `columns`
+    (dict from column name to list of values), where `row` is the dict of 
+    that row's values.
+    
+    Templates that only have fields like '%(name)s' are filled column by 
+    column (each column is converted to str once). Other templates (with 
+    other format specifiers) are filled row by row.
+    """
+    
+    n_rows = count_rows(columns)
+    pieces = re.split(r'%\((\w+)\)s', template)
+    # `pieces` alternate between literal text and field names:
+    literals, fields = pieces[0::2], pieces[1::2]
+    
+    if any('%' in literal for literal in literals) or any(field not in columns for field in fields):
+        names = list(columns.keys())
+        return [template % dict(zip(names, row)) for row in zip(*columns.values())]
+    
+    result = [literals[0]] * n_rows
+    for field, literal in zip(fields, literals[1:]):
+        result = [r + value + literal for r, value in zip(result, map(str, columns[field]))]
+    
+    return result
+
+
+def join_columns(url_params, values, n_rows, sep):
+    """
+    Return, for each of the `n_rows` (int) rows, the string 
+    '<param 1>=<value 1><sep><param 2>=<value 2>...', where the parameter
+    names come from `url_params` (list of str) and the values from `values` 
+    (list of columns, each one a list of values), in the same order.
+    """
+    parts = [[str(param) + '=' + str(value) for value in column] for param, column in zip(url_params, values)]
+    if len(parts) == 0:
+        return [''] * n_rows
+    
+    return [sep.join(row) for row in zip(*parts)]
+
+
+def forms_bigquery(par, item):
     """
     Faz um query no Google BigQuery e usa os resultados para 
-    construir uma lista de URLs e filenames (destino).
+    gerar URLs e filenames (destino), um dicionário por linha.
     """
        
     # Substitui parâmetros de input na query:
     query = par['query'] % par['query_config']
     
-    # Executa a query:
-    data = query_bigquery(query)
-        
-    # LOOP sobre as linhas do retorno do SQL:
-    for d in data:
-        
-        # Create data destination filename:
-        if len(d) > 1:
-            end_filename = '/'.join(map(lambda x: '='.join(map(str, x)), zip(par['url_params'], list(d.values()))))
-        else:
-            end_filename = d.values()[0]
-        filename = '/'.join(map(str, [item['name'], end_filename])) + '.json'
-        
-        # Create source url:    
-        url = item['url'] % dict(zip(par['url_params'], list(d.values())))
-        
-        if 'url' in d:
-            raise Exception("'url' key already exists in data; avoiding its redefinition.")
-        if 'filename' in d:
-            raise Exception("'filename' key already exists in data; avoiding its redefinition.")
+    # Executa a query (resultado por colunas):
+    names, columns = query_bigquery_columns(query)
+    n_rows = count_rows(columns)
+    if n_rows == 0:
+        return
+    
+    if 'url' in names:
+        raise Exception("'url' key already exists in data; avoiding its redefinition.")
+    if 'filename' in names:
+        raise Exception("'filename' key already exists in data; avoiding its redefinition.")
+    
+    # As colunas são associadas aos url_params pela posição:
+    values = [columns[name] for name in names]
+    
+    # Create data destination filenames:
+    if len(names) > 1:
+        end_filenames = join_columns(par['url_params'], values, n_rows, '/')
+    else:
+        end_filenames = map(str, values[0])
+    filenames = [str(item['name']) + '/' + end + '.json' for end in end_filenames]
+    
+    # Create source urls:    
+    urls = fill_template(item['url'], dict(zip(par['url_params'], values)))
+    
+    # Um dicionário por linha, com os dados, a URL e o filename:
+    for row, url, filename in zip(zip(*values), urls, filenames):
+        d = dict(zip(names, row))
         d['url']      = url
         d['filename'] = filename
-        
-        forms.append(d)
-    
-    return forms
+        yield d
 
 
-def forms_athena_query(par, item, forms):
+def forms_athena_query(par, item):
     """
     Faz um query no Athena (SQL da Amazon) e usa os resultados para 
-    construir uma lista de URLs e filenames (destino).
+    gerar URLs e filenames (destino).
     """
     
-    # Get AWS security credentials:
-    client = boto3.client('s3')
-    a = client.get_object(Bucket='config-lambda', Key='aws_accessKeys.json')
-    aws_key = json.loads(a['Body'].read().decode('utf-8'))
-
-    # Conecta à Athena com pacote do Joe.
-    cursor = connect(aws_access_key_id=aws_key['aws_access_key_id'],
-                         aws_secret_access_key=aws_key['aws_secret_access_key'],
-                         s3_staging_dir='s3://stagging-random/',
-                         region_name='us-east-1').cursor()
-    
     # Substitui parâmetros de input na query:
     query = par['query'] % par['query_config']
     
-    # Executa a query:
-    data = cursor.execute(query).fetchall() 
+    # Executa a query (resultado por colunas):
+    names, columns = query_athena_columns(query)
+    n_rows = count_rows(columns)
+    if n_rows == 0:
+        return
     
-    # LOOP sobre as linhas do retorno do SQL:
-    for d in data:
-        
-        if len(d) > 1:
-            end_filename = '&'.join(map(lambda x: '='.join(map(str, x)),
-                                                  zip(par['url_params'], 
-                                                      list(d))))
-        else:
-            end_filename = d[0]
-
-        forms.append({'url': item['url'] % dict(zip(par['url_params'], list(d))),
-                      'filename': '_'.join(map(str, [item['name'], end_filename])) + '.json'
-                      })
+    # As colunas são associadas aos url_params pela posição:
+    values = [columns[name] for name in names]
+    
+    if len(names) > 1:
+        end_filenames = join_columns(par['url_params'], values, n_rows, '&')
+    else:
+        end_filenames = map(str, values[0])
     
-    return forms
+    urls = fill_template(item['url'], dict(zip(par['url_params'], values)))
+    
+    for url, end in zip(urls, end_filenames):
+        yield {'url': url, 'filename': str(item['name']) + '_' + end + '.json'}
 
 
-def forms_from_to(par, item, forms):
+def forms_from_to(par, item):
     """
     A partir de um modelo de URL e de filename, cria realizações concretas 
     substituindo cada um dos anos listados como input nos URLs e filenames.
@@ -150,22 +229,18 @@ def forms_from_to(par, item, forms):
     # LOOP sobre os anos:
     for year in range(par['body']['from'], par['body']['to'] + 1):
         
-        forms.append({'url': item['url'] % {par['name']: year},
-                      'filename': '_'.join(map(str, [item['name'], year])) + '.json'
-                      })
-    
-    return forms
+        yield {'url': item['url'] % {par['name']: year},
+               'filename': '_'.join(map(str, [item['name'], year])) + '.json'
+               }
    
     
-def forms_from_external_list(par, item, forms, event):
+def forms_from_external_list(par, item, event):
     
     for item_from_list in event['external_params']['list']:
         
-        forms.append({'url': item['url'] % {par['url_param']: item_from_list},
-                      'filename': '_'.join(map(str, [item['name'], item_from_list])) + '.json'
-                      })
-    
-    return forms
+        yield {'url': item['url'] % {par['url_param']: item_from_list},
+               'filename': '_'.join(map(str, [item['name'], item_from_list])) + '.json'
+               }
 
 
 def daterange(start_date, end_date):
@@ -187,7 +262,7 @@ def daterange(start_date, end_date):
         yield start_date + timedelta(n)
 
 
-def forms_date_start_end(par, item, forms):
+def forms_date_start_end(par, item):
     """
     A partir de um modelo de URL e de filename, cria realizações concretas 
     substituindo cada um das datas listadas como input nos URLs e filenames.
@@ -223,25 +298,25 @@ def forms_date_start_end(par, item, forms):
         else:
             filename = item['name'] + '.json'
 
-        forms.append({'url': item['url'] % {key: datetime.strftime(value, par['date_format']) for key, value in dates.items()},
-            'filename': filename})
-    
-    return forms
+        yield {'url': item['url'] % {key: datetime.strftime(value, par['date_format']) for key, value in dates.items()},
+               'filename': filename}
 
 
-def forms_external_module(par, item, forms):
+def forms_external_module(par, item):
     
     em = importlib.import_module(item['name'].replace('-', '_'))
     
-    return em.entrypoint(par)
+    for form in em.entrypoint(par):
+        yield form
 
 
 def generate_forms(item, event):
     """
     Cria URLs a partir das informações no dynamo.
     
-    Retorno: forms, que é basicamente uma lista de dicionários que 
-    cada dicionário contém um URL e uma filename (destino).
+    Retorno: forms, um gerador de dicionários em que cada dicionário 
+    contém um URL e uma filename (destino). Os dicionários são criados
+    à medida que são consumidos.
     
     Input
     -----
@@ -257,29 +332,35 @@ def generate_forms(item, event):
     # Pega entrada 'parameters' no arquivo do dynamo:
     parameters = item['parameters']
     
-    forms = []
-    for par in parameters:
+    # Os tipos 'empty' e 'external_module' substituem os forms criados pelos 
+    # parâmetros anteriores, então estes são ignorados:
+    first = 0
+    for i, par in enumerate(parameters):
+        if par['type'] in ('empty', 'external_module'):
+            first = i
+    
+    for par in parameters[first:]:
         print(par)
         
         # Verifica o tipo de tarefa e executa o código apropriado:
         if par['type'] == 'from_to':
             
-            forms = forms_from_to(par, item, forms)
+            forms = forms_from_to(par, item)
 
         elif par['type'] == 'date_start_end':
 
-            forms = forms_date_start_end(par, item, forms)
+            forms = forms_date_start_end(par, item)
         
         elif par['type'] == 'athena_query':
 
-            forms = forms_athena_query(par, item, forms)
+            forms = forms_athena_query(par, item)
         
         elif par['type'] == 'bigquery':
-            forms = forms_bigquery(par, item, forms)
+            forms = forms_bigquery(par, item)
             
         elif par['type'] == 'external_list':
             
-            form = forms_from_external_list(par, item, forms, event)
+            forms = forms_from_external_list(par, item, event)
         
         elif par['type'] == 'empty':
             
@@ -288,19 +369,21 @@ def generate_forms(item, event):
                      }]
         
         elif par['type'] == 'external_module':
-            forms = forms_external_module(par['params'], item, forms)
+            forms = forms_external_module(par['params'], item)
         
         else:
 
-            raise 'Parameter type not identified'
-            
-    return forms 
+            raise Exception('Parameter type not identified')
+        
+        for form in forms:
+            yield form
     
     
 def generate_body(response, event):
     """
     Gera as URLs a partir de informações em arquivo 'response' do dynamo,
-    e outras coisas (metadados necessários).
+    e outras coisas (metadados necessários). É um gerador: cada dicionário
+    é criado à medida que é consumido.
     
     Input
     -----
@@ -320,8 +403,15 @@ def generate_body(response, event):
     # não dar pau se faltar alguma key do dicionário (e.g. records_keys)
     response['Item'] = defaultdict(lambda: None, response['Item'])
 
-    # Vamos popular uma lista de dicionários 'body' com URLs e metadados:    
-    body = []
+    # Format of the files saved to S3 (see output_formats):
+    output_format = output_formats.get_format(response['Item'])
+
+    # Aggregation mode (save many items in a single S3 file) needs the files' prefix:
+    aggregate = response['Item']['aggregate']
+    if aggregate != None:
+        aggregate = dict(aggregate, prefix=response['Item']['key'])
+
+    # Vamos gerar os dicionários 'body' com URLs e metadados:    
     for item in forms:
     # Do item vem filename e url, o resto vem do dynamo, basicamente infos 
     # sobre localização dos dados.
@@ -333,73 +423,142 @@ def generate_body(response, event):
                             params={}, # Parâmetros do HTTP GET.
                             headers=response['Item']['headers'], # Headers do HTTP GET.
                             bucket=response['Item']['bucket'], # bucket onde salvar os dados baixados.
-                            key=response['Item']['key'] + item.pop('filename'), # Path onde salvar os dados baixados.
+                            key=output_formats.output_key(response['Item']['key'] + item.pop('filename'), output_format), # Path onde salvar os dados baixados.
                             data_type=response['Item']['data_type'], 
                             data_path=response['Item']['data_path'], # Caminho em uma árvore de dados (e.g. XML) até os dados desejados.
                             exclude_keys=response['Item']['exclude_keys'],
                             records_keys=response['Item']['records_keys'],
                             name=response['Item']['name'],
-                            requests_pars=response['Item']['requests_pars'] # Parâmetros do item do capture_urls a serem passados à Lambda http-request.
+                            requests_pars=response['Item']['requests_pars'], # Parâmetros do item do capture_urls a serem passados à Lambda http-request.
+                            aggregate=aggregate, # Opções para salvar vários itens num único arquivo no S3 (ou None).
+                            output_format=output_format, # Formato do arquivo salvo no S3 (e.g. njson, njson.gz, parquet).
+                            output_schema=output_formats.get_schema(response['Item']), # Tipos das colunas em arquivos parquet (ou None).
+                            conditional_get=response['Item']['conditional_get'], # Usar GETs condicionais (ETag e Last-Modified da última captura).
+                            deduplicate=response['Item']['deduplicate'] # Não salvar dados iguais aos da última captura.
                            )
         request_pars['aux_data'] = item # Parâmetros gerados por generate_forms a serem passados à Lambda http-request.
     
-        body.append(request_pars)
-        
-    return body
+        yield request_pars
     
 
-def create_dynamo_temp_table(table_name, dynamodb):
+def read_queue_backend(response):
+    """
+    Given a `response` from dynamoDB's get_item (after translating from dyJSON),
+    return the name of the work queue backend (see `work_queue`) specified 
+    in the dynamoDB item under 'queue_backend'. Local runs use SQLite.
+    """
+    if local:
+        return 'sqlite'
     
-    try:
-        table = dynamodb.Table(table_name)
-        table.table_status
-
-    except:
-        create_table_response = dynamodb.create_table(
-            TableName= table_name,
-            AttributeDefinitions=[{
-            'AttributeName': 'order',
-            'AttributeType': 'N'
-            }],
-            KeySchema=[{
-                'AttributeName': 'order',
-                'KeyType': 'HASH'
-            }],
-            BillingMode='PAY_PER_REQUEST'
-        )
+    backend = response['Item'].get('queue_backend')
+    if backend == None:
+        return work_queue.default_backend
     
+    return backend
+
+
+def new_queue_id(event, batch_number, backend):
+    """
+    Determina o nome da fila a partir das informações de captura em `event`.
+    `batch_number` (int) diferencia as filas de batches paralelos criadas 
+    no mesmo segundo.
+    """
+    queue_id = '-'.join(['capture',
+                         event['key']['name']['S'],
+                         event['key']['capture_type']['S'],
+                         datetime.strftime(datetime.now(), '%Y-%m-%d-%H-%M-%S'),
+                         str(batch_number)])
+    # Tabelas temp têm prefixo 'temp-' (para clean_dynamo_tables encontrá-las):
+    if backend == 'temp_table':
+        queue_id = 'temp-' + queue_id
     
-def create_and_populate_dynamodb_table(urls, event):
+    return queue_id
+
+
+def queue_max_wait(context):
+    """
+    Retorna o tempo máximo (em segundos) de espera pela criação das filas:
+    o tempo que resta à Lambda `context` menos `queue_margin_ms`, ou o 
+    padrão do `work_queue` se rodando localmente (sem contexto da Lambda).
+    """
+    if hasattr(context, 'get_remaining_time_in_millis'):
+        return max(0, (context.get_remaining_time_in_millis() - queue_margin_ms) / 1000)
+    return work_queue.default_max_wait
+
+
+def create_and_populate_queues(body, event, n_queues, backend=work_queue.default_backend, max_wait=work_queue.default_max_wait):
     """
-    urls é uma lista de dicionários. Cada dicionário tem 
-    entradas descritas em 'body' na função generate forms acima.
+    Cria `n_queues` (int) filas do tipo `backend` (str, ver `work_queue`) e 
+    distribui entre elas os dicionários do iterável `body` (as entradas 
+    descritas em 'body' na função generate_body acima), alternadamente. 
+    A criação de cada fila espera no máximo `max_wait` segundos (float).
+    
+    `body` é consumido aos poucos e escrito nas filas em blocos de até 
+    `write_chunk_size` itens, então a lista completa nunca fica na memória.
+    As filas são criadas ao mesmo tempo, em paralelo à geração dos itens,
+    e cada fila recebe itens assim que está pronta.
+    
+    Retorna uma lista com os parâmetros do http-request para cada fila
+    com algum item.
     """
     
-    dynamodb = boto3.resource('dynamodb')
-   
-    # Determina o nome da tabela de output no dynamo a partir das informações de captura: 
-    table_name = '-'.join(['temp-capture',
-                            event['key']['name']['S'],
-                            event['key']['capture_type']['S'],
-                            datetime.strftime(datetime.now(), '%Y-%m-%d-%H-%M-%S')])
+    queue     = work_queue.get_queue(backend)
+    queue_ids = [new_queue_id(event, i, backend) for i in range(n_queues)]
+    n_items   = [0] * n_queues
+    buffers   = [[] for i in range(n_queues)]
+    
+    def flush(i):
+        # Escreve o bloco da fila i (esperando a fila ficar pronta):
+        created[i].result()
+        queue.put_items(queue_ids[i], buffers[i], n_items[i])
+        n_items[i] = n_items[i] + len(buffers[i])
+        buffers[i] = []
+    
+    with ThreadPoolExecutor(max_workers=n_queues) as executor:
+        # Cria as filas (no caso de tabelas temp, espera elas ficarem ACTIVE):
+        created = [executor.submit(queue.create, queue_id, max_wait) for queue_id in queue_ids]
+        
+        for position, body_entry in enumerate(body):
+            i = position % n_queues
+            buffers[i].append(body_entry)
+            if len(buffers[i]) >= write_chunk_size:
+                flush(i)
+        
+        for i in range(n_queues):
+            flush(i)
     
-    # Cria uma tabela vazia no dynamo:
-    create_dynamo_temp_table(table_name, dynamodb)
-
-    time.sleep(60)
+    print('Work queues (' + backend + ') with', n_items, 'entries')
+    
+    # Filas vazias não serão capturadas:
+    for i in range(n_queues):
+        if n_items[i] == 0:
+            queue.delete(queue_ids[i])
     
-    # Pega a referência (pointer) da tabela do dynamo:    
-    table = dynamodb.Table(table_name)
+    # Retorna as filas e o número de linhas - 1:    
+    return [work_queue.queue_params(backend, queue_ids[i], n_items[i]) for i in range(n_queues) if n_items[i] > 0]
 
-    # Escreve os dicionários criados pela função generate_body na tabela do dynamo: 
-    # REAAALY FAST!
-    with table.batch_writer() as batch:
-        for order, url in enumerate(urls): 
-            url.update({'order': order})   # Cria um novo key com a ordem dos dicionários 'url' na lista 'urls'.
-            batch.put_item(Item=url)
 
-    # Retorna o nome da tabela e o número de linhas - 1:    
-    return {'dynamo_table_name': table_name, 'order': len(urls) - 1}
+def invoke_http_request(params, n_workers=1):
+    """
+    Chama o http-request para capturar os itens listados na fila descrita
+    em `params`. No modo de cursor compartilhado, o http-request é chamado 
+    `n_workers` (int) vezes, e todos capturam a mesma fila.
+    """
+    if debug == True:
+        print('URLs to capture listed in:')
+        print(params)
+
+    # Faz a captura efetivamente, com os parâmetros criados por generate_body e 
+    # salvos por create_and_populate_queues:    
+    lambd = boto3.client('lambda')
+    for worker in range(n_workers):
+        if debug:
+            print('Invoking http-request...')
+        lambd.invoke(
+            FunctionName='arn:aws:lambda:us-east-1:085250262607:function:http-request:JustLambda',
+            #FunctionName='arn:aws:lambda:us-east-1:085250262607:function:http-request:DEV',
+            InvocationType='Event',
+            Payload=json.dumps(params))
 
 
 def adapt_url_key(body_entry):
@@ -436,28 +595,148 @@ def read_parallel_batches(response):
         return config[parallel_key]
 
 
-def split_parallel_batches(body, n_batches):
+def read_batch_mode(response):
+    """
+    Given a `response` from dynamoDB's get_item (after translating from dyJSON),
+    return a dict with the batch mode parameters specified in the dynamoDB item
+    ('batch_size', 'max_workers' and 'max_per_host'), to be passed to http-request. 
+    In batch mode, each http-request invocation captures many items concurrently
+    instead of a single one. If 'batch_size' is not specified, return an empty dict 
+    (one item per http-request invocation).
+    """
+    
+    batch_keys = ['batch_size', 'max_workers', 'max_per_host']
+    config = response['Item']
+    
+    if 'batch_size' not in config.keys() or config['batch_size'] == None or config['batch_size'] <= 1:
+        return {}
+    
+    return {key: config[key] for key in batch_keys if key in config.keys() and config[key] != None}
+
+
+def read_incremental(response):
+    """
+    Given a `response` from dynamoDB's get_item (after translating from dyJSON),
+    return the incremental mode options specified in the dynamoDB item under
+    'incremental', or None if the mode is off. 
+    
+    In incremental mode, items whose file already exists in S3 are not captured
+    again. 'incremental' can be true or a dict like {"max_age_days": 30}: in 
+    this case, existing files older than 'max_age_days' are captured again.
+    """
+    
+    incremental = response['Item'].get('incremental')
+    if incremental == None or incremental == False:
+        return None
+    if incremental == True:
+        return {}
+    
+    return incremental
+
+
+def list_existing_keys(bucket, prefix):
     """
-    Given a list `body` and an integer `n_batches`, tries to split `body` 
-    into `n_batches` sub-lists. For certain combinations of parameters, 
-    the number of sub-lists is different than the requested number `n_batches`.
-    It is recommended to measure the length of the returned list of batches.
+    List (with a paginated S3 listing) the files in AWS S3 `bucket` (str) 
+    under `prefix` (str). Returns a dict from the file keys to their last 
+    modification time (datetime).
     """
-    n_requests = len(body)
     
-    # Set batch sizes:
-    batch_sizes = [round(n_requests / n_batches) for i in range(n_batches)]
-    batch_sizes[0] = max(n_requests - sum(batch_sizes[1:]), 0)
+    paginator = boto3.client('s3').get_paginator('list_objects_v2')
+    
+    existing = {}
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            existing[obj['Key']] = obj['LastModified']
+    
+    return existing
+
+
+def captured_key(key):
+    """
+    Return the S3 `key` (str) of a captured file as the key of the first
+    page of the capture in the 'njson' format, i.e. without the suffix
+    added by http-request to the next pages (e.g. '_p2') and with the 
+    extension '.json' instead of the one of other output formats (e.g. 
+    '.json.gz' or '.parquet').
+    """
+    # Longer extensions first ('.json.gz' before '.json'):
+    for extension in sorted(output_formats.extensions.values(), key=len, reverse=True):
+        if key.endswith(extension):
+            return re.sub(r'_p\d+$', '', key[:-len(extension)]) + '.json'
+    
+    return key
+
 
-    # Set positions that mark the start and end of batches:
-    batch_pos = [sum(batch_sizes[:i]) for i in range(n_batches + 1)]
+def skip_captured(body, existing, max_age_days=None):
+    """
+    Generator of the entries in the iterable `body` (see generate_body) whose 
+    'key' is not in `existing` (dict from S3 key to last modification time). 
+    Keys are compared with `captured_key`, so files saved in other output 
+    formats or the next pages of a capture count as captured (with the most
+    recent modification time among them). If `max_age_days` (number) is 
+    given, entries whose file is older than that are kept too (so they are 
+    captured again).
+    """
+    
+    captured = {}
+    for key, modified in existing.items():
+        key = captured_key(key)
+        if key not in captured or modified > captured[key]:
+            captured[key] = modified
     
-    # Split into batches
-    batches = [body[batch_pos[i]:batch_pos[i+1]] for i in range(n_batches) \
-               if len(body[batch_pos[i]:batch_pos[i+1]]) > 0]
+    now = datetime.now(timezone.utc)
+    n_skipped = 0
     
-    return batches    
+    for body_entry in body:
+        modified = captured.get(captured_key(body_entry['key']))
+        if modified != None and (max_age_days == None or now - modified < timedelta(days=max_age_days)):
+            n_skipped = n_skipped + 1
+            continue
+        yield body_entry
     
+    if debug:
+        print('Incremental mode: skipped', n_skipped, 'items already in S3.')
+
+
+def read_scheduler(response):
+    """
+    Given a `response` from dynamoDB's get_item (after translating from dyJSON),
+    return a dict with the scheduler parameters to be passed to http-request.
+    If the dynamoDB item has 'scheduler' equal to 'shared_cursor', all items go
+    to a single queue and 'parallel_batches' http-request workers claim chunks 
+    of 'chunk_size' items from it until it is exhausted (instead of each one 
+    capturing a fixed slice). Chunks not finished within 'lease_seconds' are
+    claimed again by another worker. Otherwise, return an empty dict.
+    """
+    
+    config = response['Item']
+    
+    if config.get('scheduler') != 'shared_cursor':
+        return {}
+    
+    scheduler = {'scheduler': 'shared_cursor'}
+    for key in ['chunk_size', 'lease_seconds']:
+        if config.get(key) != None:
+            scheduler[key] = config[key]
+    
+    return scheduler
+
+
+def check_aggregate(response):
+    """
+    Given a `response` from dynamoDB's get_item (after translating from dyJSON),
+    raise an error if the dynamoDB item has 'aggregate' set but neither batch 
+    mode ('batch_size' > 1) nor the 'shared_cursor' scheduler: aggregated files 
+    are written when an http-request invocation ends, so they only make sense 
+    when each invocation captures many items.
+    """
+    
+    if response['Item'].get('aggregate') == None:
+        return
+    
+    if read_batch_mode(response) == {} and read_scheduler(response) == {}:
+        raise Exception("Config error: 'aggregate' requires 'batch_size' > 1 or 'scheduler' = 'shared_cursor'.")
+
 
 def lambda_handler(event, context):
     """
@@ -493,38 +772,41 @@ def lambda_handler(event, context):
     if debug == True:
         print("dict of dynamo Table:") 
         print(response)
+    # Aggregation is only possible when each http-request captures many items:
+    check_aggregate(response)
 
-    # Gera as URLs e os filenames (destino):
+    # Gera as URLs e os filenames (destino), à medida que são escritos nas filas:
     body = generate_body(response, event)
-    if debug:
-        print('# items to capture (body length):', len(body))
+    # Incremental mode: skip items whose files already exist in S3 (not possible
+    # when aggregating items, since each item does not have its own file):
+    incremental = read_incremental(response)
+    if incremental != None and response['Item'].get('aggregate') == None:
+        existing = list_existing_keys(response['Item']['bucket'], response['Item']['key'])
+        body = skip_captured(body, existing, incremental.get('max_age_days'))
     # Rename 'url' key if it is not an url:
-    body = [adapt_url_key(b) for b in body]
+    body = map(adapt_url_key, body)
 
-    # Split requests in parallel batches according to config:
+    # Number of parallel batches according to config:
     n_batches = read_parallel_batches(response)
-    body_batches = split_parallel_batches(body, n_batches)
-
-    # Chama cliente do lambda:
-    lambd = boto3.client('lambda')
-
-    
-    for body in body_batches:  # If body_batches == [], it skips everything in the loop.
-        print('Create dynamo temp table with', len(body), 'entries')
-
-        # Salva os as informações geradas acima no dynamo como uma tabela temp:
-        params = create_and_populate_dynamodb_table(body, event)
-        if debug == True:
-            print('URLs to capture listed in:')
-            print(params)
-
-        # Faz a captura efetivamente, com os parâmetros criados por generate_body e 
-        # salvos por create_and_populate_dynamodb_table:    
-        if True:
-            if debug:
-                print('Invoking http-request...')
-            lambd.invoke(
-                FunctionName='arn:aws:lambda:us-east-1:085250262607:function:http-request:JustLambda',
-                #FunctionName='arn:aws:lambda:us-east-1:085250262607:function:http-request:DEV',
-                InvocationType='Event',
-                Payload=json.dumps(params))
\ No newline at end of file
+    # Capture many items per http-request invocation, if requested in config:
+    batch_mode = read_batch_mode(response)
+    # Shared cursor: a single queue, captured by `n_batches` workers at the same time:
+    scheduler = read_scheduler(response)
+    batch_mode.update(scheduler)
+    # Where to store the list of items to capture:
+    backend = read_queue_backend(response)
+
+    # Escreve os itens nas filas (uma por batch, ou uma compartilhada):
+    all_params = create_and_populate_queues(body, event, 1 if scheduler != {} else n_batches, backend,
+                                            queue_max_wait(context))
+    if debug:
+        print('# items to capture:', sum([params['order'] + 1 for params in all_params]))
+    
+    for params in all_params:
+        params.update(batch_mode)
+        n_workers = 1
+        if scheduler != {}:
+            params['n_items'] = params['order'] + 1
+            chunk_size = scheduler.get('chunk_size', default_chunk_size)
+            n_workers  = min(n_batches, -(-params['n_items'] // chunk_size))
+        invoke_http_request(params, n_workers)
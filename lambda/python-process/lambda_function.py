@@ -1,17 +1,21 @@
 from dynamodb_json import json_util as dyjson 
-from pyathena import connect
 from collections import defaultdict
 import importlib
 import boto3
 import joblib
 import pandas as pd
 import json
+import output_formats
+import cloud_clients
 
 # Specific processing modules:
 import req_classifier
 import dou_sorter_common_functions
 
 debug = True
+# To copy files to GCP in batches, set to the SQS queue URL drained by write-to-storage-gcp
+# (if None, write-to-storage-gcp is invoked once per file):
+gcp_copy_queue_url = None
 
 
 def brasilia_time():
@@ -118,22 +122,29 @@ def load_njson(newline_delimited_json):
     return data
 
 
-def get_field(key_value_pair_list, key):
+def index_fields(key_value_pair_list):
     """
     Given a list of key-value pairs (dicts with keys 'key' and 'value'), 
-    find the entry that has the provided `key` and return its value.
-    
-    If no `key` is found, return None.
+    return a dict from each key to its value.
     
     It assumes that each `key` only appears one in `key_value_pair_list`,
-    so the first appearance is returned.
+    so the first appearance is kept.
     """
-    entry = list(filter(lambda d: d['key'] == key, key_value_pair_list))
+    fields = {}
+    for entry in key_value_pair_list:
+        fields.setdefault(entry['key'], entry['value'])
     
-    if len(entry) == 0:
-        return None
+    return fields
+
+
+def get_field(key_value_pair_list, key):
+    """
+    Given a list of key-value pairs (dicts with keys 'key' and 'value'), 
+    find the entry that has the provided `key` and return its value.
     
-    return entry[0]['value']
+    If no `key` is found, return None.
+    """
+    return index_fields(key_value_pair_list).get(key)
 
 
 def keyvalue_to_structure(raw_data, key_list):
@@ -143,9 +154,10 @@ def keyvalue_to_structure(raw_data, key_list):
     are those in `key_list` and values are given by the values 
     associated to each key.
     """
+    fields          = index_fields(raw_data)
     structured_data = {}
     for key in key_list:
-        structured_data[key] = get_field(raw_data, key)
+        structured_data[key] = fields.get(key)
         
     return structured_data
 
@@ -281,16 +293,8 @@ def athena_to_pandas(query, query_cols):
         The results of the query, with columns labeled according to `query_cols`.
     """
     
-    # Get AWS security credentials:
-    s3 = boto3.client('s3')
-    a = s3.get_object(Bucket='config-lambda', Key='aws_accessKeys.json')
-    aws_key = json.loads(a['Body'].read().decode('utf-8'))
-
-    # Conecta à Athena com pacote do Joe.
-    cursor = connect(aws_access_key_id=aws_key['aws_access_key_id'],
-                         aws_secret_access_key=aws_key['aws_secret_access_key'],
-                         s3_staging_dir='s3://stagging-random/',
-                         region_name='us-east-1').cursor()
+    # Conecta à Athena com pacote do Joe (conexão reutilizada entre chamadas):
+    cursor = cloud_clients.athena_cursor()
 
     # Executa a query:
     data  = cursor.execute(query).fetchall() 
@@ -309,24 +313,23 @@ def add_process_date(record):
     return record
 
 
-def pandas_to_njson(df):
+def pandas_to_output(df, output_format, column_types=None):
     """
-    Given a Pandas DataFrame `df`, transform it to newline-elimited JSON 
-    and add a key 'process_date' with the current date and time as value.
+    Given a Pandas DataFrame `df`, add a key 'process_date' with the current 
+    date and time as value and transform it to a file content (bytes) in 
+    `output_format` (see output_formats), e.g. 'njson', 'njson.gz' or 'parquet'.
+    `column_types` are the types of the parquet columns (see output_formats).
     """
     
-    #df['secao'] = df['secao'].astype(int)
-    
-    records   = df.to_dict(orient='records')
-    json_list = [json.dumps(add_process_date(record), ensure_ascii=False) for record in records]
-    njson     = '\n'.join(json_list)
+    records = [add_process_date(record) for record in df.to_dict(orient='records')]
+    body    = output_formats.encode_records(records, output_format, column_types)
     
-    return njson
+    return body
 
 
 def save_to_s3(bucket, key, body):
     """
-    Save a string `body` to a file `key` in the AWS S3 `bucket`.
+    Save a string or bytes `body` to a file `key` in the AWS S3 `bucket`.
     """
     client = boto3.client('s3')
     s3_log = client.put_object(Body=body, Bucket=bucket, Key=key)
@@ -342,10 +345,18 @@ def copy_s3_to_storage_gcp(bucket, key):
     - 'key': the "file path" of the file.
     
     This function calls the lambda function that copies the file from AWS
-    to GCP storage.
+    to GCP storage (or, if `gcp_copy_queue_url` is set, sends the file to 
+    the queue of files that write-to-storage-gcp copies in batches).
     """
     params = {'bucket': bucket, 'key': key}
     
+    if gcp_copy_queue_url != None:
+        if debug:
+            print('Queueing copy to GCP storage...')
+        sqs = boto3.client('sqs')
+        sqs.send_message(QueueUrl=gcp_copy_queue_url, MessageBody=json.dumps(params))
+        return
+    
     lambd = boto3.client('lambda')
     
     if debug:
@@ -430,7 +441,8 @@ def lambda_handler(event, context):
     # Output processed data:
     if debug:
         print('Prepare data for output...')
-    njson = pandas_to_njson(output_data)
+    output_format = output_formats.get_format(config['output_data'])
+    body = pandas_to_output(output_data, output_format, output_formats.get_schema(config['output_data']))
 
     output_metadata = {}
     if 'now' in config['output_data']['key_pars']:
@@ -439,11 +451,12 @@ def lambda_handler(event, context):
     output_metadata['yesterday'] = yesterday_string()
 
     output_key = config['output_data']['key'] % output_metadata
+    output_key = output_formats.output_key(output_key, output_format)
 
     if config['output_data']['type'] == 's3_gcp_file' or config['output_data']['type'] == 's3_file':
         if debug:
             print('Save file to S3...')
-        save_to_s3(config['output_data']['bucket'], output_key, njson)
+        save_to_s3(config['output_data']['bucket'], output_key, body)
 
     if config['output_data']['type'] == 's3_gcp_file':
         if debug:
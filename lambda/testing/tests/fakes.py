@@ -0,0 +1,123 @@
+"""
+In-memory stand-ins for the HTTP and AWS clients used by http-request,
+so its handler can be run offline (see test_http_request_*.py).
+"""
+
+import hashlib
+import json
+from unittest import mock
+from urllib.parse import urlencode
+
+
+class FakeResponse:
+    """
+    Response of a GET, with the attributes used by http-request.
+    """
+
+    def __init__(self, status_code=200, data=None, text=None, headers=None):
+        self.status_code = status_code
+        self.text        = text if text != None else json.dumps(data)
+        self.content     = self.text.encode('utf-8')
+        self.headers     = headers if headers != None else {}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeSession:
+    """
+    HTTP session that answers GETs with the responses in `pages` (dict
+    from url to FakeResponse, or to a function of the request headers
+    that returns one), recording every GET in `gets`.
+    """
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.gets  = []
+
+    def get(self, url, params=None, headers=None, timeout=None, verify=True):
+        self.gets.append({'url': url, 'params': params, 'headers': headers})
+        if params:
+            url = url + '?' + urlencode(sorted(params.items()))
+        page = self.pages.get(url, FakeResponse(404, text='Not found'))
+        if callable(page):
+            return page(headers if headers != None else {})
+        return page
+
+
+class FakeS3:
+    """
+    AWS S3 client holding `objects` (dict from (bucket, key) to bytes).
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.puts    = []
+
+    def put_object(self, Body, Bucket, Key):
+        self.objects[(Bucket, Key)] = Body
+        self.puts.append(Key)
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}, 'ETag': self.etag(Bucket, Key)}
+
+    def etag(self, bucket, key):
+        return '"' + hashlib.md5(self.objects[(bucket, key)]).hexdigest() + '"'
+
+    def head_object(self, Bucket, Key):
+        from botocore.exceptions import ClientError
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        return {'ETag': self.etag(Bucket, Key)}
+
+
+class FakeLambda:
+    """
+    AWS Lambda client recording the invocations (function name and payload).
+    """
+
+    def __init__(self):
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.invocations.append((FunctionName.split(':')[-2], json.loads(Payload)))
+
+
+class FakeDynamoDB:
+    class exceptions:
+        class ResourceNotFoundException(Exception):
+            pass
+
+
+class FakeAWS:
+    """
+    The clients returned by http-request's `get_client`.
+    """
+
+    def __init__(self):
+        self.clients = {'s3': FakeS3(), 'lambda': FakeLambda(), 'dynamodb': FakeDynamoDB()}
+
+    def get_client(self, service):
+        return self.clients[service]
+
+
+def patch_http_request(test, hr, pages, queue=None):
+    """
+    Replace, during the `test` (unittest.TestCase), the HTTP session and
+    AWS clients used by the http-request module `hr` by fakes serving
+    `pages` (see FakeSession), and use `queue` (e.g. a work_queue.SQLiteQueue)
+    as the 'sqlite' work queue backend. The capture cache is kept in memory.
+    Returns the FakeAWS and FakeSession.
+    """
+    aws     = FakeAWS()
+    session = FakeSession(pages)
+    patches = [mock.patch.object(hr, 'debug', False),
+               mock.patch.object(hr, 'get_client', aws.get_client),
+               mock.patch.object(hr, 'host_semaphores', {}),
+               mock.patch.object(hr.http_sessions, 'get_session', lambda url: session),
+               mock.patch.object(hr.capture_cache, 'local', True),
+               mock.patch.object(hr.capture_cache, 'memory', {}),
+               mock.patch.dict(hr.work_queue.queues, {'sqlite': queue} if queue != None else {})]
+    for patch in patches:
+        patch.start()
+        test.addCleanup(patch.stop)
+
+    return aws, session
@@ -0,0 +1,102 @@
+"""
+Helpers to import the Lambda functions' modules in the tests.
+
+Each Lambda function lives in its own folder under `lambda/` and the
+modules shared by many of them are in the capture-shared layer
+(`layers/capture-shared/python`). `load` puts both in `sys.path` and
+imports a module from a function's folder. Since all functions have a
+`lambda_function.py`, these are imported under a different name.
+
+AWS packages (boto3, dynamodb_json) are replaced by mocks when they are
+not installed, so modules that only use them in some functions can be
+imported offline.
+"""
+
+import importlib
+import importlib.util
+import os
+import sys
+from unittest import mock
+
+# Root of the repository:
+root       = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+lambda_dir = os.path.join(root, 'lambda')
+shared_dir = os.path.join(root, 'layers', 'capture-shared', 'python')
+
+
+def add_path(path):
+    """
+    Add `path` (str) to the beginning of `sys.path`, if it is not there.
+    """
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+def mock_missing(name):
+    """
+    Replace the package `name` (str) by a mock if it cannot be imported.
+    """
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        sys.modules[name] = mock.MagicMock()
+
+
+def setup():
+    """
+    Make the shared modules importable and mock missing AWS packages.
+    """
+    add_path(shared_dir)
+    mock_missing('boto3')
+    for name in ['boto3.s3', 'boto3.s3.transfer']:
+        if isinstance(sys.modules['boto3'], mock.MagicMock):
+            sys.modules[name] = mock.MagicMock()
+    mock_missing('dynamodb_json')
+
+
+def has_module(name):
+    """
+    Return True if the package `name` (str) can be imported.
+    """
+    setup()
+    try:
+        importlib.import_module(name)
+        return True
+    except ImportError:
+        return False
+
+
+def has_modules(*names):
+    """
+    Return True if all packages in `names` (str) can be imported.
+    """
+    return all(has_module(name) for name in names)
+
+
+def load(function, module='lambda_function'):
+    """
+    Import `module` (str) from the folder of the Lambda `function` (str),
+    e.g. load('write-to-storage-gcp', 'copy_queue'). A `lambda_function`
+    is imported under the name '<function>_lambda_function' (with '_'
+    instead of '-').
+    """
+    setup()
+    folder = os.path.join(lambda_dir, function)
+    add_path(folder)
+    if module != 'lambda_function':
+        return importlib.import_module(module)
+
+    name = function.replace('-', '_') + '_lambda_function'
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(folder, 'lambda_function.py'))
+        sys.modules[name] = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(sys.modules[name])
+    return sys.modules[name]
+
+
+def load_shared(module):
+    """
+    Import `module` (str) from the capture-shared layer.
+    """
+    setup()
+    return importlib.import_module(module)
@@ -0,0 +1,196 @@
+"""
+http-request's capture cache (validators of the last capture of each URL)
+and the conditional GETs that use it.
+"""
+
+import json
+import unittest
+from unittest import mock
+
+import fakes
+import support
+from test_http_request_batch import HTTPRequestCase, item, url
+
+
+@unittest.skipUnless(support.has_module('botocore'), 'requires botocore')
+class CacheCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from botocore.exceptions import ClientError, EndpointConnectionError
+        cls.ClientError = ClientError
+        cls.EndpointConnectionError = EndpointConnectionError
+        cls.capture_cache = support.load('http-request', 'capture_cache')
+
+    def use_client(self, client):
+        for patch in [mock.patch.object(self.capture_cache, 'local', False),
+                      mock.patch.object(self.capture_cache, 'memory', {}),
+                      mock.patch.object(self.capture_cache, 'dynamodb', client)]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+
+class CacheTable:
+    """
+    DynamoDB client storing the cache entries in `items` (dict from url
+    to item in dyJSON), or raising `error` (an exception) in every call.
+    """
+
+    def __init__(self, error=None):
+        from botocore.exceptions import ClientError
+
+        class exceptions:
+            class ResourceNotFoundException(ClientError):
+                pass
+
+        self.exceptions = exceptions
+        self.error      = error
+        self.items      = {}
+
+    def get_item(self, TableName, Key):
+        if self.error != None:
+            raise self.error
+        url = Key['url']['S']
+        return {'Item': dict(self.items[url], url=Key['url'])} if url in self.items else {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues=None):
+        if self.error != None:
+            raise self.error
+        item = self.items.setdefault(Key['url']['S'], {})
+        for action in UpdateExpression.split(' REMOVE '):
+            if action.startswith('SET '):
+                for assignment in action[4:].split(', '):
+                    alias, value = assignment.split(' = ')
+                    item[ExpressionAttributeNames[alias]] = ExpressionAttributeValues[value]
+            else:
+                for alias in action.replace('REMOVE ', '').split(', '):
+                    item.pop(ExpressionAttributeNames[alias], None)
+
+
+class TestCacheKey(CacheCase):
+
+    def test_stable(self):
+        event = {'url': url, 'params': {'pagina': 2, 'itens': 100, 'ordem': 'ASC'}}
+        key   = self.capture_cache.cache_key(event)
+        self.assertEqual(key, url + '?itens=100&ordem=ASC&pagina=2')
+        # Independent of the order of the params:
+        reordered = {'url': url, 'params': {'ordem': 'ASC', 'pagina': 2, 'itens': 100}}
+        self.assertEqual(self.capture_cache.cache_key(reordered), key)
+        self.assertEqual(self.capture_cache.cache_key(json.loads(json.dumps(event))), key)
+
+    def test_no_params(self):
+        self.assertEqual(self.capture_cache.cache_key({'url': url}), url)
+        self.assertEqual(self.capture_cache.cache_key({'url': url, 'params': {}}), url)
+        self.assertEqual(self.capture_cache.cache_key({'url': url, 'params': None}), url)
+
+
+class TestCache(CacheCase):
+
+    def test_dynamodb(self):
+        table = CacheTable()
+        self.use_client(table)
+        self.capture_cache.update(url, {'etag': '"e1"', 'last_modified': 'Mon, 01 Jun 2020 10:00:00 GMT'})
+        self.capture_cache.update(url, {'etag': '"e2"', 'last_modified': None})
+        self.assertEqual(self.capture_cache.get(url), {'etag': '"e2"'})
+        self.assertEqual(self.capture_cache.get(url + '1'), None)
+        self.assertEqual(self.capture_cache.memory, {})
+
+    def test_missing_table(self):
+        table = CacheTable()
+        table.error = table.exceptions.ResourceNotFoundException({'Error': {'Code': 'ResourceNotFoundException'}},
+                                                                 'GetItem')
+        self.use_client(table)
+        self.capture_cache.update(url, {'etag': '"e1"'})
+        # Memory is used from now on:
+        self.assertTrue(self.capture_cache.local)
+        self.assertEqual(self.capture_cache.get(url), {'etag': '"e1"'})
+
+    def test_memory_fallback(self):
+        for error in [self.ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'UpdateItem'),
+                      self.EndpointConnectionError(endpoint_url='https://dynamodb.us-east-1.amazonaws.com')]:
+            table = CacheTable(error)
+            self.use_client(table)
+            self.capture_cache.update(url, {'etag': '"e1"'})
+            self.assertEqual(self.capture_cache.get(url), {'etag': '"e1"'})
+            self.assertEqual(self.capture_cache.memory, {url: {'etag': '"e1"'}})
+            # DynamoDB is tried again in the next calls:
+            self.assertFalse(self.capture_cache.local)
+            table.error = None
+            self.capture_cache.update(url, {'etag': '"e2"'})
+            self.assertEqual(self.capture_cache.get(url), {'etag': '"e2"'})
+
+
+def page(n, etag, last_modified, next_page=True):
+    """
+    Page `n` (int) of the fake API, answering 304 to conditional GETs
+    with its `etag` (str) or `last_modified` (str).
+    """
+    links = [{'rel': 'next', 'href': url + '1?pagina=' + str(n + 1)}] if next_page else []
+    data  = {'dados': [{'id': n, 'etag': etag}], 'links': links}
+
+    def respond(headers):
+        if headers.get('If-None-Match') == etag or headers.get('If-Modified-Since') == last_modified:
+            return fakes.FakeResponse(304, text='')
+        return fakes.FakeResponse(data=data, headers={'ETag': etag, 'Last-Modified': last_modified})
+
+    return respond
+
+
+class TestConditionalGet(HTTPRequestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.event = item(1, conditional_get=True)
+        self.session.pages.update({url + '1': page(1, '"e1"', 'Mon, 01 Jun 2020 10:00:00 GMT'),
+                                   url + '1?pagina=2': page(2, '"e2"', 'Tue, 02 Jun 2020 10:00:00 GMT', False)})
+
+    def capture(self):
+        self.session.gets.clear()
+        self.aws.clients['s3'].puts.clear()
+        self.hr.capture_event({'order': 1}, self.event)
+
+    def test_headers_sent(self):
+        self.capture()
+        self.assertEqual([get['headers'] for get in self.session.gets], [{}, {}])
+
+        self.capture()
+        self.assertEqual([get['headers'] for get in self.session.gets],
+                         [{'If-None-Match': '"e1"', 'If-Modified-Since': 'Mon, 01 Jun 2020 10:00:00 GMT'},
+                          {'If-None-Match': '"e2"', 'If-Modified-Since': 'Tue, 02 Jun 2020 10:00:00 GMT'}])
+
+    def test_not_modified(self):
+        self.capture()
+        s3     = self.aws.clients['s3']
+        before = dict(s3.objects)
+        self.session.pages[url + '1?pagina=2'] = page(2, '"e2-new"', 'Wed, 03 Jun 2020 10:00:00 GMT', False)
+
+        self.capture()
+        # The first page is not saved again (nor copied to GCP), but its next page is
+        # followed from the cache, with the right key:
+        self.assertEqual([get['url'] for get in self.session.gets], [url + '1', url + '1?pagina=2'])
+        self.assertEqual(s3.puts, ['camara/proposicoes/1_p2.json'])
+        self.assertEqual(s3.objects[('brutos-publicos', 'camara/proposicoes/1.json')],
+                         before[('brutos-publicos', 'camara/proposicoes/1.json')])
+        self.assertEqual(json.loads(s3.objects[('brutos-publicos', 'camara/proposicoes/1_p2.json')])['etag'], '"e2-new"')
+        copied = [payload['key'] for payload in self.invocations('write-to-storage-gcp')]
+        self.assertEqual(copied, ['camara/proposicoes/1.json', 'camara/proposicoes/1_p2.json',
+                                  'camara/proposicoes/1_p2.json'])
+
+    def test_other_key(self):
+        # The validators of a capture saved to another key are not used:
+        self.capture()
+        self.event = dict(self.event, key='camara/proposicoes/other.json')
+        self.capture()
+        self.assertEqual([get['headers'] for get in self.session.gets], [{}, {}])
+        self.assertEqual(self.aws.clients['s3'].puts, ['camara/proposicoes/other.json',
+                                                       'camara/proposicoes/other_p2.json'])
+
+    def test_switched_off(self):
+        self.capture()
+        self.event = dict(self.event, conditional_get=False)
+        self.capture()
+        self.assertEqual([get['headers'] for get in self.session.gets], [{}, {}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+"""
+capture_dou's driver: polite concurrent GETs of DOU articles and the
+thread that saves them.
+"""
+
+import queue
+import threading
+import time
+import unittest
+from unittest import mock
+
+import support
+
+
+@unittest.skipUnless(support.has_modules('requests', 'lxml', 'cloudscraper', 'slackclient', 'botocore'),
+                     'requires requests, lxml, cloudscraper, slackclient and botocore')
+class DriverCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cd = support.load('capture_dou', 'capture_driver')
+
+    def setUp(self):
+        for patch in [mock.patch.object(self.cd, 'host_semaphores', {}),
+                      mock.patch.object(self.cd, 'host_next_start', {})]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+
+class Session:
+    """
+    requests session that records the URLs requested (and how many GETs
+    were running at the same time), answering each GET after `duration`
+    seconds.
+    """
+
+    def __init__(self, duration=0, errors=()):
+        self.duration    = duration
+        self.errors      = list(errors)
+        self.gets        = []
+        self.running     = 0
+        self.max_running = 0
+        self.lock        = threading.Lock()
+
+    def get(self, url, timeout=None, verify=True):
+        with self.lock:
+            self.gets.append((url, verify))
+            self.running = self.running + 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.duration)
+        with self.lock:
+            self.running = self.running - 1
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+        return url
+
+
+class TestPoliteGet(DriverCase):
+
+    def test_delay_per_host(self):
+        sleeps = []
+        clock  = mock.Mock()
+        clock.time.return_value = 1000.0
+        clock.sleep.side_effect = sleeps.append
+        session = Session()
+        with mock.patch.object(self.cd, 'time', clock), mock.patch.object(self.cd.gs, 'politeness_delay', 0.5):
+            for url in ['http://www.in.gov.br/web/1', 'http://www.in.gov.br/web/2', 'http://other.gov.br/1',
+                        'http://www.in.gov.br/web/3']:
+                self.assertEqual(self.cd.polite_get(session, url), url)
+        # GETs to the same host start `politeness_delay` seconds apart (other hosts do not wait):
+        self.assertEqual(sleeps, [0, 0.5, 0, 1.0])
+
+    def test_max_per_host(self):
+        session = Session(duration=0.02)
+        urls    = ['http://www.in.gov.br/web/' + str(i) for i in range(8)]
+        with mock.patch.object(self.cd.gs, 'politeness_delay', 0), mock.patch.object(self.cd.gs, 'max_per_host', 2):
+            threads = [threading.Thread(target=self.cd.polite_get, args=(session, url)) for url in urls]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(sorted(url for url, verify in session.gets), sorted(urls))
+        self.assertEqual(session.max_running, 2)
+
+    def test_ssl_error(self):
+        import requests
+        session = Session(errors=[requests.exceptions.SSLError()])
+        with mock.patch.object(self.cd.gs, 'politeness_delay', 0):
+            self.cd.polite_get(session, 'https://www.in.gov.br/web/1')
+        self.assertEqual(session.gets, [('https://www.in.gov.br/web/1', True), ('https://www.in.gov.br/web/1', False)])
+
+
+class TestWriteErrors(DriverCase):
+
+    url_files = [{'url': 'http://www.in.gov.br/web/' + str(i), 'filename': str(i)} for i in range(3)]
+
+    def save_and_register(self, config, url_file, raw_article):
+        if url_file['url'].endswith('/1'):
+            raise ValueError('S3 is down')
+        self.saved.append(url_file['url'])
+
+    def setUp(self):
+        super().setUp()
+        self.saved = []
+        patch = mock.patch.object(self.cd, 'save_and_register', self.save_and_register)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_write_stage(self):
+        to_write = queue.Queue()
+        for url_file in self.url_files:
+            to_write.put((url_file, {}))
+        to_write.put(None)
+        errors = []
+        self.cd.write_stage({}, to_write, errors)
+        # The other articles are still saved:
+        self.assertEqual(self.saved, [self.url_files[0]['url'], self.url_files[2]['url']])
+        self.assertEqual([(url, str(error)) for url, error in errors], [(self.url_files[1]['url'], 'S3 is down')])
+
+    def run_driver(self):
+        response = mock.Mock(status_code=200)
+        config   = {'secao': [1], 'post_articles': False, 'save_articles': True, 'url_list': 'dou-urls'}
+        matcher  = mock.Mock()
+        matcher.matches.return_value = []
+        gu = mock.Mock()
+        gu.get_articles_url.return_value = (self.url_files, {'next': True})
+        with mock.patch.multiple(self.cd, gu=gu, fa=mock.Mock(), hs=mock.Mock(), pa=mock.Mock(), sa=mock.Mock(),
+                                 fetch_article=lambda session, url_file: response):
+            self.cd.fa.format_filters.return_value = []
+            self.cd.fa.compile_filters.return_value = matcher
+            result = self.cd.capture_DOU_driver(config)
+        gu.flush_captured_urls.assert_called_once_with('dou-urls')
+        return result
+
+    def test_driver_raises_write_errors(self):
+        with self.assertRaises(Exception) as raised:
+            self.run_driver()
+        self.assertIn(self.url_files[1]['url'], str(raised.exception))
+        self.assertIsInstance(raised.exception.__cause__, ValueError)
+        self.assertEqual(self.saved, [self.url_files[0]['url'], self.url_files[2]['url']])
+
+    def test_driver_without_errors(self):
+        self.url_files = self.url_files[:1]
+        self.assertEqual(self.run_driver(), {'next': True})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+Store of captured URLs (local file storage) and its Bloom filter.
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import support
+
+captured_urls = support.load_shared('captured_urls')
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_no_false_negatives(self):
+        bloom = captured_urls.BloomFilter(1000, 0.001)
+        urls  = ['http://www.in.gov.br/web/dou/-/' + str(i) for i in range(1000)]
+        for url in urls:
+            bloom.add(url)
+        self.assertTrue(all(url in bloom for url in urls))
+
+    def test_false_positive_rate(self):
+        bloom = captured_urls.BloomFilter(2000, 0.01)
+        for i in range(2000):
+            bloom.add('http://a/' + str(i))
+        false_positives = sum('http://b/' + str(i) in bloom for i in range(20000))
+        self.assertLess(false_positives / 20000, 0.03)
+
+
+class TestCapturedURLs(unittest.TestCase):
+
+    def setUp(self):
+        folder    = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.path = os.path.join(folder.name, 'urls.txt')
+
+    def test_add_flush_and_reload(self):
+        store = captured_urls.CapturedURLs(self.path, local=True)
+        self.assertFalse('http://a' in store)
+        store.add('http://a')
+        store.add('http://b')
+        # Buffered URLs are already known:
+        self.assertTrue('http://a' in store)
+        self.assertFalse(os.path.exists(self.path))
+
+        store.flush()
+        reloaded = captured_urls.CapturedURLs(self.path, local=True)
+        self.assertTrue('http://a' in reloaded and 'http://b' in reloaded)
+        self.assertFalse('http://c' in reloaded)
+
+    def test_flush_when_buffer_is_full(self):
+        store = captured_urls.CapturedURLs(self.path, local=True)
+        for i in range(captured_urls.flush_size):
+            store.add('http://a/' + str(i))
+        with open(self.path) as f:
+            self.assertEqual(len(f.read().splitlines()), captured_urls.flush_size)
+
+    def test_large_history_in_bloom_filter(self):
+        with open(self.path, 'w') as f:
+            f.write(''.join('http://a/' + str(i) + '\n' for i in range(50)))
+        with mock.patch.object(captured_urls, 'bloom_threshold', 10):
+            store = captured_urls.CapturedURLs(self.path, local=True)
+            store.load()
+        self.assertIsInstance(store.captured, captured_urls.BloomFilter)
+        self.assertTrue(all('http://a/' + str(i) in store for i in range(50)))
+
+    def test_erase(self):
+        store = captured_urls.CapturedURLs(self.path, local=True)
+        store.add('http://a')
+        store.flush()
+        store.erase()
+        self.assertFalse('http://a' in captured_urls.CapturedURLs(self.path, local=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Credentials and clients cached across warm invocations (cloud_clients),
+and the capture-shared layer that ships them.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+import support
+
+cloud_clients = support.load_shared('cloud_clients')
+
+layers_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'layers')
+shared_dir = os.path.join(layers_dir, 'capture-shared', 'python')
+
+
+class TestCached(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        clock    = mock.Mock()
+        clock.time.side_effect = lambda: self.now
+        for patch in [mock.patch.object(cloud_clients, 'time', clock), mock.patch.object(cloud_clients, 'cache', {})]:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.built = []
+
+    def build(self, name):
+        def build():
+            self.built.append(name)
+            return object()
+        return build
+
+    def test_reused_within_ttl(self):
+        client = cloud_clients.cached('bigquery', self.build('bigquery'))
+        self.now = self.now + cloud_clients.ttl
+        self.assertIs(cloud_clients.cached('bigquery', self.build('bigquery')), client)
+        self.assertEqual(self.built, ['bigquery'])
+
+    def test_rebuilt_after_ttl(self):
+        client = cloud_clients.cached('bigquery', self.build('bigquery'))
+        self.now = self.now + cloud_clients.ttl + 1
+        self.assertIsNot(cloud_clients.cached('bigquery', self.build('bigquery')), client)
+        self.assertEqual(self.built, ['bigquery', 'bigquery'])
+        # The new client is kept for another `ttl` seconds:
+        self.now = self.now + cloud_clients.ttl
+        cloud_clients.cached('bigquery', self.build('bigquery'))
+        self.assertEqual(len(self.built), 2)
+
+    def test_nested_build(self):
+        # Building a client may use other cached objects (reentrant lock):
+        key    = cloud_clients.cached('key', self.build('key'))
+        client = cloud_clients.cached('client', lambda: (cloud_clients.cached('key', self.build('key')), object()))
+        self.assertIs(client[0], key)
+        self.assertEqual(self.built, ['key'])
+
+    def test_clear(self):
+        client = cloud_clients.cached('storage', self.build('storage'))
+        cloud_clients.clear()
+        self.assertIsNot(cloud_clients.cached('storage', self.build('storage')), client)
+
+
+@unittest.skipUnless(shutil.which('bash') and shutil.which('zip'), 'requires bash and zip')
+class TestSharedLayer(unittest.TestCase):
+
+    def test_create_shared_layer(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        layers = os.path.join(folder.name, 'layers')
+        shutil.copytree(layers_dir, layers, ignore=shutil.ignore_patterns('*.zip'))
+        os.makedirs(os.path.join(layers, 'capture-shared', 'python', '__pycache__'), exist_ok=True)
+        open(os.path.join(layers, 'capture-shared', 'python', '__pycache__', 'x.pyc'), 'w').close()
+
+        subprocess.run(['bash', 'create_shared_layer.sh'], cwd=layers, check=True, stdout=subprocess.DEVNULL)
+
+        with zipfile.ZipFile(os.path.join(layers, 'capture-shared_lambda_layer.zip')) as layer:
+            names = [name for name in layer.namelist() if not name.endswith('/')]
+        modules = sorted(name for name in os.listdir(shared_dir) if name.endswith('.py'))
+        # Lambda layers are extracted to /opt, and /opt/python is in the path:
+        self.assertEqual(sorted(names), ['python/' + name for name in modules])
+
+    def test_modules_not_copied_into_functions(self):
+        # A copy in a function's folder would shadow the layer's module:
+        modules   = [name for name in os.listdir(shared_dir) if name.endswith('.py')]
+        functions = os.path.join(layers_dir, '..', 'lambda')
+        copies    = [os.path.join(function, name) for function in os.listdir(functions) for name in modules
+                     if os.path.exists(os.path.join(functions, function, name))]
+        self.assertEqual(copies, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
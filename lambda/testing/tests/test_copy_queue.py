@@ -0,0 +1,70 @@
+"""
+Queue of files to copy to Google Storage: LocalQueue, copy_group and drain.
+"""
+
+import unittest
+
+import support
+
+copy_queue = support.load('write-to-storage-gcp', 'copy_queue')
+
+
+def messages(keys):
+    return [{'bucket': 'b', 'key': key} for key in keys]
+
+
+class TestLocalQueue(unittest.TestCase):
+
+    def test_receive_delete_release(self):
+        queue    = copy_queue.LocalQueue(messages(['1', '2', '3']))
+        received = queue.receive(2)
+        self.assertEqual([message['key'] for receipt, message in received], ['1', '2'])
+
+        queue.delete([received[0][0]])
+        queue.release()
+        self.assertEqual([message['key'] for receipt, message in queue.receive(10)], ['3', '2'])
+        self.assertEqual(queue.receive(10), [])
+
+
+class TestCopy(unittest.TestCase):
+
+    def test_copy_group(self):
+        copied = []
+
+        def copy(bucket, key):
+            if key == 'bad':
+                raise Exception('copy failed')
+            copied.append(key)
+
+        self.assertEqual(copy_queue.copy_group(messages(['1', 'bad', '2']), copy, 2), [True, False, True])
+        self.assertEqual(sorted(copied), ['1', '2'])
+        self.assertEqual(copy_queue.copy_group([], copy, 2), [])
+
+    def test_drain(self):
+        queue  = copy_queue.LocalQueue(messages([str(i) for i in range(25)] + ['bad']))
+        copied = []
+
+        def copy(bucket, key):
+            if key == 'bad':
+                raise Exception('copy failed')
+            copied.append(key)
+
+        self.assertEqual(copy_queue.drain(queue, copy, group_size=10, max_workers=4), 25)
+        self.assertEqual(sorted(copied, key=int), [str(i) for i in range(25)])
+        # The failed message is kept to be retried:
+        self.assertEqual(list(queue.in_flight.values()), messages(['bad']))
+
+    def test_drain_keep_going(self):
+        queue = copy_queue.LocalQueue(messages([str(i) for i in range(25)]))
+        calls = []
+
+        def keep_going():
+            calls.append(1)
+            return len(calls) <= 2
+
+        self.assertEqual(copy_queue.drain(queue, lambda bucket, key: None, group_size=10, keep_going=keep_going), 20)
+        self.assertEqual(len(queue.messages), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+capture_dou's listing of DOU articles: the JSON array of articles
+embedded in each listing page.
+"""
+
+import json
+import unittest
+from unittest import mock
+
+import support
+
+articles = [{'urlTitle': 'portaria-n-1-de-2-de-junho-de-2020-259884545', 'pubName': 'DO1',
+             'title': 'PORTARIA Nº 1 [retificada] {extra}', 'content': 'Resolve: "art. 1º" \\ fim'}]
+
+
+def listing_page(script):
+    return ('<html><head><title>Leitura do Jornal</title></head><body>'
+            '<div class="container"><p>DOU</p>' + script + '<script>var x = 1;</script>'
+            '</div></body></html>').encode('utf-8')
+
+
+def params_script(text, attributes='id="params" type="application/json"'):
+    return '<script ' + attributes + '>' + text + '</script>'
+
+
+@unittest.skipUnless(support.has_modules('requests', 'lxml', 'cloudscraper'), 'requires requests, lxml and cloudscraper')
+class TestExtractJSONArray(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.gu = support.load('capture_dou', 'get_articles_url')
+
+    def extract(self, content):
+        """
+        Return the result of `extract_json_array` and whether the page was parsed by lxml.
+        """
+        with mock.patch.object(self.gu.html, 'fromstring', wraps=self.gu.html.fromstring) as fromstring:
+            result = self.gu.extract_json_array(content)
+        return result, fromstring.called
+
+    def old_extract(self, content):
+        # The original extraction, always with lxml:
+        tree = self.gu.html.fromstring(content)
+        return json.loads(tree.xpath('//*[@id="params"]/text()')[0])['jsonArray']
+
+    def test_normal_page(self):
+        content = listing_page(params_script(json.dumps({'jsonArray': articles, 'section': 'do1'})))
+        self.assertEqual(self.extract(content), (articles, False))
+        self.assertEqual(self.old_extract(content), articles)
+
+    def test_other_attributes(self):
+        for attributes in ["type='application/json' id='params'", 'id = "params"', 'class="x" id="params"']:
+            content = listing_page(params_script(json.dumps({'jsonArray': articles}), attributes))
+            self.assertEqual(self.extract(content), (articles, False))
+
+    def test_regex_misses(self):
+        # Attribute without quotes (not found by the scan):
+        content = listing_page(params_script(json.dumps({'jsonArray': articles}), 'id=params'))
+        self.assertEqual(self.extract(content), (articles, True))
+        self.assertEqual(self.old_extract(content), articles)
+
+    def test_closing_tag_inside_strings(self):
+        with_tag = [dict(articles[0], title='PORTARIA <b>Nº 1</b> [1] {2}')]
+        # Escaped as '<\/' (still valid JSON), read by the scan:
+        content  = listing_page(params_script(json.dumps({'jsonArray': with_tag}).replace('</', '<\\/')))
+        self.assertEqual(self.extract(content), (with_tag, False))
+        # Not escaped: the scan stops at '</b>', so lxml is used:
+        content  = listing_page(params_script(json.dumps({'jsonArray': with_tag})))
+        self.assertEqual(self.extract(content), (with_tag, True))
+        self.assertEqual(self.old_extract(content), with_tag)
+
+    def test_escaped_brackets_and_quotes(self):
+        tricky  = [dict(articles[0], title='"]}\\"[{ \\u00e7', content='a\\"]b')]
+        content = listing_page(params_script(json.dumps({'jsonArray': tricky}, ensure_ascii=False)))
+        self.assertEqual(self.extract(content), (tricky, False))
+        self.assertEqual(self.old_extract(content), tricky)
+
+    def test_no_articles(self):
+        content = listing_page(params_script(json.dumps({'jsonArray': []})))
+        self.assertEqual(self.extract(content), ([], False))
+
+    def test_no_params(self):
+        with self.assertRaises(IndexError):
+            self.gu.extract_json_array(listing_page('<p>Erro</p>'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,208 @@
+"""
+http-request's batch mode (many items per invocation, with checkpoints)
+and the paths of its handler, run on a SQLite work queue with the HTTP
+and AWS clients replaced by fakes.
+"""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import fakes
+import support
+
+url = 'https://dadosabertos.camara.leg.br/api/v2/proposicoes/'
+
+
+def item(n, **config):
+    """
+    Work queue item (see parametrize-API-requests' generate_body) to capture
+    the n-th (int) page of the fake API.
+    """
+    return dict({'url': url + str(n), 'params': {}, 'headers': {}, 'bucket': 'brutos-publicos',
+                 'key': 'camara/proposicoes/' + str(n) + '.json', 'data_type': 'json', 'data_path': ['dados'],
+                 'exclude_keys': None, 'records_keys': None, 'name': 'camara-proposicoes', 'requests_pars': None,
+                 'aggregate': None, 'output_format': 'njson', 'aux_data': {}}, **config)
+
+
+def pages(n_items):
+    return {url + str(n): fakes.FakeResponse(data={'dados': [{'id': n}], 'links': []}) for n in range(n_items)}
+
+
+@unittest.skipUnless(support.has_modules('requests', 'xmltodict', 'botocore'), 'requires requests, xmltodict and botocore')
+class HTTPRequestCase(unittest.TestCase):
+
+    n_items = 25
+
+    @classmethod
+    def setUpClass(cls):
+        cls.hr         = support.load('http-request')
+        cls.work_queue = support.load_shared('work_queue')
+
+    def setUp(self):
+        folder     = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.queue = self.work_queue.SQLiteQueue(os.path.join(folder.name, 'queue.sqlite'))
+        self.queue.put_items('q', [item(n) for n in range(self.n_items)])
+        self.aws, self.session = fakes.patch_http_request(self, self.hr, pages(self.n_items), self.queue)
+
+    def params(self, **options):
+        return dict({'queue_backend': 'sqlite', 'queue_id': 'q', 'order': self.n_items - 1}, **options)
+
+    def saved_keys(self):
+        return sorted(key for bucket, key in self.aws.clients['s3'].objects)
+
+    def invocations(self, function):
+        return [payload for name, payload in self.aws.clients['lambda'].invocations if name == function]
+
+
+class TestBatchHelpers(HTTPRequestCase):
+
+    def test_order_ranges(self):
+        self.assertEqual(list(self.hr.order_ranges(24, 10)),
+                         [list(range(24, 14, -1)), list(range(14, 4, -1)), [4, 3, 2, 1, 0]])
+        self.assertEqual(list(self.hr.order_ranges(0, 10)), [[0]])
+
+    def test_prefetch_params(self):
+        loaded = []
+        ranges = list(self.hr.order_ranges(24, 10))
+        events = self.hr.prefetch_params(self.params(), ranges)
+
+        with mock.patch.object(self.hr, 'batch_load_params', lambda params, orders: loaded.append(orders) or orders):
+            orders, items = next(events)
+            self.assertEqual(orders, ranges[0])
+            # The next range is loaded while the first one is being captured:
+            for _ in range(100):
+                if len(loaded) == 2:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(loaded, ranges[:2])
+            self.assertEqual([orders for orders, items in events], ranges[1:])
+
+    def test_prefetch_params_items(self):
+        self.queue.delete('q')
+        self.queue.put_items('q', [item(n) for n in [0, 1, 2]])
+        self.queue.put_items('q', [item(4)], first_order=4)
+
+        result = list(self.hr.prefetch_params(self.params(), self.hr.order_ranges(4, 3)))
+        self.assertEqual([orders for orders, items in result], [[4, 3, 2], [1, 0]])
+        # Missing orders come as None:
+        self.assertEqual([[i and i['url'] for i in items] for orders, items in result],
+                         [[url + '4', None, url + '2'], [url + '1', url + '0']])
+
+    def test_host_semaphore(self):
+        semaphore = self.hr.host_semaphore(url + '1', 4)
+        self.assertIs(self.hr.host_semaphore(url + '2', 4), semaphore)
+        # Another limit (from an event with another 'max_per_host') or host gets its own semaphore:
+        self.assertIsNot(self.hr.host_semaphore(url + '1', 2), semaphore)
+        self.assertIsNot(self.hr.host_semaphore('https://www.in.gov.br/', 4), semaphore)
+
+
+class TestCaptureBatch(HTTPRequestCase):
+
+    def test_captures_all(self):
+        params = self.hr.capture_batch(self.params(batch_size=10), {})
+        self.assertEqual(params['order'], 0)
+        self.assertEqual(self.saved_keys(), sorted('camara/proposicoes/' + str(n) + '.json' for n in range(25)))
+        self.assertEqual(len(self.invocations('write-to-storage-gcp')), 25)
+
+    def test_stops_when_time_runs_low(self):
+        context = mock.Mock()
+        context.get_remaining_time_in_millis.side_effect = [10 * self.hr.min_remaining_ms, self.hr.min_remaining_ms - 1]
+
+        params = self.hr.capture_batch(self.params(batch_size=10), context)
+
+        # Checkpoint: the last order of the second range:
+        self.assertEqual(params['order'], 5)
+        self.assertEqual(self.saved_keys(), sorted('camara/proposicoes/' + str(n) + '.json' for n in range(5, 25)))
+
+    def test_failed_items_do_not_stop_the_batch(self):
+        captured = []
+        lock     = threading.Lock()
+
+        def capture_event(params, event):
+            if params['order'] == 20:
+                raise Exception('capture failed')
+            with lock:
+                captured.append(params['order'])
+
+        with mock.patch.object(self.hr, 'capture_event', capture_event):
+            params = self.hr.capture_batch(self.params(batch_size=10, max_workers=3), {})
+
+        self.assertEqual(params['order'], 0)
+        self.assertEqual(sorted(captured), [n for n in range(25) if n != 20])
+
+    def test_max_workers(self):
+        running  = []
+        max_seen = []
+        lock     = threading.Lock()
+
+        def capture_event(params, event):
+            with lock:
+                running.append(1)
+                max_seen.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.pop()
+
+        with mock.patch.object(self.hr, 'capture_event', capture_event):
+            self.hr.capture_batch(self.params(batch_size=10, max_workers=3), {})
+
+        self.assertEqual(len(max_seen), 25)
+        self.assertLessEqual(max(max_seen), 3)
+
+
+class TestHandler(HTTPRequestCase):
+
+    def test_single_item(self):
+        self.hr.lambda_handler(self.params(order=7), {})
+
+        self.assertEqual(self.saved_keys(), ['camara/proposicoes/7.json'])
+        self.assertEqual(self.aws.clients['s3'].objects[('brutos-publicos', 'camara/proposicoes/7.json')][:9],
+                         b'{"id": 7,')
+        self.assertEqual(self.invocations('write-to-storage-gcp'),
+                         [{'order': 7, 'bucket': 'brutos-publicos', 'key': 'camara/proposicoes/7.json'}])
+        # The next item is captured by a new invocation:
+        self.assertEqual(self.invocations('http-request'), [self.params(order=6)])
+
+    def test_batch_mode_continues_from_checkpoint(self):
+        context = mock.Mock()
+        context.get_remaining_time_in_millis.return_value = self.hr.min_remaining_ms - 1
+
+        self.hr.lambda_handler(self.params(batch_size=10), context)
+
+        self.assertEqual(len(self.saved_keys()), 10)
+        self.assertEqual(self.invocations('http-request'), [self.params(batch_size=10, order=14)])
+
+    def test_batch_mode_deletes_finished_queue(self):
+        self.hr.lambda_handler(self.params(batch_size=10), {})
+
+        self.assertEqual(len(self.saved_keys()), 25)
+        self.assertEqual(self.invocations('http-request'), [])
+        self.assertEqual(self.queue.get_items('q', [0, 24]), [None, None])
+
+    def test_aggregate_requires_batch_mode(self):
+        self.queue.put_items('q', [item(7, aggregate={'prefix': 'camara/proposicoes/'})], first_order=7)
+
+        self.hr.lambda_handler(self.params(order=7), {})
+
+        # The item is not captured, but the chain goes on:
+        self.assertEqual(self.saved_keys(), [])
+        self.assertEqual(self.invocations('http-request'), [self.params(order=6)])
+
+    def test_missing_item(self):
+        self.hr.lambda_handler(self.params(order=30), {})
+        self.assertEqual(self.saved_keys(), [])
+        self.assertEqual(self.invocations('http-request'), [self.params(order=29)])
+
+    def test_event_as_params(self):
+        self.hr.lambda_handler(item(3), {})
+        self.assertEqual(self.saved_keys(), ['camara/proposicoes/3.json'])
+        self.assertEqual(self.invocations('http-request'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
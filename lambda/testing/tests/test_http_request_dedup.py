@@ -0,0 +1,109 @@
+"""
+Deduplication in http-request: data equal to the last capture saved to
+the same S3 key is not saved again.
+"""
+
+import contextlib
+import io
+import json
+import unittest
+from unittest import mock
+
+import fakes
+from test_http_request_batch import HTTPRequestCase, item, url
+
+
+class TestDedupHelpers(HTTPRequestCase):
+
+    def test_records_hash(self):
+        records = [{'id': 1, 'nome': 'PL 1/2020', 'capture_date': '2020-06-01 10:00:00'}, {'id': 2}]
+        same    = [{'capture_date': '2020-06-02 11:00:00', 'nome': 'PL 1/2020', 'id': 1}, {'id': 2}]
+        self.assertEqual(self.hr.records_hash(same), self.hr.records_hash(records))
+        self.assertNotEqual(self.hr.records_hash([records[0], {'id': 3}]), self.hr.records_hash(records))
+        self.assertNotEqual(self.hr.records_hash(records[::-1]), self.hr.records_hash(records))
+        self.assertNotEqual(self.hr.records_hash(records[:1]), self.hr.records_hash(records))
+        # Not dicts:
+        self.assertEqual(self.hr.records_hash(['a', 1]), self.hr.records_hash(['a', 1]))
+
+    def test_saved_object_exists(self):
+        event = {'bucket': 'brutos-publicos', 'key': 'camara/proposicoes/1.json'}
+        s3    = self.aws.clients['s3']
+        self.assertFalse(self.hr.saved_object_exists(event, '"e1"'))
+        s3.put_object(Body=b'{"id": 1}', Bucket=event['bucket'], Key=event['key'])
+        etag = s3.etag(event['bucket'], event['key'])
+        self.assertTrue(self.hr.saved_object_exists(event, etag))
+        self.assertFalse(self.hr.saved_object_exists(event, None))
+        # Overwritten by something else:
+        s3.put_object(Body=b'{"id": 2}', Bucket=event['bucket'], Key=event['key'])
+        self.assertFalse(self.hr.saved_object_exists(event, etag))
+
+
+class TestDeduplicate(HTTPRequestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.registered = []
+        store = mock.Mock()
+        store.add.side_effect = self.registered.append
+        for patch in [mock.patch.object(self.hr.captured_urls, 'get_store', lambda url_list: store),
+                      mock.patch.object(self.hr, 'dedup_counts', {})]:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.event = item(1, deduplicate=True, aux_data={'url_list': 'dou-urls'})
+        self.s3    = self.aws.clients['s3']
+
+    def capture(self):
+        self.hr.capture_event({'order': 1}, self.event)
+
+    def metrics(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.hr.emit_dedup_metrics()
+        return [json.loads(line) for line in output.getvalue().splitlines()]
+
+    def test_unchanged_payload(self):
+        self.capture()
+        self.capture()
+        # Saved (and copied to GCP) only once, but registered both times:
+        self.assertEqual(self.s3.puts, ['camara/proposicoes/1.json'])
+        self.assertEqual(len(self.invocations('write-to-storage-gcp')), 1)
+        self.assertEqual(self.registered, [url + '1', url + '1'])
+
+    def test_changed_payload(self):
+        self.capture()
+        self.session.pages[url + '1'] = fakes.FakeResponse(data={'dados': [{'id': 1, 'nome': 'new'}], 'links': []})
+        self.capture()
+        self.assertEqual(self.s3.puts, ['camara/proposicoes/1.json'] * 2)
+        self.assertEqual(json.loads(self.s3.objects[('brutos-publicos', 'camara/proposicoes/1.json')])['nome'], 'new')
+        self.assertEqual(len(self.invocations('write-to-storage-gcp')), 2)
+
+    def test_deleted_object(self):
+        self.capture()
+        del self.s3.objects[('brutos-publicos', 'camara/proposicoes/1.json')]
+        self.capture()
+        self.assertEqual(self.s3.puts, ['camara/proposicoes/1.json'] * 2)
+
+    def test_switched_off(self):
+        self.event = dict(self.event, deduplicate=False)
+        self.capture()
+        self.capture()
+        self.assertEqual(self.s3.puts, ['camara/proposicoes/1.json'] * 2)
+        self.assertEqual(self.metrics(), [])
+
+    def test_metrics(self):
+        self.capture()
+        self.capture()
+        self.capture()
+        metrics, = self.metrics()
+        self.assertEqual((metrics['name'], metrics['UnchangedFiles'], metrics['WrittenFiles']),
+                         ('camara-proposicoes', 2, 1))
+        directive, = metrics['_aws']['CloudWatchMetrics']
+        self.assertEqual(directive['Namespace'], 'capturaAWS/http-request')
+        self.assertEqual(directive['Dimensions'], [['name']])
+        self.assertEqual(sorted(metric['Name'] for metric in directive['Metrics']), ['UnchangedFiles', 'WrittenFiles'])
+        # The counts restart after being emitted:
+        self.assertEqual(self.metrics(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
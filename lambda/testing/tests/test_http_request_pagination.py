@@ -0,0 +1,111 @@
+"""
+Paginated captures in http-request: the key of each page (for every
+output format) and the pages followed by `capture_event`, including
+pages not modified since the last capture (304).
+"""
+
+import gzip
+import json
+import unittest
+
+import fakes
+from test_http_request_batch import HTTPRequestCase, item, url
+
+
+def api_page(n, last=3, etag=None):
+    """
+    Page `n` (int) of the fake API, with a 'next' link unless it is the
+    `last` (int) one. If `etag` (str) is given, the page answers 304 to
+    GETs with that ETag in If-None-Match.
+    """
+    links = [{'rel': 'self', 'href': url + '1?pagina=' + str(n)}]
+    if n < last:
+        links.append({'rel': 'next', 'href': url + '1?pagina=' + str(n + 1)})
+    data = {'dados': [{'id': n}], 'links': links}
+
+    def respond(headers):
+        if etag != None and headers.get('If-None-Match') == etag:
+            return fakes.FakeResponse(304, text='')
+        return fakes.FakeResponse(data=data, headers={'ETag': etag} if etag != None else {})
+
+    return respond
+
+
+class TestGetNextPage(HTTPRequestCase):
+
+    def next_key(self, key, page=2):
+        data = {'dados': [], 'links': [{'rel': 'next', 'href': url + '?itens=100&pagina=' + str(page)}]}
+        return self.hr.get_next_page({'key': key}, data)['key']
+
+    def test_suffixes(self):
+        self.assertEqual(self.next_key('camara/p.json'), 'camara/p_p2.json')
+        self.assertEqual(self.next_key('camara/p.json.gz'), 'camara/p_p2.json.gz')
+        self.assertEqual(self.next_key('camara/p.json.zst'), 'camara/p_p2.json.zst')
+        self.assertEqual(self.next_key('camara/p.parquet'), 'camara/p_p2.parquet')
+
+    def test_next_pages(self):
+        self.assertEqual(self.next_key('camara/p_p2.json', 3), 'camara/p_p3.json')
+        self.assertEqual(self.next_key('camara/p_p9.json.gz', 10), 'camara/p_p10.json.gz')
+        self.assertEqual(self.next_key('camara/p_p2.parquet', 3), 'camara/p_p3.parquet')
+        # Only the end of the key is changed:
+        self.assertEqual(self.next_key('camara/a.json/p_p2.json', 3), 'camara/a.json/p_p3.json')
+
+    def test_url(self):
+        data = {'dados': [], 'links': [{'rel': 'next', 'href': url + '?pagina=2'}]}
+        self.assertEqual(self.hr.get_next_page({'key': 'p.json'}, data), {'key': 'p_p2.json', 'url': url + '?pagina=2'})
+
+    def test_no_next_page(self):
+        self.assertEqual(self.hr.get_next_page({'key': 'p.json'}, {'dados': [], 'links': [{'rel': 'self', 'href': url}]}), None)
+        self.assertEqual(self.hr.get_next_page({'key': 'p.json'}, {'dados': []}), None)
+        self.assertEqual(self.hr.get_next_page({'key': 'p.json'}, None), None)
+        self.assertEqual(self.hr.get_next_page({'key': 'p.json'}, [{'links': []}]), None)
+
+    def test_many_next_pages(self):
+        data = {'links': [{'rel': 'next', 'href': url + '?pagina=2'}, {'rel': 'next', 'href': url + '?pagina=3'}]}
+        with self.assertRaises(Exception):
+            self.hr.get_next_page({'key': 'p.json'}, data)
+
+
+class TestCaptureEvent(HTTPRequestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.session.pages.update({url + '1': api_page(1, etag='"e1"'),
+                                   url + '1?pagina=2': api_page(2, etag='"e2"'),
+                                   url + '1?pagina=3': api_page(3, etag='"e3"')})
+
+    def saved(self, key):
+        return [json.loads(line) for line in gzip.decompress(self.aws.clients['s3'].objects[('brutos-publicos', key)]).splitlines()]
+
+    def test_follows_pages(self):
+        event = item(1, output_format='njson.gz', key='camara/proposicoes/1.json.gz')
+        self.hr.capture_event({'order': 1}, event)
+
+        self.assertEqual(self.saved_keys(), ['camara/proposicoes/1.json.gz', 'camara/proposicoes/1_p2.json.gz',
+                                             'camara/proposicoes/1_p3.json.gz'])
+        self.assertEqual([self.saved(key)[0]['id'] for key in self.saved_keys()], [1, 2, 3])
+        self.assertEqual(self.saved('camara/proposicoes/1_p2.json.gz')[0]['api_url'], url + '1?pagina=2')
+        # Each page is downloaded once:
+        self.assertEqual([get['url'] for get in self.session.gets], [url + '1', url + '1?pagina=2', url + '1?pagina=3'])
+
+    def test_not_modified_pages(self):
+        event = item(1, conditional_get=True)
+        self.hr.capture_event({'order': 1}, event)
+        s3     = self.aws.clients['s3']
+        before = dict(s3.objects)
+        s3.puts.clear()
+
+        # Only the second page changes:
+        self.session.pages[url + '1?pagina=2'] = api_page(2, etag='"e2-new"')
+        self.hr.capture_event({'order': 1}, event)
+
+        # The first page (304) is not saved again, but the next pages (from its
+        # last capture) are still checked:
+        self.assertEqual([get['url'] for get in self.session.gets[3:]], [url + '1', url + '1?pagina=2', url + '1?pagina=3'])
+        self.assertEqual(s3.puts, ['camara/proposicoes/1_p2.json'])
+        self.assertEqual(s3.objects[('brutos-publicos', 'camara/proposicoes/1.json')],
+                         before[('brutos-publicos', 'camara/proposicoes/1.json')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""
+Registry of pooled HTTP sessions shared by the requests to each host.
+"""
+
+import unittest
+from unittest import mock
+
+import support
+
+
+@unittest.skipUnless(support.has_module('requests'), 'requires requests')
+class TestHTTPSessions(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.hs = support.load_shared('http_sessions')
+
+    def setUp(self):
+        patch = mock.patch.object(self.hs, 'sessions', {})
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_one_session_per_scheme_and_host(self):
+        session = self.hs.get_session('https://dadosabertos.camara.leg.br/api/v2/proposicoes?pagina=2')
+        self.assertIs(self.hs.get_session('https://dadosabertos.camara.leg.br/api/v2/deputados'), session)
+        self.assertIsNot(self.hs.get_session('http://dadosabertos.camara.leg.br/api/v2/deputados'), session)
+        self.assertIsNot(self.hs.get_session('https://www.in.gov.br/leiturajornal'), session)
+        self.assertEqual(sorted(self.hs.sessions), ['http://dadosabertos.camara.leg.br', 'https://dadosabertos.camara.leg.br',
+                                                    'https://www.in.gov.br'])
+
+    def test_adapters(self):
+        session = self.hs.get_session('https://www.in.gov.br/leiturajornal')
+        for prefix in ['http://', 'https://']:
+            adapter = session.get_adapter(prefix + 'www.in.gov.br/')
+            self.assertEqual(adapter._pool_maxsize, self.hs.pool_maxsize)
+            retry = adapter.max_retries
+            self.assertEqual((retry.total, retry.connect, retry.read), (self.hs.max_retries,) * 3)
+            self.assertEqual(retry.backoff_factor, self.hs.backoff_factor)
+            self.assertEqual(sorted(retry.status_forcelist), self.hs.status_forcelist)
+            self.assertFalse(retry.raise_on_status)
+
+    def test_close_sessions(self):
+        session = self.hs.get_session('https://www.in.gov.br/leiturajornal')
+        with mock.patch.object(session, 'close') as close:
+            self.hs.close_sessions()
+        close.assert_called_once_with()
+        self.assertEqual(self.hs.sessions, {})
+        self.assertIsNot(self.hs.get_session('https://www.in.gov.br/leiturajornal'), session)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Keyword filters compiled with keyword_matcher, compared with the filtering
+done (one bot and one filter at a time) before the filters were compiled.
+"""
+
+import random
+import unittest
+
+import support
+
+km = support.load_shared('keyword_matcher')
+
+
+def reference_select(bot_info, rows):
+    """
+    The rows (list of dicts) selected by `bot_info`, as filtered before
+    keyword_matcher.
+    """
+    for f in bot_info['filters']:
+        rows = [x for x in rows if x[f['column_name']] is not None]
+        if 'positive_filter' in f:
+            rows = [x for x in rows if any([var.lower() in x[f['column_name']].lower() for var in f['positive_filter']])]
+        if 'negative_filter' in f:
+            rows = [x for x in rows if all([var.lower() not in x[f['column_name']].lower() for var in f['negative_filter']])]
+    return rows
+
+
+class TestKeywordMatcher(unittest.TestCase):
+
+    def test_overlapping_keywords(self):
+        matcher = km.KeywordMatcher(['he', 'she', 'his', 'hers'])
+        found   = matcher.find('ushers')
+        self.assertEqual({matcher.keywords[i] for i in found}, {'he', 'she', 'hers'})
+        self.assertEqual(matcher.find('xyz'), set())
+
+    def test_empty_and_repeated_keywords(self):
+        matcher = km.KeywordMatcher(['', 'ab', 'ab'])
+        self.assertEqual(matcher.keywords, ['', 'ab'])
+        self.assertEqual(matcher.find('xyz'), {0})
+        self.assertEqual(matcher.find('cab'), {0, 1})
+
+    def test_random_texts(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            keywords = [''.join(rng.choice('abc') for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 8))]
+            text     = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 30)))
+            matcher  = km.KeywordMatcher(keywords)
+            self.assertEqual({matcher.keywords[i] for i in matcher.find(text)},
+                             {keyword for keyword in keywords if keyword in text})
+
+
+class TestFilterSets(unittest.TestCase):
+
+    def test_same_as_reference(self):
+        rng     = random.Random(1)
+        words   = ['Ministério', 'saúde', 'educação', 'PORTARIA', 'decreto', 'ção', 'lei', '']
+        columns = ['ementa', 'orgao']
+
+        def keywords():
+            return [rng.choice(words) for _ in range(rng.randint(0, 3))]
+
+        rows = [{column: None if rng.random() < 0.1 else ' '.join(rng.choice(words) for _ in range(rng.randint(0, 6)))
+                 for column in columns} for _ in range(200)]
+
+        bot_infos = []
+        for _ in range(50):
+            filters = []
+            for column in rng.sample(columns, rng.randint(0, 2)):
+                f = {'column_name': column}
+                if rng.random() < 0.8:
+                    f['positive_filter'] = keywords()
+                if rng.random() < 0.5:
+                    f['negative_filter'] = keywords()
+                filters.append(f)
+            bot_infos.append({'filters': filters})
+
+        selected = km.FilterSets(bot_infos).select(rows)
+        for bot_info, rows_selected in zip(bot_infos, selected):
+            self.assertEqual(rows_selected, reference_select(bot_info, rows))
+
+    def test_none_column(self):
+        bot_infos = [{'filters': [{'column_name': 'ementa', 'negative_filter': ['x']}]}]
+        self.assertEqual(km.FilterSets(bot_infos).matches({'ementa': None}), [False])
+        self.assertEqual(km.FilterSets(bot_infos).matches({'ementa': 'abc'}), [True])
+
+
+if __name__ == '__main__':
+    unittest.main()
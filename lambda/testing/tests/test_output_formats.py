@@ -0,0 +1,60 @@
+"""
+Encoding of captured records in the output formats.
+"""
+
+import gzip
+import io
+import json
+import unittest
+
+import support
+
+output_formats = support.load_shared('output_formats')
+
+lines = [json.dumps({'a': 1, 'b': 'ação'}, ensure_ascii=False), json.dumps({'a': None, 'c': {'d': [1, 2]}})]
+
+
+class TestOutputFormats(unittest.TestCase):
+
+    def test_get_format(self):
+        self.assertEqual(output_formats.get_format({}), 'njson')
+        self.assertEqual(output_formats.get_format({'output_format': None}), 'njson')
+        self.assertEqual(output_formats.get_format({'output_format': 'parquet'}), 'parquet')
+
+    def test_output_key(self):
+        self.assertEqual(output_formats.output_key('a/b.json'), 'a/b.json')
+        self.assertEqual(output_formats.output_key('a/b.json', 'njson.gz'), 'a/b.json.gz')
+        self.assertEqual(output_formats.output_key('a/b', 'parquet'), 'a/b.parquet')
+        with self.assertRaises(Exception):
+            output_formats.output_key('a/b.json', 'csv')
+
+    def test_njson(self):
+        self.assertEqual(output_formats.encode_lines(lines), '\n'.join(lines).encode('utf-8'))
+        self.assertEqual(gzip.decompress(output_formats.encode_lines(lines, 'njson.gz')), '\n'.join(lines).encode('utf-8'))
+
+    def test_encode_records(self):
+        records = [json.loads(line) for line in lines]
+        self.assertEqual(output_formats.encode_records(records), output_formats.encode_lines(lines))
+
+    def test_to_string(self):
+        self.assertEqual([output_formats.to_string(v) for v in [None, 'x', 1, {'a': 'ç'}]], [None, 'x', '1', '{"a": "ç"}'])
+
+    @unittest.skipUnless(support.has_module('pyarrow'), 'requires pyarrow')
+    def test_parquet_schema(self):
+        import pyarrow.parquet as pq
+
+        # Without 'output_schema', all columns are strings, whatever the values:
+        table = pq.read_table(io.BytesIO(output_formats.encode_lines(lines, 'parquet')))
+        self.assertEqual([str(field.type) for field in table.schema], ['string', 'string', 'string'])
+        self.assertEqual(table.to_pylist(), [{'a': '1', 'b': 'ação', 'c': None},
+                                             {'a': None, 'b': None, 'c': '{"d": [1, 2]}'}])
+
+        # Declared columns come first, with their types, even if missing:
+        table = pq.read_table(io.BytesIO(output_formats.encode_lines(lines, 'parquet', {'z': 'double', 'a': 'int64'})))
+        self.assertEqual([(field.name, str(field.type)) for field in table.schema],
+                         [('z', 'double'), ('a', 'int64'), ('b', 'string'), ('c', 'string')])
+        self.assertEqual(table.column('a').to_pylist(), [1, None])
+
+
+if __name__ == '__main__':
+    unittest.main()
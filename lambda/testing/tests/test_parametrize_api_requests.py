@@ -0,0 +1,258 @@
+"""
+parametrize-API-requests: URLs and filenames built from query results
+(compared with the original row-by-row code), items skipped in
+incremental mode and creation of the work queues listing the items to
+capture.
+"""
+
+import datetime
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import support
+
+parametrize = support.load('parametrize-API-requests')
+
+
+# Query results (by column) with missing values and non-string columns:
+names   = ['id', 'sigla', 'data']
+columns = {'id': [1, 22, None], 'sigla': ['PL', None, 'PEC'],
+           'data': [datetime.date(2020, 1, 2), datetime.date(2021, 3, 4), None]}
+
+
+def rows(columns):
+    return [dict(zip(columns.keys(), row)) for row in zip(*columns.values())]
+
+
+def old_forms_bigquery(par, item, data):
+    """
+    The original forms_bigquery, row by row (with `data` as the query result).
+    """
+    forms = []
+    for d in data:
+        end_filename = '/'.join(map(lambda x: '='.join(map(str, x)), zip(par['url_params'], list(d.values()))))
+        filename = '/'.join(map(str, [item['name'], end_filename])) + '.json'
+        url = item['url'] % dict(zip(par['url_params'], list(d.values())))
+        d = dict(d, url=url, filename=filename)
+        forms.append(d)
+    return forms
+
+
+def old_forms_athena_query(par, item, data):
+    """
+    The original forms_athena_query, row by row (with `data` as the query result).
+    """
+    forms = []
+    for d in data:
+        if len(d) > 1:
+            end_filename = '&'.join(map(lambda x: '='.join(map(str, x)), zip(par['url_params'], list(d))))
+        else:
+            end_filename = d[0]
+        forms.append({'url': item['url'] % dict(zip(par['url_params'], list(d))),
+                      'filename': '_'.join(map(str, [item['name'], end_filename])) + '.json'})
+    return forms
+
+
+class TestFillTemplate(unittest.TestCase):
+
+    def assert_row_by_row(self, template, columns):
+        expected = [template % row for row in rows(columns)]
+        self.assertEqual(parametrize.fill_template(template, columns), expected)
+
+    def test_string_fields(self):
+        self.assert_row_by_row('https://api/proposicoes?id=%(id)s&sigla=%(sigla)s', columns)
+        self.assert_row_by_row('%(data)s/%(id)s', columns)
+        self.assert_row_by_row('%(id)s%(id)s', columns)
+        self.assert_row_by_row('https://api/proposicoes', columns)
+
+    def test_other_specifiers(self):
+        # Filled row by row:
+        self.assert_row_by_row('https://api/%(id)r?p=%(sigla)s', columns)
+        self.assert_row_by_row('https://api/%%20%(sigla)s', columns)
+        self.assertEqual(parametrize.fill_template('%(n)05d', {'n': [1, 22]}), ['00001', '00022'])
+
+    def test_missing_field(self):
+        with self.assertRaises(KeyError):
+            parametrize.fill_template('%(other)s', columns)
+
+    def test_no_rows(self):
+        self.assertEqual(parametrize.fill_template('%(id)s', {'id': []}), [])
+
+
+class TestJoinColumns(unittest.TestCase):
+
+    def test_row_by_row(self):
+        values = [columns[name] for name in names]
+        for sep in ['/', '&']:
+            expected = [sep.join(map(lambda x: '='.join(map(str, x)), zip(names, row))) for row in zip(*values)]
+            self.assertEqual(parametrize.join_columns(names, values, 3, sep), expected)
+
+    def test_no_columns(self):
+        self.assertEqual(parametrize.join_columns([], [], 2, '/'), ['', ''])
+
+
+class TestFormsFromQueries(unittest.TestCase):
+
+    item = {'name': 'camara-proposicoes', 'url': 'https://api/proposicoes?id=%(id)s&sigla=%(sigla)s&data=%(data)s'}
+    par  = {'query': 'SELECT %(cols)s FROM t', 'query_config': {'cols': '*'}, 'url_params': names}
+
+    def test_forms_bigquery(self):
+        with mock.patch.object(parametrize, 'query_bigquery_columns', return_value=(names, columns)):
+            forms = list(parametrize.forms_bigquery(self.par, self.item))
+        self.assertEqual(forms, old_forms_bigquery(self.par, self.item, rows(columns)))
+
+    def test_forms_athena_query(self):
+        with mock.patch.object(parametrize, 'query_athena_columns', return_value=(names, columns)):
+            forms = list(parametrize.forms_athena_query(self.par, self.item))
+        self.assertEqual(forms, old_forms_athena_query(self.par, self.item, list(zip(*columns.values()))))
+
+    def test_forms_athena_query_one_column(self):
+        par  = dict(self.par, url_params=['id'])
+        item = dict(self.item, url='https://api/proposicoes/%(id)s')
+        with mock.patch.object(parametrize, 'query_athena_columns', return_value=(['id'], {'id': [1, None]})):
+            forms = list(parametrize.forms_athena_query(par, item))
+        self.assertEqual(forms, old_forms_athena_query(par, item, [(1,), (None,)]))
+
+    def test_reserved_names(self):
+        with mock.patch.object(parametrize, 'query_bigquery_columns', return_value=(['url'], {'url': ['x']})):
+            with self.assertRaises(Exception):
+                list(parametrize.forms_bigquery(dict(self.par, url_params=['url']), self.item))
+
+
+event = {'table_name': 'capture_urls',
+         'key': {'name': {'S': 'camara-deputados-detalhes'}, 'capture_type': {'S': 'historical'}}}
+
+
+class TestQueueBackend(unittest.TestCase):
+
+    def test_read_queue_backend(self):
+        self.assertEqual(parametrize.read_queue_backend({'Item': {}}), 'partitioned')
+        self.assertEqual(parametrize.read_queue_backend({'Item': {'queue_backend': 'temp_table'}}), 'temp_table')
+        with mock.patch.object(parametrize, 'local', True):
+            self.assertEqual(parametrize.read_queue_backend({'Item': {}}), 'sqlite')
+
+    def test_new_queue_id(self):
+        queue_id = parametrize.new_queue_id(event, 2, 'partitioned')
+        self.assertRegex(queue_id, r'^capture-camara-deputados-detalhes-historical-[0-9-]{19}-2$')
+        # Temp tables are found by their prefix:
+        self.assertEqual(parametrize.new_queue_id(event, 2, 'temp_table')[:5], 'temp-')
+
+
+class TestSkipCaptured(unittest.TestCase):
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    def days_ago(self, days):
+        return self.now - datetime.timedelta(days=days)
+
+    def kept(self, keys, existing, max_age_days=None):
+        body = ({'key': key} for key in keys)
+        return [entry['key'] for entry in parametrize.skip_captured(body, existing, max_age_days)]
+
+    def test_captured_key(self):
+        self.assertEqual(parametrize.captured_key('camara/p/1.json'), 'camara/p/1.json')
+        self.assertEqual(parametrize.captured_key('camara/p/1.json.gz'), 'camara/p/1.json')
+        self.assertEqual(parametrize.captured_key('camara/p/1.json.zst'), 'camara/p/1.json')
+        self.assertEqual(parametrize.captured_key('camara/p/1.parquet'), 'camara/p/1.json')
+        self.assertEqual(parametrize.captured_key('camara/p/1_p2.json'), 'camara/p/1.json')
+        self.assertEqual(parametrize.captured_key('camara/p/1_p12.json.gz'), 'camara/p/1.json')
+        self.assertEqual(parametrize.captured_key('camara/p_1/manifest.txt'), 'camara/p_1/manifest.txt')
+
+    def test_exact_keys(self):
+        existing = {'p/1.json': self.days_ago(1), 'p/2.json': self.days_ago(1)}
+        self.assertEqual(self.kept(['p/1.json', 'p/3.json', 'p/2.json'], existing), ['p/3.json'])
+
+    def test_suffixed_keys(self):
+        existing = {'p/1.json.gz': self.days_ago(1), 'p/2_p2.json': self.days_ago(1),
+                    'p/3.parquet': self.days_ago(1), 'p/4_p3.json.gz': self.days_ago(1)}
+        self.assertEqual(self.kept(['p/1.json.gz', 'p/2.json', 'p/3.json', 'p/4.json.gz', 'p/5.json.gz'], existing),
+                         ['p/5.json.gz'])
+        # The key of the item is normalised too:
+        self.assertEqual(self.kept(['p/1_p2.json', 'p/6.parquet'], existing), ['p/6.parquet'])
+
+    def test_max_age_days(self):
+        existing = {'p/1.json': self.days_ago(40), 'p/2.json': self.days_ago(10),
+                    # The most recent page counts:
+                    'p/3.json': self.days_ago(40), 'p/3_p2.json': self.days_ago(5)}
+        self.assertEqual(self.kept(['p/1.json', 'p/2.json', 'p/3.json'], existing, 30), ['p/1.json'])
+        self.assertEqual(self.kept(['p/1.json', 'p/2.json', 'p/3.json'], existing, 7), ['p/1.json', 'p/2.json'])
+        self.assertEqual(self.kept(['p/1.json', 'p/2.json', 'p/3.json'], existing), [])
+
+
+class TestCreateAndPopulateQueues(unittest.TestCase):
+
+    def setUp(self):
+        folder        = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.queue    = parametrize.work_queue.SQLiteQueue(os.path.join(folder.name, 'queue.sqlite'))
+        self.puts     = []
+        self.deleted  = []
+        self.consumed = 0
+        put_items, delete = self.queue.put_items, self.queue.delete
+
+        def record_put(queue_id, items, first_order=0):
+            self.puts.append((queue_id[-1], first_order, len(items), self.consumed))
+            put_items(queue_id, items, first_order)
+
+        def record_delete(queue_id):
+            self.deleted.append(queue_id[-1])
+            delete(queue_id)
+
+        for patch in [mock.patch.object(parametrize.work_queue, 'queues', {'sqlite': self.queue}),
+                      mock.patch.object(parametrize, 'write_chunk_size', 2),
+                      mock.patch.object(self.queue, 'put_items', record_put),
+                      mock.patch.object(self.queue, 'delete', record_delete)]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def body(self, n):
+        for i in range(n):
+            self.consumed = self.consumed + 1
+            yield {'url': 'https://api/' + str(i)}
+
+    def urls(self, params):
+        orders = range(params['order'] + 1)
+        return [item['url'][12:] for item in self.queue.get_items(params['queue_id'], orders)]
+
+    def test_round_robin(self):
+        all_params = parametrize.create_and_populate_queues(self.body(7), event, 3, 'sqlite')
+        self.assertEqual([params['queue_backend'] for params in all_params], ['sqlite'] * 3)
+        self.assertEqual([params['queue_id'][-1] for params in all_params], ['0', '1', '2'])
+        self.assertEqual([self.urls(params) for params in all_params], [['0', '3', '6'], ['1', '4'], ['2', '5']])
+
+    def test_write_chunks(self):
+        parametrize.create_and_populate_queues(self.body(7), event, 2, 'sqlite')
+        # Each queue is written in chunks of `write_chunk_size` items as soon as they
+        # are generated (the fourth value is the number of items generated so far),
+        # then what is left:
+        self.assertEqual(self.puts, [('0', 0, 2, 3), ('1', 0, 2, 4), ('0', 2, 2, 7), ('0', 4, 0, 7), ('1', 2, 1, 7)])
+
+    def test_empty_queues_are_deleted(self):
+        all_params = parametrize.create_and_populate_queues(self.body(2), event, 4, 'sqlite')
+        self.assertEqual([params['queue_id'][-1] for params in all_params], ['0', '1'])
+        self.assertEqual(self.deleted, ['2', '3'])
+
+    def test_create_max_wait(self):
+        with mock.patch.object(self.queue, 'create') as create:
+            parametrize.create_and_populate_queues(self.body(2), event, 2, 'sqlite', 42)
+        self.assertEqual(sorted(call[0][1] for call in create.call_args_list), [42, 42])
+
+
+class TestQueueMaxWait(unittest.TestCase):
+
+    def test_lambda_context(self):
+        context = mock.Mock()
+        context.get_remaining_time_in_millis.return_value = parametrize.queue_margin_ms + 90000
+        self.assertEqual(parametrize.queue_max_wait(context), 90)
+        # No time left to wait:
+        context.get_remaining_time_in_millis.return_value = parametrize.queue_margin_ms - 1000
+        self.assertEqual(parametrize.queue_max_wait(context), 0)
+
+    def test_local(self):
+        self.assertEqual(parametrize.queue_max_wait({}), parametrize.work_queue.default_max_wait)
+
+
+if __name__ == '__main__':
+    unittest.main()
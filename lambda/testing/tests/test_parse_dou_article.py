@@ -0,0 +1,60 @@
+"""
+Parsing of DOU articles (capture_dou), checked against the fields the
+parser extracted before it was optimized.
+"""
+
+import unittest
+
+import support
+
+url  = 'http://www.in.gov.br/web/dou/-/portaria-1'
+page = ''.join(['<html><body><div id="materia">',
+                '<p class="identifica">PORTARIA Nº 1, DE 2 DE JANEIRO DE 2020</p>',
+                '<p class="ementa">Dispõe sobre a <b>aplicação</b> de recursos.</p>',
+                '<!-- comentário -->',
+                '<p class="dou-paragraph">Art. 1º Fica aprovado.</p>',
+                '<p class="dou-paragraph">Art. 2º Esta portaria entra em vigor.</p>',
+                '<div class="texto-dou"><span>-</span>Texto<strong class="assina">FULANO DE TAL</strong> cauda</div>',
+                '<p class="cargo">Ministro</p>',
+                '<p class="botao-materia"><a href="http://pesquisa.in.gov.br/certificado">Versão certificada</a></p>',
+                '</div></body></html>']).encode('utf-8')
+
+expected = [('identifica', 'PORTARIA Nº 1, DE 2 DE JANEIRO DE 2020'),
+            ('ementa', 'Dispõe sobre a  |  de recursos.'),
+            ('dou-paragraph', 'Art. 1º Fica aprovado. | Art. 2º Esta portaria entra em vigor.'),
+            ('texto-dou', 'Texto |  cauda'),
+            ('assina', 'FULANO DE TAL'),
+            ('cargo', 'Ministro'),
+            ('fulltext', 'PORTARIA Nº 1, DE 2 DE JANEIRO DE 2020Dispõe sobre a aplicação de recursos.'
+                         'Art. 1º Fica aprovado.Art. 2º Esta portaria entra em vigor.-TextoFULANO DE TAL cauda'
+                         'MinistroVersão certificada')]
+
+
+class Response:
+    """
+    Stand-in for requests' Response, with the page in `content`.
+    """
+    def __init__(self, content):
+        self.content = content
+
+
+@unittest.skipUnless(support.has_module('lxml'), 'requires lxml')
+class TestParseDOUArticle(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.parser = support.load('capture_dou', 'parse_dou_article')
+
+    def test_fields(self):
+        records = self.parser.parse_dou_article(Response(page), url)
+        self.assertEqual(sorted((r['key'], r['value']) for r in records), sorted(expected))
+        self.assertTrue(all(r['url'] == url for r in records))
+        self.assertTrue(all(r['url_certificado'] == 'http://pesquisa.in.gov.br/certificado' for r in records))
+
+    def test_fields_lookup(self):
+        records = self.parser.parse_dou_article(Response(page), url)
+        self.assertEqual(records.fields, dict(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
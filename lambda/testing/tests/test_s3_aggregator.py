@@ -0,0 +1,116 @@
+"""
+Aggregated writing of captured items to S3 (http-request's batch mode).
+"""
+
+import json
+import threading
+import unittest
+from unittest import mock
+
+import support
+
+s3_aggregator = support.load('http-request', 's3_aggregator')
+
+
+class TestAggregatedWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.saved   = {}
+        self.flushed = []
+        patcher = mock.patch.object(s3_aggregator, 'put_object', self.put_object)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def put_object(self, bucket, key, body):
+        self.saved[(bucket, key)] = body
+
+    def on_flush(self, bucket, key, manifest):
+        self.flushed.append((bucket, key, manifest))
+
+    def test_flush_writes_data_and_manifest(self):
+        writer = s3_aggregator.AggregatedWriter('b', 'data/', on_flush=self.on_flush)
+        writer.add('http://a', 'data/a.json', ['{"x": 1}', '{"x": 2}'], url_list='urls/a.txt')
+        writer.add('http://b', 'data/b.json', ['{"x": 3}'])
+        self.assertEqual(self.saved, {})
+
+        writer.flush()
+        (bucket, key, manifest), = self.flushed
+        self.assertEqual(bucket, 'b')
+        self.assertTrue(key.startswith('data/aggregated_') and key.endswith('.json'))
+        self.assertEqual(self.saved[('b', key)], b'{"x": 1}\n{"x": 2}\n{"x": 3}')
+        self.assertEqual(manifest, [
+            {'url': 'http://a', 'key': 'data/a.json', 'first_line': 0, 'last_line': 1, 'url_list': 'urls/a.txt', 'object': key},
+            {'url': 'http://b', 'key': 'data/b.json', 'first_line': 2, 'last_line': 2, 'object': key}])
+        saved_manifest = self.saved[('b', s3_aggregator.manifest_root + key)].decode('utf-8')
+        self.assertEqual([json.loads(line) for line in saved_manifest.split('\n')], manifest)
+
+        # The buffer is empty after the flush:
+        writer.flush()
+        self.assertEqual(len(self.flushed), 1)
+
+    def test_flush_at_max_bytes(self):
+        writer = s3_aggregator.AggregatedWriter('b', 'data/', max_bytes=20, output_format='njson.gz',
+                                                on_flush=self.on_flush)
+        writer.add('http://a', 'data/a.json', ['{"x": 1}'])
+        self.assertEqual(self.flushed, [])
+        writer.add('http://b', 'data/b.json', ['{"x": 2}', '{"x": 3}'])
+        self.assertEqual(len(self.flushed), 1)
+        self.assertTrue(self.flushed[0][1].endswith('.json.gz'))
+        self.assertEqual([entry['url'] for entry in self.flushed[0][2]], ['http://a', 'http://b'])
+
+    def test_get_writer_and_flush_all(self):
+        self.addCleanup(s3_aggregator.writers.clear)
+        writer = s3_aggregator.get_writer('b', 'data/', on_flush=self.on_flush)
+        self.assertIs(s3_aggregator.get_writer('b', 'data/', on_flush=self.on_flush), writer)
+        self.assertIsNot(s3_aggregator.get_writer('b', 'other/', on_flush=self.on_flush), writer)
+        self.assertEqual(writer.max_bytes, s3_aggregator.default_max_bytes)
+
+        writer.add('http://a', 'data/a.json', ['{"x": 1}'])
+        s3_aggregator.flush_all()
+        self.assertEqual(len(self.flushed), 1)
+
+    def test_get_writer_per_format(self):
+        self.addCleanup(s3_aggregator.writers.clear)
+        njson = s3_aggregator.get_writer('b', 'data/', 1000, 'njson', on_flush=self.on_flush)
+        gz    = s3_aggregator.get_writer('b', 'data/', 1000, 'njson.gz', on_flush=self.on_flush)
+        self.assertIsNot(gz, njson)
+        njson.add('http://a', 'data/a.json', ['{"x": 1}'])
+        gz.add('http://b', 'data/b.json.gz', ['{"x": 2}'])
+        s3_aggregator.flush_all()
+        self.assertEqual(sorted(key.endswith('.gz') for bucket, key, manifest in self.flushed), [False, True])
+
+    def test_get_writer_mismatch(self):
+        self.addCleanup(s3_aggregator.writers.clear)
+        s3_aggregator.get_writer('b', 'data/', 1000, 'parquet', {'a': 'int64'}, self.on_flush)
+        for other in [(2000, {'a': 'int64'}, self.on_flush), (1000, {'a': 'string'}, self.on_flush), (1000, {'a': 'int64'}, None)]:
+            with self.assertRaises(Exception):
+                s3_aggregator.get_writer('b', 'data/', other[0], 'parquet', other[1], other[2])
+
+    def test_upload_outside_lock(self):
+        uploading = threading.Event()
+        finish    = threading.Event()
+        uploaded  = []
+
+        def put_object(bucket, key, body):
+            if key.startswith(s3_aggregator.manifest_root):
+                return
+            # The first upload only finishes when the test says so:
+            if len(uploaded) == 0 and not uploading.is_set():
+                uploading.set()
+                finish.wait(5)
+            uploaded.append(body)
+
+        writer = s3_aggregator.AggregatedWriter('b', 'data/', max_bytes=5)
+        with mock.patch.object(s3_aggregator, 'put_object', put_object):
+            thread = threading.Thread(target=writer.add, args=('http://a', 'data/a.json', ['{"x": 1}']))
+            thread.start()
+            uploading.wait(5)
+            # Items are added (and written) while the first object is being uploaded:
+            writer.add('http://b', 'data/b.json', ['{"x": 2}'])
+            finish.set()
+            thread.join()
+
+        self.assertEqual(uploaded, [b'{"x": 2}', b'{"x": 1}'])
+
+if __name__ == '__main__':
+    unittest.main()
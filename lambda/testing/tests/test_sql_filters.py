@@ -0,0 +1,196 @@
+"""
+Gabi bot filters compiled into BigQuery SQL (checked by running the
+predicates in SQLite against keyword_matcher) and the choice between
+filtering inside BigQuery or after downloading the results.
+"""
+
+import contextlib
+import io
+import sqlite3
+import sys
+import types
+import unittest
+from unittest import mock
+
+import support
+from test_vectorized_filters import random_filters
+
+km          = support.load_shared('keyword_matcher')
+sql_filters = support.load('bigquery-to-sns', 'sql_filters')
+
+
+class TestBuildQuery(unittest.TestCase):
+
+    def test_predicates(self):
+        bot_infos = [{'filters': [{'column_name': 'ementa', 'positive_filter': ['Saúde', 'educação'],
+                                   'negative_filter': ['saúde animal']}]},
+                     {'filters': [{'column_name': 'orgao', 'positive_filter': ['SAÚDE', '']}]},
+                     {'filters': [{'column_name': 'orgao', 'positive_filter': []}]},
+                     {'filters': []}]
+        sql, params = sql_filters.build_query(bot_infos, 'SELECT * FROM `d.t`')
+
+        # Keywords are lowered and each one becomes a single query parameter:
+        self.assertEqual(params, {'saúde': 'kw0', 'educação': 'kw1', 'saúde animal': 'kw2'})
+        flags = ("IF((`ementa` IS NOT NULL AND (STRPOS(LOWER(CAST(`ementa` AS STRING)), @kw0) > 0 OR "
+                 "STRPOS(LOWER(CAST(`ementa` AS STRING)), @kw1) > 0) AND "
+                 "NOT (STRPOS(LOWER(CAST(`ementa` AS STRING)), @kw2) > 0)), 0, NULL), "
+                 "IF((`orgao` IS NOT NULL AND (STRPOS(LOWER(CAST(`orgao` AS STRING)), @kw0) > 0 OR TRUE)), 1, NULL), "
+                 "IF((`orgao` IS NOT NULL AND FALSE), 2, NULL), "
+                 "IF(TRUE, 3, NULL)")
+        self.assertEqual(sql, 'SELECT gabi_bot_id, t.* EXCEPT (gabi_bot_ids)\n'
+                              'FROM (SELECT *, [' + flags + '] AS gabi_bot_ids\n'
+                              '      FROM (SELECT * FROM `d.t`)) AS t\n'
+                              'CROSS JOIN UNNEST(t.gabi_bot_ids) AS gabi_bot_id\n'
+                              'WHERE gabi_bot_id IS NOT NULL')
+
+    def test_invalid_column(self):
+        bot_infos = [{'filters': [{'column_name': 'ementa`) OR (TRUE', 'positive_filter': ['x']}]}]
+        with self.assertRaises(Exception):
+            sql_filters.build_query(bot_infos, 'SELECT * FROM `d.t`')
+
+    def test_select_without_bots(self):
+        self.assertEqual(sql_filters.select([], 'SELECT * FROM `d.t`'), [])
+
+
+def sqlite_select(bot_infos, rows):
+    """
+    Select, for each bot_info in `bot_infos`, the `rows` (list of dicts with
+    the same keys) that pass its predicate (see `filters_predicate`), run in
+    SQLite with BigQuery's STRPOS and (Unicode) LOWER.
+    """
+    columns    = list(rows[0].keys())
+    connection = sqlite3.connect(':memory:')
+    connection.create_function('LOWER', 1, lambda text: None if text is None else text.lower())
+    connection.create_function('STRPOS', 2, lambda text, sub: None if text is None else text.find(sub) + 1)
+    connection.execute('CREATE TABLE t (row_id INTEGER, ' + ', '.join('`%s` TEXT' % c for c in columns) + ')')
+    connection.executemany('INSERT INTO t VALUES (' + ', '.join(['?'] * (len(columns) + 1)) + ')',
+                           [[i] + [row[c] for c in columns] for i, row in enumerate(rows)])
+
+    selected = []
+    for bot_info in bot_infos:
+        params    = {}
+        # SQLite's name for BigQuery's STRING type:
+        predicate = sql_filters.filters_predicate(bot_info['filters'], params).replace('AS STRING', 'AS TEXT')
+        cursor    = connection.execute('SELECT row_id FROM t WHERE ' + predicate + ' ORDER BY row_id',
+                                       {name: keyword for keyword, name in params.items()})
+        selected.append([rows[row_id] for row_id, in cursor])
+    return selected
+
+
+class TestPredicates(unittest.TestCase):
+
+    def test_same_as_keyword_matcher(self):
+        for seed in [2, 7, 8]:
+            bot_infos, rows = random_filters(seed)
+            self.assertEqual(sqlite_select(bot_infos, rows), km.FilterSets(bot_infos).select(rows))
+
+    def test_accents_and_case(self):
+        rows      = [{'ementa': 'Dispõe sobre a SAÚDE'}, {'ementa': 'saúde animal'}, {'ementa': None},
+                     {'ementa': '50% (cinquenta) _ por cento'}]
+        bot_infos = [{'filters': [{'column_name': 'ementa', 'positive_filter': ['Saúde'],
+                                   'negative_filter': ['ANIMAL']}]},
+                     {'filters': [{'column_name': 'ementa', 'positive_filter': ['%', '_']}]},
+                     {'filters': [{'column_name': 'ementa', 'negative_filter': ['saúde']}]}]
+        self.assertEqual(sqlite_select(bot_infos, rows), km.FilterSets(bot_infos).select(rows))
+        self.assertEqual(sqlite_select(bot_infos, rows), [rows[:1], rows[3:], rows[3:]])
+
+
+class FakeBigQuery:
+    """
+    BigQuery client answering the filtered query with `rows` (list of dicts
+    with 'gabi_bot_id'), recording the queries and their parameters.
+    """
+
+    def __init__(self, rows):
+        self.rows    = rows
+        self.queries = []
+
+    def query(self, sql, job_config, location):
+        self.queries.append((sql, job_config.query_parameters))
+        return [mock.Mock(items=lambda row=row: list(row.items())) for row in self.rows]
+
+
+class TestSelect(unittest.TestCase):
+
+    def test_select_groups_by_bot(self):
+        bigquery = types.ModuleType('google.cloud.bigquery')
+        bigquery.QueryJobConfig = lambda query_parameters: types.SimpleNamespace(query_parameters=query_parameters)
+        bigquery.ScalarQueryParameter = lambda name, kind, value: (name, kind, value)
+        client    = FakeBigQuery([{'gabi_bot_id': 1, 'id': 10}, {'gabi_bot_id': 0, 'id': 10}, {'gabi_bot_id': 1, 'id': 11}])
+        bot_infos = [{'filters': [{'column_name': 'ementa', 'positive_filter': ['Saúde']}]},
+                     {'filters': [{'column_name': 'ementa', 'positive_filter': ['educação']}]},
+                     {'filters': [{'column_name': 'ementa', 'positive_filter': ['x']}]}]
+        google = types.ModuleType('google')
+        google.cloud = types.ModuleType('google.cloud')
+        google.cloud.bigquery = bigquery
+        modules = {'google': google, 'google.cloud': google.cloud, 'google.cloud.bigquery': bigquery}
+        with mock.patch.dict(sys.modules, modules), \
+             mock.patch.object(sql_filters.cloud_clients, 'bigquery_client', lambda: client):
+            selected = sql_filters.select(bot_infos, 'SELECT * FROM `d.t`')
+
+        self.assertEqual(selected, [[{'id': 10}], [{'id': 10}, {'id': 11}], []])
+        (sql, parameters), = client.queries
+        self.assertEqual(sql, sql_filters.build_query(bot_infos, 'SELECT * FROM `d.t`')[0])
+        self.assertEqual(sorted(parameters), [('kw0', 'STRING', 'saúde'), ('kw1', 'STRING', 'educação'),
+                                              ('kw2', 'STRING', 'x')])
+
+
+class TestFilterQueries(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.lf = support.load('bigquery-to-sns')
+
+    def setUp(self):
+        self.bot_infos, self.rows = random_filters(9, n_bots=6)
+        for bot_info, casa in zip(self.bot_infos, ['camara', 'senado', 'camara', 'assembleia', 'senado', 'camara']):
+            bot_info['casa'] = casa
+        self.queries_metadata = [{'casa': 'camara', 'query': 'SELECT * FROM camara'},
+                                 {'casa': 'senado', 'query': 'SELECT * FROM senado', 'pushdown': True}]
+        self.downloaded = []
+        self.pushed     = []
+        for patch in [mock.patch.object(self.lf, 'query_bigquery', self.query_bigquery),
+                      mock.patch.object(self.lf.sql_filters, 'select', self.pushdown_select)]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def query_bigquery(self, query):
+        self.downloaded.append(query)
+        return self.rows
+
+    def pushdown_select(self, bot_infos, query):
+        # The filters run "inside BigQuery" (SQLite):
+        self.pushed.append(query)
+        return sqlite_select(bot_infos, self.rows)
+
+    def filter_queries(self, event):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.lf.filter_queries(self.bot_infos, self.queries_metadata, event)
+
+    def expected(self):
+        selected = km.FilterSets(self.bot_infos).select(self.rows)
+        # The 'assembleia' bot has no query:
+        return {i: selected[i] for i in [0, 1, 2, 4, 5]}
+
+    def test_per_query(self):
+        self.assertEqual(self.filter_queries({}), self.expected())
+        self.assertEqual(self.downloaded, ['SELECT * FROM camara'])
+        self.assertEqual(self.pushed, ['SELECT * FROM senado'])
+
+    def test_event_overrides(self):
+        self.assertEqual(self.filter_queries({'pushdown': True}), self.expected())
+        self.assertEqual((self.downloaded, sorted(self.pushed)), ([], ['SELECT * FROM camara', 'SELECT * FROM senado']))
+
+        self.pushed.clear()
+        self.assertEqual(self.filter_queries({'pushdown': False}), self.expected())
+        self.assertEqual((sorted(self.downloaded), self.pushed), (['SELECT * FROM camara', 'SELECT * FROM senado'], []))
+
+    def test_use_pushdown(self):
+        self.assertFalse(self.lf.use_pushdown({'query': 'q'}, {}))
+        self.assertTrue(self.lf.use_pushdown({'query': 'q', 'pushdown': True}, None))
+        self.assertFalse(self.lf.use_pushdown({'query': 'q', 'pushdown': True}, {'pushdown': False}))
+        self.assertTrue(self.lf.use_pushdown({'query': 'q'}, {'pushdown': True, 'source': 'aws.events'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+Indexed DOU article records (capture_dou's ArticleRecords), checked
+against the plain list of key/value dicts they replaced.
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import support
+
+sa = support.load('capture_dou', 'structure_article')
+
+url        = 'http://www.in.gov.br/web/dou/-/portaria-n-1-de-2-de-junho-de-2020-259884545'
+identifier = {'capture_date': '2020-06-02 10:00:00', 'url': url, 'url_certificado': url + '?cert'}
+fields     = [('secao-dou', 'Seção: 1 | Página: 10'), ('orgao-dou-data', 'Ministério da Saúde'),
+              ('identifica', 'PORTARIA Nº 1, DE 2 DE JUNHO DE 2020'), ('dou-paragraph', 'Resolve: art. 1º'),
+              ('publicado-dou-data', '02/06/2020'), ('assina', 'FULANO'), ('fulltext', 'PORTARIA Nº 1 Resolve: "art. 1º"'),
+              # Repeated key (the first value is used):
+              ('dou-paragraph', 'Art. 2º'), ('ementa', None)]
+
+
+def old_get_key_value(key, article_raw):
+    # The original get_key_value, scanning the list:
+    sel = list(filter(lambda d: d['key'] == key, article_raw))
+    if len(sel) == 0:
+        return None
+    return sel[0]['value']
+
+
+class TestArticleRecords(unittest.TestCase):
+
+    def setUp(self):
+        self.plain   = [dict(identifier, key=key, value=value) for key, value in fields]
+        self.records = sa.ArticleRecords(self.plain)
+
+    def test_list(self):
+        self.assertIsInstance(self.records, list)
+        self.assertEqual(self.records, self.plain)
+        self.assertEqual(self.records[0]['capture_date'], '2020-06-02 10:00:00')
+        self.assertEqual(json.dumps(self.records, ensure_ascii=False), json.dumps(self.plain, ensure_ascii=False))
+
+    def test_fields(self):
+        self.assertEqual(self.records.fields['dou-paragraph'], 'Resolve: art. 1º')
+        self.assertEqual(sa.article_fields(self.records), sa.article_fields(self.plain))
+        self.assertIs(sa.article_fields(self.records), self.records.fields)
+        self.assertEqual(sa.ArticleRecords().fields, {})
+
+    def test_get_key_value(self):
+        for key in [key for key, value in fields] + ['missing']:
+            for article in [self.records, self.plain]:
+                self.assertEqual(sa.get_key_value(key, article), old_get_key_value(key, self.plain))
+
+    def test_structure_article(self):
+        struct = sa.structure_article(self.records)
+        self.assertEqual(sa.structure_article(self.plain), struct)
+        self.assertEqual((struct['secao'], struct['paragraph'], struct['ementa']), ('1', 'Resolve: art. 1º', None))
+
+
+@unittest.skipUnless(support.has_module('botocore'), 'requires botocore')
+class TestWriteArticle(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.wa = support.load('capture_dou', 'write_article')
+
+    def setUp(self):
+        self.plain   = [dict(identifier, key=key, value=value) for key, value in fields]
+        self.records = sa.ArticleRecords(self.plain)
+
+    def test_get_pub_date(self):
+        self.assertEqual(self.wa.get_pub_date(self.records), '2020-06-02')
+        no_date = [record for record in self.plain if record['key'] != 'publicado-dou-data']
+        self.assertEqual(self.wa.get_pub_date(sa.ArticleRecords(no_date)), 'capt_2020-06-02')
+        self.assertEqual(self.wa.get_pub_date(no_date), 'capt_2020-06-02')
+
+    def test_write_local_article(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        saved = []
+        for article in [self.plain, self.records]:
+            path = os.path.join(folder.name, str(len(saved)))
+            self.wa.write_local_article({'storage_path': path}, article, 'portaria/1.json')
+            with open(os.path.join(path, '2020-06-02', 'portaria_1.json'), 'rb') as f:
+                saved.append(f.read())
+        self.assertEqual(saved[1], saved[0])
+        self.assertEqual(json.loads(saved[1].decode('utf-8')), self.plain)
+
+    def test_write_to_s3(self):
+        s3 = mock.Mock()
+        s3.put_object.return_value = {'ResponseMetadata': {'HTTPStatusCode': 200}}
+        for output_format in ['njson.gz', 'njson']:
+            config = {'bucket': 'brutos-publicos', 'key': 'executivo/federal/dou/', 'output_format': output_format}
+            bodies = []
+            with mock.patch.object(self.wa, 'get_client', lambda service: s3):
+                for article in [self.plain, self.records]:
+                    self.assertEqual(self.wa.write_to_s3(config, article, 'portaria-1.json'), 200)
+                    bodies.append(s3.put_object.call_args[1]['Body'])
+            self.assertEqual(bodies[1], bodies[0])
+            self.assertEqual(s3.put_object.call_args[1]['Key'],
+                             self.wa.of.output_key('executivo/federal/dou/portaria-1.json', output_format))
+        # One json per line, as before:
+        self.assertEqual(bodies[0].decode('utf-8'), '\n'.join(json.dumps(record, ensure_ascii=False)
+                                                              for record in self.plain))
+
+
+if __name__ == '__main__':
+    unittest.main()
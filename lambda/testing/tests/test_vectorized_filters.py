@@ -0,0 +1,108 @@
+"""
+Gabi bot filters evaluated with pandas, compared with keyword_matcher.
+"""
+
+import contextlib
+import io
+import random
+import unittest
+from unittest import mock
+
+import support
+
+km = support.load_shared('keyword_matcher')
+
+
+def random_filters(seed, n_rows=200, n_bots=50):
+    """
+    Return random bot_infos (list of dicts) and query results (list of dicts)
+    with text and None values.
+    """
+    rng     = random.Random(seed)
+    words   = ['Ministério', 'saúde', 'educação', 'PORTARIA', 'decreto', 'ção', 'a.b', '(lei)', '']
+    columns = ['ementa', 'orgao']
+
+    def keywords():
+        return [rng.choice(words) for _ in range(rng.randint(0, 3))]
+
+    rows = [{column: None if rng.random() < 0.1 else ' '.join(rng.choice(words) for _ in range(rng.randint(0, 6)))
+             for column in columns} for _ in range(n_rows)]
+
+    bot_infos = []
+    for i in range(n_bots):
+        filters = []
+        for column in rng.sample(columns, rng.randint(0, 2)):
+            f = {'column_name': column}
+            if rng.random() < 0.8:
+                f['positive_filter'] = keywords()
+            if rng.random() < 0.5:
+                f['negative_filter'] = keywords()
+            filters.append(f)
+        bot_infos.append({'nome': 'bot ' + str(i), 'casa': 'camara', 'filters': filters})
+
+    return bot_infos, rows
+
+
+@unittest.skipUnless(support.has_module('pandas'), 'requires pandas')
+class TestVectorizedFilters(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.vf = support.load('bigquery-to-sns', 'vectorized_filters')
+
+    def test_same_as_keyword_matcher(self):
+        for seed in [2, 3, 4]:
+            bot_infos, rows = random_filters(seed)
+            self.assertEqual(self.vf.select(bot_infos, rows), km.FilterSets(bot_infos).select(rows))
+
+    def test_no_results(self):
+        bot_infos = [{'filters': [{'column_name': 'ementa', 'positive_filter': ['x']}]}, {'filters': []}]
+        self.assertEqual(self.vf.select(bot_infos, []), [[], []])
+
+    def test_all_none_column(self):
+        rows      = [{'ementa': None}, {'ementa': None}]
+        bot_infos = [{'filters': [{'column_name': 'ementa', 'negative_filter': ['x']}]}]
+        self.assertEqual(self.vf.select(bot_infos, rows), [[]])
+
+    def test_not_text(self):
+        bot_infos = [{'filters': [{'column_name': 'ementa', 'positive_filter': ['1']}]}]
+        self.assertTrue(self.vf.is_text(bot_infos, [{'ementa': 'a', 'numero': 1}, {'ementa': None}]))
+        # Values that are not text, or missing columns, are left to keyword_matcher (which fails on them):
+        for rows in [[{'ementa': 'a 1'}, {'ementa': 1}], [{'ementa': 'a 1'}, {'ementa': float('nan')}],
+                     [{'ementa': 'a 1'}, {'numero': 1}]]:
+            self.assertFalse(self.vf.is_text(bot_infos, rows))
+            with mock.patch.object(self.vf, 'match_matrix') as match_matrix:
+                with self.assertRaises(Exception):
+                    self.vf.select(bot_infos, rows)
+            match_matrix.assert_not_called()
+        # Columns that are not filtered may have any value:
+        self.assertEqual(self.vf.select(bot_infos, [{'ementa': 'a 1', 'numero': 1}, {'ementa': 'b', 'numero': None}]),
+                         [[{'ementa': 'a 1', 'numero': 1}]])
+
+
+@unittest.skipUnless(support.has_module('pandas'), 'requires pandas')
+class TestGetRelevantResults(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.lf = support.load('bigquery-to-sns')
+
+    def select(self, bot_infos, rows, vectorized):
+        with mock.patch.object(self.lf, 'vectorized', vectorized), contextlib.redirect_stdout(io.StringIO()):
+            return self.lf.get_relevant_results_all(bot_infos, rows)
+
+    def test_vectorized_is_default(self):
+        self.assertTrue(self.lf.vectorized)
+
+    def test_same_with_and_without_pandas(self):
+        for seed in [5, 6]:
+            bot_infos, rows = random_filters(seed)
+            selected = self.select(bot_infos, rows, True)
+            self.assertEqual(selected, self.select(bot_infos, rows, False))
+            # A single bot_info:
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(self.lf.get_relevant_results(bot_infos[1], rows), selected[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+"""
+Work queue backends: the SQLite backend, shared cursor claims and leases,
+the DynamoDB counters and waiting for temp tables to be ready.
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import support
+
+work_queue = support.load_shared('work_queue')
+
+
+class FakeDynamoDB:
+    """
+    DynamoDB client whose `describe_table` returns the table statuses in
+    `statuses` (list of str), one per call.
+    """
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.calls    = 0
+
+    def describe_table(self, TableName):
+        self.calls = self.calls + 1
+        return {'Table': {'TableName': TableName, 'TableStatus': self.statuses.pop(0)}}
+
+
+class TestSQLiteQueue(unittest.TestCase):
+
+    def setUp(self):
+        folder     = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.queue = work_queue.SQLiteQueue(os.path.join(folder.name, 'queue.sqlite'))
+        self.queue.put_items('q', ({'url': 'http://x/' + str(i)} for i in range(25)))
+
+    def test_items(self):
+        self.assertEqual(self.queue.get_item('q', 3), {'url': 'http://x/3', 'order': 3})
+        self.assertEqual(self.queue.get_items('q', [24, 25, 0]),
+                         [{'url': 'http://x/24', 'order': 24}, None, {'url': 'http://x/0', 'order': 0}])
+        self.assertEqual(self.queue.get_item('other', 3), None)
+
+    def test_put_items_first_order(self):
+        self.queue.put_items('q', [{'url': 'http://y'}], first_order=25)
+        self.assertEqual(self.queue.get_item('q', 25), {'url': 'http://y', 'order': 25})
+
+    def test_counters(self):
+        self.assertEqual(self.queue.add_to_counter('q', 'c', 3), 3)
+        self.assertEqual(self.queue.add_to_counter('q', 'c', 4), 7)
+        self.assertEqual(self.queue.add_to_counter('other', 'c', 1), 1)
+
+    def test_claim_all(self):
+        starts = []
+        n_done = 0
+        while True:
+            start, lease = work_queue.claim(self.queue, 'q', 10, 25)
+            if start >= 25:
+                break
+            starts.append(start)
+            n_done = work_queue.mark_done(self.queue, 'q', start, 10, lease, min(10, 25 - start))
+        self.assertEqual(starts, [0, 10, 20])
+        self.assertEqual(n_done, 25)
+        self.assertEqual(work_queue.pending_leases(self.queue, 'q', 10, 25), [])
+
+    def test_expired_lease_is_claimed_again(self):
+        # The first worker's lease is already expired:
+        start_1, lease_1 = work_queue.claim(self.queue, 'q', 10, 25, lease_time=-1)
+        start_2, lease_2 = work_queue.claim(self.queue, 'q', 10, 25)
+        self.assertEqual((start_1, start_2), (0, 0))
+        self.assertEqual(work_queue.pending_leases(self.queue, 'q', 10, 25), [lease_2])
+
+        # The first worker lost the chunk, so only the second one reports it:
+        self.assertEqual(work_queue.mark_done(self.queue, 'q', start_1, 10, lease_1, 10), None)
+        self.assertEqual(work_queue.mark_done(self.queue, 'q', start_2, 10, lease_2, 10), 10)
+        self.assertEqual(work_queue.claim(self.queue, 'q', 10, 25)[0], 10)
+
+    def test_unexpired_lease_is_kept(self):
+        start_1, lease_1 = work_queue.claim(self.queue, 'q', 10, 25)
+        start_2, lease_2 = work_queue.claim(self.queue, 'q', 10, 25)
+        self.assertEqual((start_1, start_2), (0, 10))
+        self.assertEqual(len(work_queue.pending_leases(self.queue, 'q', 10, 25)), 2)
+
+    def test_delete(self):
+        work_queue.claim(self.queue, 'q', 10, 25)
+        self.queue.delete('q')
+        self.assertEqual(self.queue.get_items('q', [0, 1]), [None, None])
+        self.assertEqual(self.queue.get_leases('q'), [])
+
+
+class CountersClient:
+    """
+    DynamoDB client that records the `update_item` requests.
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def update_item(self, **request):
+        self.requests.append(request)
+        return {'Attributes': {'c': {'N': '3'}}}
+
+
+class TestDynamoDBCounters(unittest.TestCase):
+
+    def test_counters_location_is_abstract(self):
+        with self.assertRaises(TypeError):
+            work_queue.DynamoDBCounters()
+
+        class NoLocation(work_queue.DynamoDBCounters):
+            pass
+
+        with self.assertRaises(TypeError):
+            NoLocation()
+
+    def test_counters_location(self):
+        with mock.patch.object(work_queue, 'new_session'):
+            partitioned = work_queue.PartitionedTableQueue()
+            temp_table  = work_queue.TempTableQueue()
+        self.assertEqual(partitioned.counters_location('q'),
+                         (work_queue.partitioned_table, {'queue_id': {'S': 'q'}, 'order': {'N': '-1'}}))
+        self.assertEqual(temp_table.counters_location('temp-q'), ('temp-q', {'order': {'N': '-1'}}))
+
+    def test_add_to_counter(self):
+
+        class Counters(work_queue.DynamoDBCounters):
+            client = CountersClient()
+
+            def counters_location(self, queue_id):
+                return 'table', {'id': {'S': queue_id}}
+
+        counters = Counters()
+        self.assertEqual(counters.add_to_counter('q', 'c', 3), 3)
+        self.assertEqual(counters.client.requests,
+                         [{'TableName': 'table', 'Key': {'id': {'S': 'q'}}, 'UpdateExpression': 'ADD #c :n',
+                           'ReturnValues': 'UPDATED_NEW', 'ExpressionAttributeNames': {'#c': 'c'},
+                           'ExpressionAttributeValues': {':n': {'N': '3'}}}])
+
+
+class TestTempTableQueue(unittest.TestCase):
+
+    def setUp(self):
+        with mock.patch.object(work_queue, 'new_session'):
+            self.queue = work_queue.TempTableQueue()
+        self.sleeps = []
+        patch = mock.patch.object(work_queue.time, 'sleep', self.sleeps.append)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_wait_active(self):
+        self.queue.client = FakeDynamoDB(['CREATING'] * 6 + ['ACTIVE'])
+        self.assertEqual(self.queue.wait_active('temp-q', max_delay=4), 15.5)
+        # Exponential backoff, up to `max_delay`:
+        self.assertEqual(self.sleeps, [0.5, 1, 2, 4, 4, 4])
+
+    def test_already_active(self):
+        self.queue.client = FakeDynamoDB(['ACTIVE'])
+        self.assertEqual(self.queue.wait_active('temp-q'), 0)
+        self.assertEqual(self.sleeps, [])
+
+    def test_max_wait(self):
+        self.queue.client = FakeDynamoDB(['CREATING'] * 10)
+        with self.assertRaises(Exception):
+            self.queue.wait_active('temp-q', max_wait=5)
+        # Never sleeps past `max_wait`:
+        self.assertEqual(self.sleeps, [0.5, 1, 2, 1.5])
+        self.assertEqual(self.queue.client.calls, 5)
+
+    def test_no_time_left(self):
+        self.queue.client = FakeDynamoDB(['CREATING'])
+        with self.assertRaises(Exception):
+            self.queue.wait_active('temp-q', max_wait=0)
+        self.assertEqual(self.sleeps, [])
+
+    def test_create_passes_max_wait(self):
+        self.queue.client = FakeDynamoDB(['ACTIVE'])
+        with mock.patch.object(self.queue, 'wait_active') as wait_active:
+            self.queue.create('temp-q', 42)
+        wait_active.assert_called_once_with('temp-q', 42)
+
+
+class TestParams(unittest.TestCase):
+
+    def test_default_backend(self):
+        self.assertEqual(work_queue.default_backend, 'partitioned')
+
+    def test_queue_params(self):
+        self.assertEqual(work_queue.queue_params('partitioned', 'q', 25),
+                         {'queue_backend': 'partitioned', 'queue_id': 'q', 'order': 24})
+        self.assertEqual(work_queue.queue_params('temp_table', 'temp-q', 1),
+                         {'queue_backend': 'temp_table', 'queue_id': 'temp-q', 'order': 0,
+                          'dynamo_table_name': 'temp-q'})
+
+    def test_old_payloads(self):
+        # Queues created before the backends existed are temp tables:
+        params = {'dynamo_table_name': 'temp-q', 'order': 5}
+        self.assertEqual(work_queue.get_backend(params), 'temp_table')
+        self.assertEqual(work_queue.get_queue_id(params), 'temp-q')
+        self.assertEqual(work_queue.get_queue_id({'order': 5}), None)
+
+    def test_n_chunks(self):
+        self.assertEqual([work_queue.n_chunks(n, 10) for n in [1, 10, 11, 25]], [1, 1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""
+Copies to Google Storage queued with copy_queue.LocalQueue and sent through
+the write-to-storage-gcp handler ('keys', SQS 'Records' and 'queue_url'
+events), with AWS S3 and Google Storage replaced by in-memory fakes.
+"""
+
+import io
+import json
+import unittest
+from unittest import mock
+
+import support
+
+wtsg       = support.load('write-to-storage-gcp')
+copy_queue = support.load('write-to-storage-gcp', 'copy_queue')
+
+
+class FakeBody:
+    def __init__(self, data):
+        self.data = data
+
+    def iter_chunks(self, chunk_size):
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i:i + chunk_size]
+
+
+class FakeS3:
+    """
+    AWS S3 client holding `files` (dict from (bucket, key) to bytes).
+    """
+
+    def __init__(self, files):
+        self.files = files
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.files:
+            raise Exception('NoSuchKey: ' + Key)
+        return {'ContentType': 'application/json', 'Body': FakeBody(self.files[(Bucket, Key)])}
+
+
+class FakeUpload(io.BytesIO):
+    def __init__(self, stored, key):
+        super().__init__()
+        self.stored = stored
+        self.key    = key
+
+    def close(self):
+        self.stored[self.key] = self.getvalue()
+        super().close()
+
+
+class FakeBucket:
+    """
+    Google Storage bucket saving the uploads to `stored` (dict from key to bytes).
+    """
+
+    def __init__(self, stored):
+        self.stored = stored
+
+    def blob(self, key, chunk_size=None):
+        blob = mock.Mock()
+        blob.open.side_effect = lambda mode, content_type=None: FakeUpload(self.stored, key)
+        return blob
+
+
+class TestWriteToStorageGCP(unittest.TestCase):
+
+    def setUp(self):
+        self.files  = {('brutos-publicos', 'a/1.json'): b'{"x": 1}',
+                       ('brutos-publicos', 'a/2.json'): b'{"x": 2}\n{"x": 3}',
+                       ('brutos-publicos', 'a/3.json'): b'3' * (3 * 1024)}
+        self.stored = {}
+        patches = [mock.patch.object(wtsg, 'client', FakeS3(self.files)),
+                   mock.patch.object(wtsg, 'get_bucket_gcp', lambda bucket: FakeBucket(self.stored)),
+                   # Many chunks per file:
+                   mock.patch.object(wtsg, 'chunk_size', 1024)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def fill_queue(self, keys):
+        queue = copy_queue.LocalQueue()
+        for key in keys:
+            queue.send({'bucket': 'brutos-publicos', 'key': key})
+        return queue
+
+    def test_single_key(self):
+        event = {'bucket': 'brutos-publicos', 'key': 'a/1.json'}
+        self.assertEqual(wtsg.lambda_handler(event, {}), event)
+        self.assertEqual(self.stored, {'a/1.json': b'{"x": 1}'})
+
+    def test_keys(self):
+        keys = ['a/1.json', 'a/2.json', 'a/3.json']
+        wtsg.lambda_handler({'bucket': 'brutos-publicos', 'keys': keys}, {})
+        self.assertEqual(self.stored, {key: self.files[('brutos-publicos', key)] for key in keys})
+
+    def test_keys_failure(self):
+        with self.assertRaises(Exception):
+            wtsg.lambda_handler({'bucket': 'brutos-publicos', 'keys': ['a/1.json', 'missing.json']}, {})
+        # The other files are copied anyway:
+        self.assertEqual(list(self.stored), ['a/1.json'])
+
+    def test_sqs_records_partial_failure(self):
+        queue    = self.fill_queue(['a/1.json', 'missing.json', 'a/2.json'])
+        received = queue.receive(10)
+        records  = [{'messageId': receipt, 'body': json.dumps(message)} for receipt, message in received]
+
+        response = wtsg.lambda_handler({'Records': records}, {})
+
+        # Only the failed message is reported (and retried by SQS):
+        failed = [receipt for receipt, message in received if message['key'] == 'missing.json']
+        self.assertEqual(response, {'batchItemFailures': [{'itemIdentifier': failed[0]}]})
+        self.assertEqual(sorted(self.stored), ['a/1.json', 'a/2.json'])
+
+        queue.delete([receipt for receipt, message in received if receipt not in failed])
+        queue.release()
+        self.assertEqual([message['key'] for receipt, message in queue.receive(10)], ['missing.json'])
+
+    def test_drain_queue(self):
+        keys  = ['a/1.json', 'a/2.json', 'missing.json', 'a/3.json'] * 4
+        queue = self.fill_queue(keys)
+
+        with mock.patch.object(wtsg.copy_queue, 'SQSQueue', lambda queue_url: queue):
+            wtsg.lambda_handler({'queue_url': 'https://sqs.us-east-1.amazonaws.com/0/write-to-storage-gcp'}, {})
+
+        self.assertEqual(sorted(self.stored), ['a/1.json', 'a/2.json', 'a/3.json'])
+        # Failed copies stay in the queue:
+        queue.release()
+        self.assertEqual([message['key'] for receipt, message in queue.receive(10)], ['missing.json'] * 4)
+
+    def test_drain_stops_without_time(self):
+        queue   = self.fill_queue(['a/1.json', 'a/2.json'])
+        context = mock.Mock()
+        context.get_remaining_time_in_millis.return_value = 0
+
+        with mock.patch.object(wtsg.copy_queue, 'SQSQueue', lambda queue_url: queue):
+            wtsg.lambda_handler({'queue_url': 'https://sqs.us-east-1.amazonaws.com/0/write-to-storage-gcp'}, context)
+
+        self.assertEqual(self.stored, {})
+        self.assertEqual(len(queue.messages), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
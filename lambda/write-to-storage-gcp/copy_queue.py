@@ -0,0 +1,139 @@
+"""
+Queues of files waiting to be copied from AWS S3 to Google Storage.
+
+Producers (http-request, python-process, capture_dou) send messages like
+{"bucket": "brutos-publicos", "key": "path/file.json"} to an AWS SQS queue
+instead of invoking write-to-storage-gcp once per file. This Lambda then
+drains the queue in groups and copies each group concurrently.
+
+`SQSQueue` wraps the AWS SQS queue and `LocalQueue` is an in-memory
+stand-in with the same interface, for running and testing offline.
+"""
+
+import json
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# SQS returns at most 10 messages per request:
+max_group_size = 10
+
+
+class SQSQueue:
+    """
+    AWS SQS queue with URL `queue_url` (str).
+    """
+
+    def __init__(self, queue_url, sqs_client=None):
+        import boto3
+        self.queue_url = queue_url
+        self.sqs       = sqs_client if sqs_client != None else boto3.client('sqs')
+
+    def send(self, message):
+        """
+        Send the dict `message` to the queue.
+        """
+        self.sqs.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(message))
+
+    def receive(self, n_messages):
+        """
+        Return a list of at most `n_messages` (int) tuples (receipt, message)
+        from the queue. The messages become invisible to other consumers
+        until deleted (or until the queue's visibility timeout ends).
+        """
+        response = self.sqs.receive_message(QueueUrl=self.queue_url,
+                                            MaxNumberOfMessages=min(n_messages, max_group_size),
+                                            WaitTimeSeconds=1)
+        return [(m['ReceiptHandle'], json.loads(m['Body'])) for m in response.get('Messages', [])]
+
+    def delete(self, receipts):
+        """
+        Remove the messages identified by the list `receipts` from the queue.
+        """
+        for i in range(0, len(receipts), max_group_size):
+            entries = [{'Id': str(j), 'ReceiptHandle': r} for j, r in enumerate(receipts[i:i + max_group_size])]
+            self.sqs.delete_message_batch(QueueUrl=self.queue_url, Entries=entries)
+
+
+class LocalQueue:
+    """
+    In-memory stand-in for `SQSQueue`. Received messages that are not
+    deleted can be put back in the queue with `release`.
+    """
+
+    def __init__(self, messages=None):
+        self.messages  = deque(messages if messages != None else [])
+        self.in_flight = {}
+
+    def send(self, message):
+        self.messages.append(message)
+
+    def receive(self, n_messages):
+        received = []
+        while len(self.messages) > 0 and len(received) < n_messages:
+            receipt = uuid.uuid4().hex
+            self.in_flight[receipt] = self.messages.popleft()
+            received.append((receipt, self.in_flight[receipt]))
+        return received
+
+    def delete(self, receipts):
+        for receipt in receipts:
+            self.in_flight.pop(receipt, None)
+
+    def release(self):
+        """
+        Put the received but not deleted messages back in the queue
+        (similar to the end of SQS' visibility timeout).
+        """
+        self.messages.extend(self.in_flight.values())
+        self.in_flight = {}
+
+
+def copy_group(messages, copy_function, max_workers):
+    """
+    Call `copy_function(bucket, key)` for each message (dict with 'bucket'
+    and 'key') in the list `messages`, with at most `max_workers` (int)
+    copies running at the same time.
+
+    Returns a list of bools telling which copies succeeded.
+    """
+
+    def safe_copy(message):
+        try:
+            copy_function(message['bucket'], message['key'])
+            return True
+        except Exception as e:
+            print('Failed to copy', message, ':', e)
+            return False
+
+    if len(messages) == 0:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(messages))) as executor:
+        return list(executor.map(safe_copy, messages))
+
+
+def drain(queue, copy_function, group_size=max_group_size, max_workers=8, keep_going=None):
+    """
+    Receive messages from `queue` (`SQSQueue` or `LocalQueue`) in groups of
+    `group_size` and copy each group concurrently with `copy_group`. Messages
+    successfully copied are deleted from the queue; failed ones stay there to
+    be retried later.
+
+    Stops when the queue is empty or when `keep_going()` (optional function)
+    returns False. Returns the number of files copied.
+    """
+    n_copied = 0
+    while keep_going == None or keep_going():
+        received = queue.receive(group_size)
+        if len(received) == 0:
+            break
+
+        receipts = [receipt for receipt, message in received]
+        messages = [message for receipt, message in received]
+        success  = copy_group(messages, copy_function, max_workers)
+
+        queue.delete([receipt for receipt, ok in zip(receipts, success) if ok])
+        n_copied = n_copied + sum(success)
+
+    return n_copied
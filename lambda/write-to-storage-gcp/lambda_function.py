@@ -1,39 +1,95 @@
 import json
-from google.cloud import storage
 import boto3
+import copy_queue
+import cloud_clients
+
+# Size of the pieces streamed from AWS S3 to Google Storage's resumable upload
+# (must be a multiple of 256 KB):
+chunk_size = 8 * 1024 * 1024
+# Number of files copied at the same time in batch mode:
+max_workers = 8
+# Stop draining the queue when the Lambda has less time than this left:
+min_remaining_ms = 60000
 
 client = boto3.client('s3')
-a = client.get_object(
-                  Bucket='config-lambda', 
-                  Key='layers/google-cloud-storage/gabinete-compartilhado.json')
-open('/tmp/key.json', 'w').write(a['Body'].read().decode('utf-8'))
 
-def get_file_s3(bucket, key):
-    
-    return client.get_object(
-            Bucket=bucket,
-            Key=key
-        )['Body'].read().decode('utf-8')
-        
-def upload_to_storage_gcp(bucket, key, data):
-    
-    storage_client = storage.Client(project='gabinete-compartilhado')
-    
-    bucket = storage_client.get_bucket(bucket)
-    blob = bucket.blob(key)
+
+def get_bucket_gcp(bucket):
+    """
+    Return a handle to the Google Storage `bucket` (str), from the
+    Google Storage client kept across warm invocations.
+    """
+    # `bucket()` does not call the API (unlike `get_bucket()`):
+    return cloud_clients.storage_client().bucket(bucket)
+
+
+def copy_s3_to_storage_gcp(bucket, key):
+    """
+    Copy the file `key` (str) in AWS S3 `bucket` (str) to the same bucket
+    and key in Google Storage. The file is streamed in chunks into a resumable
+    upload, so it is never fully loaded (nor decoded) in memory.
+    """
+
+    s3_object = client.get_object(Bucket=bucket, Key=key)
+    blob      = get_bucket_gcp(bucket).blob(key, chunk_size=chunk_size)
+
+    with blob.open('wb', content_type=s3_object.get('ContentType')) as gcp_file:
+        for chunk in s3_object['Body'].iter_chunks(chunk_size):
+            gcp_file.write(chunk)
+
+
+def copy_sqs_records(records):
+    """
+    Copy the files listed in the messages `records` of an SQS event (each
+    message body is like {"bucket": ..., "key": ...}) concurrently. Returns 
+    the SQS partial batch response, listing the messages that failed (so 
+    only these are retried).
+    """
+    messages = [json.loads(record['body']) for record in records]
+    success  = copy_queue.copy_group(messages, copy_s3_to_storage_gcp, max_workers)
     
-    blob.upload_from_string(data)   
+    return {'batchItemFailures': [{'itemIdentifier': record['messageId']} 
+                                  for record, ok in zip(records, success) if not ok]}
+
 
 def lambda_handler(event, context):
-    
+    """
+    Copy files from AWS S3 to Google Storage.
+
+    Sample input
+    ------------
+
+    event : dict
+        {'bucket': 'brutos-publicos', 'key': 'legislativo/camara/v2/partidos/camara-partidos.json'}
+        or, to copy many files in one invocation:
+        {'bucket': 'brutos-publicos', 'keys': ['path/file1.json', 'path/file2.json']}
+        or, to drain an SQS queue of files to copy (see copy_queue):
+        {'queue_url': 'https://sqs.us-east-1.amazonaws.com/085250262607/write-to-storage-gcp'}
+        or an SQS event (when this function is triggered by the queue), with 
+        messages like {"bucket": ..., "key": ...}.
+    """
+
     print(event)
+
+    # Triggered by SQS: copy the group of files received:
+    if 'Records' in event:
+        return copy_sqs_records(event['Records'])
     
+    # Drain the queue while there is time:
+    if 'queue_url' in event:
+        keep_going = lambda: not hasattr(context, 'get_remaining_time_in_millis') or \
+                             context.get_remaining_time_in_millis() > min_remaining_ms
+        n_copied = copy_queue.drain(copy_queue.SQSQueue(event['queue_url']), copy_s3_to_storage_gcp,
+                                    max_workers=max_workers, keep_going=keep_going)
+        print('Copied', n_copied, 'files.')
+        return event
+
     bucket = event['bucket']
-    key = event['key']
-    
-  
-    data = get_file_s3(bucket, key)
-    upload_to_storage_gcp(bucket, key, data)
+    keys   = event['keys'] if 'keys' in event else [event['key']]
 
-    return event
+    success = copy_queue.copy_group([{'bucket': bucket, 'key': key} for key in keys], copy_s3_to_storage_gcp, max_workers)
+    # Fail the invocation (so Lambda retries it) if any copy failed:
+    if not all(success):
+        raise Exception('Failed to copy some files to Google Storage.')
 
+    return event
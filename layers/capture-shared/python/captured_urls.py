@@ -0,0 +1,224 @@
+"""
+Store of URLs already captured (e.g. DOU articles), kept in an AWS
+DynamoDB table (one item {'url': ...} per URL) or, when running locally,
+in a text file (one URL per line).
+
+The store loads the captured URLs once into a set, so checking whether
+a URL was captured does not scan a list. Histories larger than
+`bloom_threshold` are loaded into a Bloom filter instead, which uses
+much less memory at the cost of a small false positive rate
+(`bloom_error`).
+
+New URLs are buffered and written in batches of `flush_size` URLs (the
+DynamoDB limit for `batch_write_item`). Call `flush` (or `flush_all`)
+before the Lambda invocation ends; URLs still in the buffer if the
+invocation crashes are simply captured again next time.
+
+PS: This file is part of the capture-shared Lambda layer (see layers/create_shared_layer.sh),
+used by the capture_dou and http-request Lambda functions.
+"""
+
+import hashlib
+import math
+import os
+import threading
+import time
+
+# Number of buffered URLs that triggers a batch write (max. 25 for DynamoDB):
+flush_size      = 25
+# Load histories with more than this number of URLs into a Bloom filter (None = never):
+bloom_threshold = 1000000
+# False positive rate of the Bloom filter:
+bloom_error     = 0.000001
+
+# Registry of stores, one per table (or file):
+stores      = {}
+stores_lock = threading.Lock()
+# DynamoDB client (boto3's default session is not thread-safe):
+dynamodb    = None
+client_lock = threading.Lock()
+
+
+def get_dynamodb():
+    """
+    Return the DynamoDB client, creating it if it does not exist yet.
+    """
+    global dynamodb
+    with client_lock:
+        if dynamodb == None:
+            import boto3
+            dynamodb = boto3.session.Session().client('dynamodb')
+    return dynamodb
+
+
+def batch_write(table_name, write_requests):
+    """
+    Send the list of DynamoDB `write_requests` (dicts like {'PutRequest': 
+    ...} or {'DeleteRequest': ...}) to the table `table_name` (str), in 
+    batches of `flush_size`, retrying the items not processed (e.g. due to
+    throttling).
+    """
+    for i in range(0, len(write_requests), flush_size):
+        unprocessed = {table_name: write_requests[i:i + flush_size]}
+        wait = 0.05
+        while len(unprocessed) > 0:
+            unprocessed = get_dynamodb().batch_write_item(RequestItems=unprocessed).get('UnprocessedItems', {})
+            if len(unprocessed) > 0:
+                time.sleep(wait)
+                wait = min(wait * 2, 5)
+
+
+class BloomFilter:
+    """
+    Set-like structure for `n_items` (int) strings with false positive
+    rate `error` (float): `url in bloom` may be True for some URLs that
+    were never added, but is always True for the ones added.
+    """
+
+    def __init__(self, n_items, error):
+        n_items       = max(n_items, 1)
+        self.n_bits   = int(math.ceil(-n_items * math.log(error) / math.log(2) ** 2))
+        self.n_hashes = max(1, int(round(self.n_bits / n_items * math.log(2))))
+        self.bits     = bytearray((self.n_bits + 7) // 8)
+
+    def positions(self, item):
+        """
+        Return the bit positions for `item` (str), by enhanced double hashing.
+        """
+        digest    = hashlib.sha256(item.encode('utf-8')).digest()
+        h1        = int.from_bytes(digest[:16], 'big') % self.n_bits
+        h2        = int.from_bytes(digest[16:], 'big') % self.n_bits
+        positions = []
+        for i in range(self.n_hashes):
+            positions.append(h1)
+            h1 = (h1 + h2) % self.n_bits
+            h2 = (h2 + i + 1) % self.n_bits
+        return positions
+
+    def add(self, item):
+        for p in self.positions(item):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self.positions(item))
+
+
+class CapturedURLs:
+    """
+    Captured URLs stored in the DynamoDB table (or, if `local` is True,
+    the file) `url_list` (str).
+    """
+
+    def __init__(self, url_list, local=False):
+        self.url_list = url_list
+        self.local    = local
+        self.captured = None
+        self.buffer   = []
+        self.lock     = threading.Lock()
+
+    def read_all(self):
+        """
+        Return a list of all URLs in the storage.
+        """
+        if self.local:
+            if os.path.isfile(self.url_list) == False:
+                return []
+            with open(self.url_list, 'r') as f:
+                return f.read().splitlines()
+
+        paginator = get_dynamodb().get_paginator('scan')
+        pages     = paginator.paginate(TableName=self.url_list, ProjectionExpression='#u',
+                                       ExpressionAttributeNames={'#u': 'url'})
+        return [item['url']['S'] for page in pages for item in page['Items']]
+
+    def load(self):
+        """
+        (Re)load the captured URLs from the storage into memory, as a set
+        or (for large histories) a Bloom filter. The URLs still in the
+        buffer are kept.
+        """
+        urls = self.read_all()
+        if bloom_threshold != None and len(urls) > bloom_threshold:
+            captured = BloomFilter(len(urls) * 2, bloom_error)
+            for url in urls:
+                captured.add(url)
+        else:
+            captured = set(urls)
+
+        with self.lock:
+            for url in self.buffer:
+                captured.add(url)
+            self.captured = captured
+
+    def __contains__(self, url):
+        if self.captured == None:
+            self.load()
+        return url in self.captured
+
+    def add(self, url):
+        """
+        Register `url` (str) as captured. It is written to the storage
+        together with other URLs when the buffer is full.
+        """
+        with self.lock:
+            if self.captured != None:
+                self.captured.add(url)
+            self.buffer.append(url)
+            full = len(self.buffer) >= flush_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered URLs to the storage.
+        """
+        with self.lock:
+            urls, self.buffer = self.buffer, []
+        if len(urls) == 0:
+            return
+
+        if self.local:
+            with open(self.url_list, 'a') as f:
+                f.write(''.join([url + '\n' for url in urls]))
+            return
+
+        # Remove repeated URLs (DynamoDB rejects batches with repeated keys):
+        urls = list(dict.fromkeys(urls))
+        batch_write(self.url_list, [{'PutRequest': {'Item': {'url': {'S': url}}}} for url in urls])
+
+    def erase(self):
+        """
+        Erase all URLs from the storage (and from memory).
+        """
+        with self.lock:
+            self.buffer   = []
+            self.captured = set()
+
+        if self.local:
+            with open(self.url_list, 'w') as f:
+                f.write('')
+            return
+
+        urls = self.read_all()
+        batch_write(self.url_list, [{'DeleteRequest': {'Key': {'url': {'S': url}}}} for url in urls])
+
+
+def get_store(url_list, local=False):
+    """
+    Return the `CapturedURLs` store for the DynamoDB table (or local file)
+    `url_list` (str), creating it if it does not exist yet.
+    """
+    with stores_lock:
+        if url_list not in stores:
+            stores[url_list] = CapturedURLs(url_list, local)
+        return stores[url_list]
+
+
+def flush_all():
+    """
+    Write the URLs buffered in all stores to their storages.
+    """
+    with stores_lock:
+        to_flush = list(stores.values())
+    for store in to_flush:
+        store.flush()
@@ -0,0 +1,161 @@
+"""
+Cache of credentials and clients for Google Cloud (BigQuery, Storage) and
+AWS Athena.
+
+The credentials (Google's key file, AWS access keys), clients and
+connections are built on first use and kept at module level, so warm
+Lambda invocations reuse them instead of downloading the keys from S3
+and opening new connections every time. Each cached object is rebuilt
+after `ttl` seconds, so rotated keys are eventually picked up.
+
+The Google and Athena packages are only imported when needed.
+
+PS: This file is part of the capture-shared Lambda layer (see layers/create_shared_layer.sh),
+used by the parametrize-API-requests, python-process, capture_dou,
+bigquery-to-sns, add-to-bigquery, add-to-bigquery-slave and
+write-to-storage-gcp Lambda functions.
+"""
+
+import json
+import os
+import threading
+import time
+
+# Where the keys are stored in AWS S3:
+keys_bucket  = 'config-lambda'
+gcp_key_s3   = 'layers/google-cloud-storage/gabinete-compartilhado.json'
+aws_keys_s3  = 'aws_accessKeys.json'
+# Local copy of Google's key file:
+gcp_key_path = '/tmp/key.json'
+
+gcp_project  = 'gabinete-compartilhado'
+gcp_scopes   = ['https://www.googleapis.com/auth/drive',
+                'https://www.googleapis.com/auth/bigquery']
+athena_staging_dir = 's3://stagging-random/'
+athena_region      = 'us-east-1'
+
+# Time (in seconds) after which cached credentials and clients are rebuilt:
+ttl = 3600
+
+# Cached objects: name -> (creation time, object). The lock is reentrant
+# since building an object may require other cached objects.
+cache      = {}
+cache_lock = threading.RLock()
+
+
+def cached(name, build):
+    """
+    Return the object cached under `name` (str), calling `build()` to
+    (re)create it if it does not exist or is older than `ttl`.
+    """
+    with cache_lock:
+        if name not in cache or time.time() - cache[name][0] > ttl:
+            cache[name] = (time.time(), build())
+        return cache[name][1]
+
+
+def clear():
+    """
+    Drop all cached objects (e.g. after an authentication error).
+    """
+    with cache_lock:
+        cache.clear()
+
+
+def s3_client():
+    """
+    Return the AWS S3 client used to download the keys.
+    """
+    import boto3
+    return cached('s3', lambda: boto3.session.Session().client('s3'))
+
+
+def gcp_key_file():
+    """
+    Download Google's key file from AWS S3 to `gcp_key_path` and return
+    this path. The environment variable GOOGLE_APPLICATION_CREDENTIALS
+    points to it, unless it was already set.
+    """
+    def build():
+        a = s3_client().get_object(Bucket=keys_bucket, Key=gcp_key_s3)
+        open(gcp_key_path, 'w').write(a['Body'].read().decode('utf-8'))
+        os.environ.setdefault('GOOGLE_APPLICATION_CREDENTIALS', gcp_key_path)
+        return gcp_key_path
+
+    return cached('gcp_key_file', build)
+
+
+def gcp_credentials():
+    """
+    Return Google credentials with Drive & BigQuery API scopes and the
+    project they belong to, as a tuple (credentials, project).
+    """
+    def build():
+        import google.auth
+        gcp_key_file()
+        # Both APIs must be enabled for the project:
+        return google.auth.default(scopes=gcp_scopes)
+
+    return cached('gcp_credentials', build)
+
+
+def bigquery_client():
+    """
+    Return a Google BigQuery client.
+    """
+    def build():
+        from google.cloud import bigquery
+        credentials, project = gcp_credentials()
+        return bigquery.Client(credentials=credentials, project=project)
+
+    return cached('bigquery', build)
+
+
+def storage_client():
+    """
+    Return a Google Storage client.
+    """
+    def build():
+        from google.cloud import storage
+        gcp_key_file()
+        return storage.Client(project=gcp_project)
+
+    return cached('storage', build)
+
+
+def aws_keys():
+    """
+    Return a dict with the AWS access keys ('aws_access_key_id' and
+    'aws_secret_access_key') stored in S3.
+    """
+    def build():
+        a = s3_client().get_object(Bucket=keys_bucket, Key=aws_keys_s3)
+        return json.loads(a['Body'].read().decode('utf-8'))
+
+    return cached('aws_keys', build)
+
+
+def athena_connection():
+    """
+    Return a connection to AWS Athena (with pyathena).
+    """
+    def build():
+        from pyathena import connect
+        aws_key = aws_keys()
+        return connect(aws_access_key_id=aws_key['aws_access_key_id'],
+                       aws_secret_access_key=aws_key['aws_secret_access_key'],
+                       s3_staging_dir=athena_staging_dir,
+                       region_name=athena_region)
+
+    return cached('athena', build)
+
+
+def athena_cursor(cursor_class=None):
+    """
+    Return a new cursor from the cached Athena connection. `cursor_class`
+    is a pyathena cursor class (e.g. ArrowCursor); if None, the default 
+    cursor is used.
+    """
+    if cursor_class == None:
+        return athena_connection().cursor()
+    return athena_connection().cursor(cursor_class)
@@ -0,0 +1,76 @@
+"""
+Registry of HTTP sessions, one per host, shared by all requests made by
+a Lambda function (in http-request, including the ones in
+`external_modules`).
+
+The sessions are stored at module level, so they (and their open
+connections) survive between warm Lambda invocations. This avoids
+repeating the TCP and TLS handshakes for every request to the same
+host (e.g. dadosabertos.camara.leg.br, www.in.gov.br).
+
+PS: This file is part of the capture-shared Lambda layer (see layers/create_shared_layer.sh),
+used by the http-request and capture_dou Lambda functions.
+"""
+
+import threading
+from urllib.parse import urlparse
+import requests
+from urllib3.util.retry import Retry
+
+# Connection pool and retry settings:
+pool_maxsize     = 16                        # Max. number of connections kept alive per host.
+max_retries      = 3                         # Number of retries for failed requests.
+backoff_factor   = 0.5                       # Sleep 0.5s, 1s, 2s... between retries.
+status_forcelist = [429, 500, 502, 503, 504] # HTTP status codes that trigger a retry.
+
+# Registry of sessions, keyed by scheme and host:
+sessions      = {}
+sessions_lock = threading.Lock()
+
+
+def build_session():
+    """
+    Create a `requests.Session` with a connection pool of size
+    `pool_maxsize` and a retry policy with exponential backoff.
+    """
+    retry = Retry(total=max_retries,
+                  connect=max_retries,
+                  read=max_retries,
+                  backoff_factor=backoff_factor,
+                  status_forcelist=status_forcelist,
+                  # Return the last response instead of raising an error if
+                  # all retries return a bad status (the caller checks the status):
+                  raise_on_status=False)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=pool_maxsize,
+                                            max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+def get_session(url):
+    """
+    Return the shared `requests.Session` for the host in `url` (str),
+    creating it if it does not exist yet.
+    """
+    parsed = urlparse(url)
+    host   = parsed.scheme + '://' + parsed.netloc
+
+    with sessions_lock:
+        if host not in sessions:
+            sessions[host] = build_session()
+
+    return sessions[host]
+
+
+def close_sessions():
+    """
+    Close all sessions in the registry (and their connections).
+    """
+    with sessions_lock:
+        for session in sessions.values():
+            session.close()
+        sessions.clear()
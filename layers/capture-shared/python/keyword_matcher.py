@@ -0,0 +1,141 @@
+"""
+Keyword filters (Gabi bot filters) compiled for fast matching.
+
+Each bot_info has a list of filters, each with a 'column_name' and
+(optionally) 'positive_filter' and 'negative_filter' keyword lists. A
+row (a DOU article, a tramitação) is selected by a bot if, for all its
+filters, the column is not None, contains at least one positive keyword
+and contains no negative keyword (case-insensitive substring match).
+
+Instead of lowering the column again for every keyword of every bot,
+`FilterSets` puts all keywords used on each column (by all bots) into
+one `KeywordMatcher` (an Aho-Corasick automaton), so each column of a
+row is lowered and scanned only once, whatever the number of bots.
+
+PS: This file is part of the capture-shared Lambda layer (see layers/create_shared_layer.sh),
+used by the capture_dou and bigquery-to-sns Lambda functions.
+"""
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton that finds which of the `keywords` (list of
+    str) appear as substrings of a text.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = list(dict.fromkeys(keywords))
+        self.ids      = {keyword: i for i, keyword in enumerate(self.keywords)}
+        # Transitions, failure links and keywords ending at each node (node 0 is the root):
+        self.goto     = [{}]
+        self.fail     = [0]
+        self.out      = [[]]
+
+        # Build a trie with all keywords:
+        for i, keyword in enumerate(self.keywords):
+            node = 0
+            for char in keyword:
+                if char not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                    self.goto[node][char] = len(self.goto) - 1
+                node = self.goto[node][char]
+            self.out[node].append(i)
+
+        # Set failure links (longest proper suffix that is in the trie), in breadth-first order:
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fail = self.fail[node]
+                while fail != 0 and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                if node != 0 and char in self.goto[fail]:
+                    self.fail[child] = self.goto[fail][char]
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def find(self, text):
+        """
+        Return the set of ids (positions in `self.keywords`) of the
+        keywords found in `text` (str).
+        """
+        goto  = self.goto
+        fail  = self.fail
+        out   = self.out
+        # The empty keyword (if any) is found in every text:
+        found = set(out[0])
+        node  = 0
+        for char in text:
+            while node != 0 and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+
+class FilterSets:
+    """
+    The filters of all `bot_infos` (list of dicts), compiled into one
+    `KeywordMatcher` per column.
+    """
+
+    def __init__(self, bot_infos):
+        # All (lowered) keywords used on each column:
+        keywords = {}
+        for bot_info in bot_infos:
+            for f in bot_info['filters']:
+                for kind in ('positive_filter', 'negative_filter'):
+                    if kind in f:
+                        keywords.setdefault(f['column_name'], []).extend([var.lower() for var in f[kind]])
+        self.matchers = {column: KeywordMatcher(words) for column, words in keywords.items()}
+
+        # Filters of each bot as (column, positive keyword ids, negative keyword ids) tuples,
+        # where None means that there is no such filter:
+        self.compiled = []
+        for bot_info in bot_infos:
+            compiled = []
+            for f in bot_info['filters']:
+                column = f['column_name']
+                ids    = [frozenset([self.matchers[column].ids[var.lower()] for var in f[kind]])
+                          if kind in f else None for kind in ('positive_filter', 'negative_filter')]
+                compiled.append((column, ids[0], ids[1]))
+            self.compiled.append(compiled)
+
+    def matches(self, row):
+        """
+        Return a list of bools telling, for each bot_info, whether the
+        `row` (dict from column names to values) passes all its filters.
+        """
+        # Keywords found in each column of the row (scanned only when needed):
+        found   = {}
+        results = []
+        for compiled in self.compiled:
+            selected = True
+            for column, positive, negative in compiled:
+                if row[column] is None:
+                    selected = False
+                    break
+                if column not in found:
+                    found[column] = self.matchers[column].find(row[column].lower()) if column in self.matchers else set()
+                if positive is not None and found[column].isdisjoint(positive):
+                    selected = False
+                    break
+                if negative is not None and not found[column].isdisjoint(negative):
+                    selected = False
+                    break
+            results.append(selected)
+        return results
+
+    def select(self, rows):
+        """
+        Return, for each bot_info, the list of `rows` (list of dicts) that
+        pass all its filters (in the same order as in `rows`).
+        """
+        selected = [[] for compiled in self.compiled]
+        for row in rows:
+            for i, ok in enumerate(self.matches(row)):
+                if ok:
+                    selected[i].append(row)
+        return selected
@@ -0,0 +1,159 @@
+"""
+Encoding of captured records into the file formats saved to AWS S3.
+
+The format is chosen with the `output_format` config entry:
+* 'njson'     -- newline-delimited JSON (default), saved as '.json';
+* 'njson.gz'  -- gzip-compressed newline-delimited JSON, saved as '.json.gz';
+* 'njson.zst' -- zstd-compressed newline-delimited JSON, saved as '.json.zst'
+                 (requires the `zstandard` package);
+* 'parquet'   -- Apache Parquet, saved as '.parquet' (requires `pyarrow`).
+                 Columns are strings unless their type is set in the
+                 `output_schema` config entry (see `table_schema`).
+
+PS: This file is part of the capture-shared Lambda layer (see layers/create_shared_layer.sh),
+used by the http-request, capture_dou, python-process and
+parametrize-API-requests Lambda functions.
+"""
+
+import gzip
+import io
+import json
+
+# File extension of each output format:
+extensions = {'njson': '.json', 'njson.gz': '.json.gz', 'njson.zst': '.json.zst', 'parquet': '.parquet'}
+
+
+def get_format(config):
+    """
+    Return the output format (str) set in the dict `config` under the
+    key 'output_format', or 'njson' if it is not set.
+    """
+    output_format = config.get('output_format')
+    if output_format == None:
+        return 'njson'
+    return output_format
+
+
+def check_format(output_format):
+    """
+    Raise an error if `output_format` (str) is not a known format.
+    """
+    if output_format not in extensions:
+        raise Exception('Unknown output_format \'' + str(output_format) + '\'.')
+
+
+def output_key(key, output_format='njson'):
+    """
+    Given an S3 `key` (str) ending in '.json', return the key with the
+    file extension of `output_format` (str).
+    """
+    check_format(output_format)
+    if key[-5:] == '.json':
+        key = key[:-5]
+    return key + extensions[output_format]
+
+
+def compress(data, output_format):
+    """
+    Compress `data` (bytes) according to `output_format` (str):
+    'njson.gz' uses gzip, 'njson.zst' uses zstd and 'njson' does
+    nothing.
+    """
+    if output_format == 'njson.gz':
+        return gzip.compress(data)
+    if output_format == 'njson.zst':
+        import zstandard
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def get_schema(config):
+    """
+    Return the Parquet column types (dict from column name to pyarrow type
+    name) set in the dict `config` under the key 'output_schema', or None.
+    """
+    return config.get('output_schema')
+
+
+def encode_lines(lines, output_format='njson', column_types=None):
+    """
+    Given a list of JSON strings `lines` (one per record), return the
+    content of the file (bytes) in `output_format` (str). `column_types`
+    is only used for Parquet (see `table_schema`).
+    """
+    check_format(output_format)
+    if output_format == 'parquet':
+        return encode_records([json.loads(line) for line in lines], output_format, column_types)
+
+    return compress('\n'.join(lines).encode('utf-8'), output_format)
+
+
+def encode_records(records, output_format='njson', column_types=None):
+    """
+    Given a list of dicts `records`, return the content of the file
+    (bytes) in `output_format` (str). `column_types` is only used for
+    Parquet (see `table_schema`).
+    """
+    check_format(output_format)
+    if output_format == 'parquet':
+        import pyarrow.parquet as pq
+        buffer = io.BytesIO()
+        pq.write_table(records_to_table(records, table_schema(records, column_types)), buffer, compression='snappy')
+        return buffer.getvalue()
+
+    return encode_lines([json.dumps(record, ensure_ascii=False) for record in records], output_format)
+
+
+def table_schema(records, column_types=None):
+    """
+    Return the pyarrow schema of a Parquet file with the list of dicts
+    `records`. The schema does not depend on the values in `records`, so
+    all files of the same table get the same column types: `column_types`
+    (dict from column name to a pyarrow type name, e.g. 'int64', 'double',
+    'bool', set in the config under 'output_schema') gives the type of some
+    columns, and all other columns are strings. The columns in
+    `column_types` come first (even if missing in `records`), followed by
+    the other keys found in the records (in order of first appearance).
+    """
+    import pyarrow as pa
+
+    if column_types == None:
+        column_types = {}
+
+    # Column names, keeping the order they appear:
+    columns = list(dict.fromkeys(list(column_types) + [key for record in records for key in record]))
+
+    return pa.schema([pa.field(column, pa.type_for_alias(column_types.get(column, 'string')))
+                      for column in columns])
+
+
+def to_string(value):
+    """
+    Represent `value` as a string for a string column: nested data is
+    dumped as JSON, None is kept.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def records_to_table(records, schema=None):
+    """
+    Build a pyarrow Table from the list of dicts `records`, using `schema`
+    (by default, all columns are strings, see `table_schema`).
+    """
+    import pyarrow as pa
+
+    if schema is None:
+        schema = table_schema(records)
+
+    columns = []
+    for field in schema:
+        values = [record.get(field.name) for record in records]
+        if pa.types.is_string(field.type):
+            values = [to_string(value) for value in values]
+        columns.append(pa.array(values, type=field.type))
+
+    return pa.Table.from_arrays(columns, schema=schema)
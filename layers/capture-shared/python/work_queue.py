@@ -0,0 +1,578 @@
+"""
+Work queues listing the items to be captured by http-request.
+
+parametrize-API-requests puts the items of a capture (dicts built by
+`generate_body`) in a queue, numbered by the key 'order' (0, 1, 2...),
+and http-request loads them by 'order'. In the Lambda payloads (`params`),
+a queue is identified by:
+* 'queue_backend' -- the implementation that stores the queue (see below);
+* 'queue_id'      -- the queue name, e.g.
+                     'capture-camara-tramitacoes-live-2020-06-23-16-30-26-0'.
+Old payloads containing only 'dynamo_table_name' use the 'temp_table' backend.
+
+Backends:
+* 'partitioned' (`PartitionedTableQueue`) -- a single long-lived DynamoDB
+  table with hash key 'queue_id' and range key 'order' (the default). The
+  table is created the first time it is needed. Creating and deleting a
+  queue does not create or delete any table. The items of each queue are
+  spread over `n_shards` hash keys, so a large queue is not a single hot
+  partition. Items also expire (DynamoDB TTL) in case a queue is never
+  deleted.
+* 'temp_table' (`TempTableQueue`) -- one DynamoDB table per queue (the
+  original behaviour), deleted by the dynamodb-delete-table Lambda. Used
+  when the capture config sets 'queue_backend' to 'temp_table'. Queues
+  created before the 'partitioned' default (payloads without
+  'queue_backend') are still read from their temp tables.
+* 'sqlite' (`SQLiteQueue`) -- a SQLite file, for local runs.
+
+Each queue also has atomic counters (`add_to_counter`), used by the shared
+cursor scheduler: many http-request workers `claim` the next unclaimed range
+(chunk) of orders from the same queue and report the items finished with
+`mark_done`. Each claimed chunk has a lease: if it is not finished before
+the lease expires (e.g. the worker timed out), another worker claims it
+again. In DynamoDB, the counters and leases are stored in the item with
+order `counters_order`.
+
+PS: This file is part of the capture-shared Lambda layer (see layers/create_shared_layer.sh),
+used by the parametrize-API-requests and http-request Lambda functions.
+"""
+
+import abc
+import json
+import sqlite3
+import threading
+import time
+from dynamodb_json import json_util as dyjson
+
+# Long-lived DynamoDB table used by the 'partitioned' backend:
+partitioned_table = 'capture-work-queue'
+# Items in the partitioned table expire after this number of days:
+ttl_days          = 7
+# SQLite file used by the 'sqlite' backend:
+sqlite_path       = '/tmp/work_queue.sqlite'
+# Backend used when not specified in the capture config:
+default_backend   = 'partitioned'
+# Number of hash keys the items of a queue are spread over, in the partitioned table:
+n_shards          = 16
+# Maximum number of seconds `create` waits for a new DynamoDB table to be ready:
+default_max_wait  = 300
+
+# Order of the item holding the queue's counters (not a capture item):
+counters_order = -1
+# Claimed chunks not finished after this number of seconds (the Lambda timeout) can be claimed again:
+lease_seconds  = 900
+
+# DynamoDB's BatchGetItem accepts at most 100 keys per call:
+max_batch_keys = 100
+
+# Queue objects (and their clients), kept across warm invocations:
+queues      = {}
+queues_lock = threading.Lock()
+
+
+def new_session():
+    """
+    Return a new boto3 session (boto3's default session is not thread-safe).
+    """
+    import boto3
+    return boto3.session.Session()
+
+
+def batch_get(client, table_name, keys):
+    """
+    Get the items identified by the list of DynamoDB `keys` (in dyJSON) from
+    `table_name` (str) with BatchGetItem, retrying unprocessed keys. Returns a
+    list of items (dicts, translated from dyJSON) in any order.
+    """
+    items = []
+    for i in range(0, len(keys), max_batch_keys):
+        request = {table_name: {'Keys': keys[i:i + max_batch_keys]}}
+        # Keep requesting until DynamoDB processed all keys:
+        while len(request) > 0:
+            response = client.batch_get_item(RequestItems=request)
+            items.extend(dyjson.loads(response['Responses'].get(table_name, [])))
+            request = response['UnprocessedKeys']
+
+    return items
+
+
+class DynamoDBCounters(abc.ABC):
+    """
+    Counters and chunk leases of queues stored in DynamoDB, kept in the item
+    with order `counters_order` (see `counters_location`). The lease of each
+    claimed chunk is an element of the list attribute 'leases' (position =
+    chunk number), holding the time (in seconds since the epoch) when the
+    lease expires, or 0 once the chunk is finished.
+
+    Subclasses must set `self.client` (a DynamoDB client) and implement
+    `counters_location`.
+    """
+
+    @abc.abstractmethod
+    def counters_location(self, queue_id):
+        """
+        Return the table name (str) and the key (dyJSON) of the item that
+        holds the counters of the queue `queue_id` (str).
+        """
+
+    def counters_extra(self):
+        """
+        Return extra 'SET' actions (list of str) and their values (dict) to
+        be applied whenever the counters item is updated.
+        """
+        return [], {}
+
+    def update_counters(self, queue_id, adds, sets, values, names, condition=None):
+        """
+        Update the counters item of the queue `queue_id` (str) with the
+        'ADD' and 'SET' actions `adds` and `sets` (lists of str), using the
+        placeholders `values` and `names` (dicts). Returns the updated
+        attributes (dyJSON), or None if the `condition` (str) failed.
+        """
+        table_name, key          = self.counters_location(queue_id)
+        extra_sets, extra_values = self.counters_extra()
+        sets    = sets + extra_sets
+        update  = ' '.join((['ADD ' + ', '.join(adds)] if len(adds) > 0 else []) +
+                           (['SET ' + ', '.join(sets)] if len(sets) > 0 else []))
+        request = dict(TableName=table_name, Key=key, UpdateExpression=update, ReturnValues='UPDATED_NEW',
+                       ExpressionAttributeNames=names, ExpressionAttributeValues=dict(values, **extra_values))
+        if condition != None:
+            request['ConditionExpression'] = condition
+        try:
+            return self.client.update_item(**request)['Attributes']
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return None
+
+    def add_to_counter(self, queue_id, counter, n):
+        """
+        Atomically add `n` (int) to the `counter` (str) of the queue
+        `queue_id` (str), starting from 0, and return its new value.
+        """
+        attributes = self.update_counters(queue_id, ['#c :n'], [], {':n': {'N': str(n)}}, {'#c': counter})
+        return int(attributes[counter]['N'])
+
+    def claim_chunk(self, queue_id, chunk_size, expires_at):
+        """
+        Atomically claim the next `chunk_size` (int) orders of the queue
+        `queue_id` (str), with a lease that expires at `expires_at` (int).
+        Returns the first order claimed.
+        """
+        attributes = self.update_counters(queue_id, ['#c :n'], ['#l = list_append(if_not_exists(#l, :empty), :lease)'],
+                                          {':n': {'N': str(chunk_size)}, ':empty': {'L': []},
+                                           ':lease': {'L': [{'N': str(expires_at)}]}},
+                                          {'#c': 'claimed', '#l': 'leases'})
+        return int(attributes['claimed']['N']) - chunk_size
+
+    def renew_lease(self, queue_id, chunk, old_lease, new_lease):
+        """
+        Replace the lease `old_lease` of the `chunk` (int) of the queue
+        `queue_id` (str) by `new_lease` (int). Returns False if the lease
+        was not `old_lease` anymore (e.g. another worker renewed it first).
+        """
+        return self.update_counters(queue_id, [], ['#l[%d] = :new' % chunk],
+                                    {':new': {'N': str(new_lease)}, ':old': {'N': str(old_lease)}},
+                                    {'#l': 'leases'}, '#l[%d] = :old' % chunk) != None
+
+    def finish_chunk(self, queue_id, chunk, lease, n_done):
+        """
+        If the `chunk` (int) of the queue `queue_id` (str) still has the
+        `lease` (int), mark it as finished and add `n_done` (int) to the
+        'done' counter. Returns the new 'done' value, or None if the lease
+        was lost.
+        """
+        attributes = self.update_counters(queue_id, ['#d :n'], ['#l[%d] = :zero' % chunk],
+                                          {':n': {'N': str(n_done)}, ':zero': {'N': '0'}, ':lease': {'N': str(lease)}},
+                                          {'#d': 'done', '#l': 'leases'}, '#l[%d] = :lease' % chunk)
+        if attributes == None:
+            return None
+        return int(attributes['done']['N'])
+
+    def get_leases(self, queue_id):
+        """
+        Return the list of leases (ints, one per claimed chunk) of the
+        queue `queue_id` (str), or an empty list if it does not exist.
+        """
+        table_name, key = self.counters_location(queue_id)
+        try:
+            response = self.client.get_item(TableName=table_name, Key=key, ConsistentRead=True,
+                                            ProjectionExpression='#l', ExpressionAttributeNames={'#l': 'leases'})
+        except self.client.exceptions.ResourceNotFoundException:
+            return []
+        return [int(lease['N']) for lease in response.get('Item', {}).get('leases', {}).get('L', [])]
+
+
+class PartitionedTableQueue(DynamoDBCounters):
+    """
+    Queues stored as partitions of a single DynamoDB table `table_name`
+    (str), sorted by the range key 'order'. The hash key 'queue_id' of an
+    item is the queue name plus a shard number (see `shard_key`). The table
+    is created by `create` if it does not exist.
+    """
+
+    def __init__(self, table_name=partitioned_table):
+        self.table_name = table_name
+        self.has_table  = False
+        session         = new_session()
+        self.client     = session.client('dynamodb')
+        self.table      = session.resource('dynamodb').Table(table_name)
+
+    def create_table(self, max_wait=default_max_wait):
+        """
+        Create the DynamoDB table (with TTL on the attribute 'expires_at')
+        and wait until it exists (checking every 5s, for at most about 
+        `max_wait` seconds).
+        """
+        try:
+            self.client.create_table(TableName=self.table_name,
+                                     AttributeDefinitions=[{'AttributeName': 'queue_id', 'AttributeType': 'S'},
+                                                           {'AttributeName': 'order', 'AttributeType': 'N'}],
+                                     KeySchema=[{'AttributeName': 'queue_id', 'KeyType': 'HASH'},
+                                                {'AttributeName': 'order', 'KeyType': 'RANGE'}],
+                                     BillingMode='PAY_PER_REQUEST')
+        # Being created by another invocation:
+        except self.client.exceptions.ResourceInUseException:
+            pass
+        self.client.get_waiter('table_exists').wait(TableName=self.table_name,
+                                                    WaiterConfig={'Delay': 5, 'MaxAttempts': max(1, int(max_wait // 5))})
+        try:
+            self.client.update_time_to_live(TableName=self.table_name,
+                                            TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expires_at'})
+        # TTL already enabled (or being enabled by another invocation):
+        except self.client.exceptions.ClientError as e:
+            print('Could not enable TTL on ' + self.table_name + ':', e)
+
+    def create(self, queue_id, max_wait=default_max_wait):
+        """
+        Create the table if it does not exist yet (only checked once per
+        queue object), waiting at most about `max_wait` seconds for it. The 
+        queue itself exists as soon as it has items.
+        """
+        if self.has_table:
+            return
+        try:
+            self.client.describe_table(TableName=self.table_name)
+        except self.client.exceptions.ResourceNotFoundException:
+            self.create_table(max_wait)
+        self.has_table = True
+
+    def shard_key(self, queue_id, order):
+        """
+        Return the hash key of the item with `order` (int) in the queue
+        `queue_id` (str): items are spread over `n_shards` keys by order,
+        and the counters item uses the queue name itself.
+        """
+        if order == counters_order:
+            return queue_id
+        return queue_id + '#' + str(order % n_shards)
+
+    def put_items(self, queue_id, items, first_order=0):
+        """
+        Save the dicts in the iterable `items` to the queue `queue_id` (str),
+        each one with its position in `items` plus `first_order` (int) as
+        'order'. Items are written as they are read from `items`.
+        """
+        expires_at = int(time.time()) + ttl_days * 24 * 3600
+        with self.table.batch_writer() as batch:
+            for order, item in enumerate(items, first_order):
+                batch.put_item(Item=dict(item, queue_id=self.shard_key(queue_id, order), order=order,
+                                         expires_at=expires_at))
+
+    def counters_location(self, queue_id):
+        return self.table_name, {'queue_id': {'S': queue_id}, 'order': {'N': str(counters_order)}}
+
+    def counters_extra(self):
+        # The counters item also expires:
+        expires_at = int(time.time()) + ttl_days * 24 * 3600
+        return ['expires_at = if_not_exists(expires_at, :e)'], {':e': {'N': str(expires_at)}}
+
+    def clean(self, item):
+        """
+        Remove the attributes of the table from `item` (dict), leaving it
+        as it was put in the queue (plus 'order').
+        """
+        item.pop('queue_id', None)
+        item.pop('expires_at', None)
+        return item
+
+    def get_item(self, queue_id, order):
+        """
+        Return the item with `order` (int) in the queue `queue_id` (str),
+        or None if it does not exist.
+        """
+        response = self.client.get_item(TableName=self.table_name,
+                                        Key={'queue_id': {'S': self.shard_key(queue_id, order)},
+                                             'order': {'N': str(order)}})
+        response = dyjson.loads(response)
+        if 'Item' not in response:
+            return None
+        return self.clean(response['Item'])
+
+    def get_items(self, queue_id, orders):
+        """
+        Return the items with the orders listed in `orders` (list of ints)
+        in the queue `queue_id`, in the same order. Missing items are None.
+        """
+        keys  = [{'queue_id': {'S': self.shard_key(queue_id, order)}, 'order': {'N': str(order)}} for order in orders]
+        items = {item['order']: self.clean(item) for item in batch_get(self.client, self.table_name, keys)}
+        return [items.get(order) for order in orders]
+
+    def delete(self, queue_id):
+        """
+        Delete all items of the queue `queue_id` (str), in all its shards.
+        """
+        paginator = self.client.get_paginator('query')
+        hash_keys = [queue_id] + [queue_id + '#' + str(shard) for shard in range(n_shards)]
+        with self.table.batch_writer() as batch:
+            for hash_key in hash_keys:
+                pages = paginator.paginate(TableName=self.table_name,
+                                           KeyConditionExpression='queue_id = :q',
+                                           ExpressionAttributeValues={':q': {'S': hash_key}},
+                                           ProjectionExpression='queue_id, #o',
+                                           ExpressionAttributeNames={'#o': 'order'})
+                for page in pages:
+                    for key in dyjson.loads(page['Items']):
+                        batch.delete_item(Key=key)
+
+
+class TempTableQueue(DynamoDBCounters):
+    """
+    Each queue is a DynamoDB table named after the queue, with hash key 'order'.
+    """
+
+    def __init__(self):
+        session       = new_session()
+        self.client   = session.client('dynamodb')
+        self.resource = session.resource('dynamodb')
+
+    def wait_active(self, table_name, max_wait=default_max_wait, max_delay=10):
+        """
+        Wait until the table `table_name` (str) is ACTIVE, checking its
+        status with exponential backoff (from 0.5s to `max_delay` seconds).
+        Raise an error if it is not ready after `max_wait` seconds (never
+        sleeping past it). Returns the number of seconds waited.
+        """
+        delay  = 0.5
+        waited = 0
+        while True:
+            status = self.client.describe_table(TableName=table_name)['Table']['TableStatus']
+            if status == 'ACTIVE':
+                return waited
+            if waited >= max_wait:
+                raise Exception('Table ' + table_name + ' not ACTIVE after ' + str(waited) + 's (status: ' + status + ').')
+            sleep  = min(delay, max_wait - waited)
+            time.sleep(sleep)
+            waited = waited + sleep
+            delay  = min(2 * delay, max_delay)
+
+    def create(self, queue_id, max_wait=default_max_wait):
+        """
+        Create the table `queue_id` (str), if it does not exist, and wait
+        until it is ACTIVE (at most `max_wait` seconds).
+        """
+        try:
+            self.client.describe_table(TableName=queue_id)
+        except self.client.exceptions.ResourceNotFoundException:
+            self.client.create_table(TableName=queue_id,
+                                     AttributeDefinitions=[{'AttributeName': 'order', 'AttributeType': 'N'}],
+                                     KeySchema=[{'AttributeName': 'order', 'KeyType': 'HASH'}],
+                                     BillingMode='PAY_PER_REQUEST')
+        self.wait_active(queue_id, max_wait)
+
+    def put_items(self, queue_id, items, first_order=0):
+        table = self.resource.Table(queue_id)
+        with table.batch_writer() as batch:
+            for order, item in enumerate(items, first_order):
+                batch.put_item(Item=dict(item, order=order))
+
+    def counters_location(self, queue_id):
+        return queue_id, {'order': {'N': str(counters_order)}}
+
+    def get_item(self, queue_id, order):
+        response = dyjson.loads(self.client.get_item(TableName=queue_id, Key={'order': {'N': str(order)}}))
+        return response.get('Item')
+
+    def get_items(self, queue_id, orders):
+        keys  = [{'order': {'N': str(order)}} for order in orders]
+        items = {item['order']: item for item in batch_get(self.client, queue_id, keys)}
+        return [items.get(order) for order in orders]
+
+    def delete(self, queue_id):
+        self.client.delete_table(TableName=queue_id)
+
+
+class SQLiteQueue:
+    """
+    Queues stored in the SQLite file `path` (str), for local runs.
+    """
+
+    def __init__(self, path=sqlite_path):
+        self.path = path
+        with self.connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS queue_items '
+                               '(queue_id TEXT, item_order INTEGER, item TEXT, PRIMARY KEY (queue_id, item_order))')
+            connection.execute('CREATE TABLE IF NOT EXISTS queue_counters '
+                               '(queue_id TEXT, counter TEXT, value INTEGER, PRIMARY KEY (queue_id, counter))')
+            connection.execute('CREATE TABLE IF NOT EXISTS queue_leases '
+                               '(queue_id TEXT, chunk INTEGER, expires_at INTEGER, PRIMARY KEY (queue_id, chunk))')
+
+    def connect(self):
+        # A new connection per operation, so the queue can be used by many threads:
+        return sqlite3.connect(self.path, timeout=60)
+
+    def create(self, queue_id, max_wait=default_max_wait):
+        pass
+
+    def put_items(self, queue_id, items, first_order=0):
+        rows = ((queue_id, order, json.dumps(dict(item, order=order), ensure_ascii=False, default=str))
+                for order, item in enumerate(items, first_order))
+        with self.connect() as connection:
+            connection.executemany('INSERT OR REPLACE INTO queue_items VALUES (?, ?, ?)', rows)
+
+    def increment(self, connection, queue_id, counter, n):
+        # The first write locks the database until the end of the transaction:
+        connection.execute('INSERT OR IGNORE INTO queue_counters VALUES (?, ?, 0)', (queue_id, counter))
+        connection.execute('UPDATE queue_counters SET value = value + ? WHERE queue_id = ? AND counter = ?',
+                           (n, queue_id, counter))
+        return connection.execute('SELECT value FROM queue_counters WHERE queue_id = ? AND counter = ?',
+                                  (queue_id, counter)).fetchone()[0]
+
+    def add_to_counter(self, queue_id, counter, n):
+        with self.connect() as connection:
+            return self.increment(connection, queue_id, counter, n)
+
+    def claim_chunk(self, queue_id, chunk_size, expires_at):
+        with self.connect() as connection:
+            start = self.increment(connection, queue_id, 'claimed', chunk_size) - chunk_size
+            chunk = connection.execute('SELECT COUNT(*) FROM queue_leases WHERE queue_id = ?', (queue_id,)).fetchone()[0]
+            connection.execute('INSERT INTO queue_leases VALUES (?, ?, ?)', (queue_id, chunk, expires_at))
+        return start
+
+    def renew_lease(self, queue_id, chunk, old_lease, new_lease):
+        with self.connect() as connection:
+            cursor = connection.execute('UPDATE queue_leases SET expires_at = ? '
+                                        'WHERE queue_id = ? AND chunk = ? AND expires_at = ?',
+                                        (new_lease, queue_id, chunk, old_lease))
+            return cursor.rowcount > 0
+
+    def finish_chunk(self, queue_id, chunk, lease, n_done):
+        with self.connect() as connection:
+            cursor = connection.execute('UPDATE queue_leases SET expires_at = 0 '
+                                        'WHERE queue_id = ? AND chunk = ? AND expires_at = ?',
+                                        (queue_id, chunk, lease))
+            if cursor.rowcount == 0:
+                return None
+            return self.increment(connection, queue_id, 'done', n_done)
+
+    def get_leases(self, queue_id):
+        with self.connect() as connection:
+            rows = connection.execute('SELECT expires_at FROM queue_leases WHERE queue_id = ? ORDER BY chunk',
+                                      (queue_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def get_item(self, queue_id, order):
+        return self.get_items(queue_id, [order])[0]
+
+    def get_items(self, queue_id, orders):
+        with self.connect() as connection:
+            rows = connection.execute('SELECT item_order, item FROM queue_items WHERE queue_id = ? AND item_order IN ('
+                                      + ','.join(['?'] * len(orders)) + ')', [queue_id] + list(orders)).fetchall()
+        items = {order: json.loads(item) for order, item in rows}
+        return [items.get(order) for order in orders]
+
+    def delete(self, queue_id):
+        with self.connect() as connection:
+            connection.execute('DELETE FROM queue_items WHERE queue_id = ?', (queue_id,))
+            connection.execute('DELETE FROM queue_counters WHERE queue_id = ?', (queue_id,))
+            connection.execute('DELETE FROM queue_leases WHERE queue_id = ?', (queue_id,))
+
+
+backends = {'partitioned': PartitionedTableQueue, 'temp_table': TempTableQueue, 'sqlite': SQLiteQueue}
+
+
+def get_backend(params):
+    """
+    Return the name (str) of the backend of the queue described in `params`
+    (dict). Payloads without 'queue_backend' come from the temp table scheme.
+    """
+    return params.get('queue_backend', 'temp_table')
+
+
+def get_queue_id(params):
+    """
+    Return the name (str) of the queue described in `params` (dict), or None
+    if `params` does not refer to a queue.
+    """
+    if 'queue_id' in params:
+        return params['queue_id']
+    return params.get('dynamo_table_name')
+
+
+def get_queue(backend):
+    """
+    Return the (cached) queue object for `backend` (str).
+    """
+    if backend not in backends:
+        raise Exception('Unknown queue_backend \'' + str(backend) + '\'.')
+    with queues_lock:
+        if backend not in queues:
+            queues[backend] = backends[backend]()
+    return queues[backend]
+
+
+def claim(queue, queue_id, chunk_size, n_items, lease_time=lease_seconds):
+    """
+    Claim `chunk_size` (int) orders of the queue `queue_id` (str) stored in
+    `queue` (a queue object), with `n_items` (int) items, for `lease_time`
+    seconds. A chunk whose lease expired before it was finished (e.g. its
+    worker timed out) is claimed again; otherwise, the next unclaimed chunk
+    is claimed atomically. Returns the first order claimed (the claimed
+    orders go from it up to, but excluding, it + `chunk_size`) and the lease
+    (int), to be passed to `mark_done`. Orders are claimed from 0 upwards
+    and may exceed the number of items.
+    """
+    now = int(time.time())
+    for chunk, lease in enumerate(queue.get_leases(queue_id)[:n_chunks(n_items, chunk_size)]):
+        if lease != 0 and lease < now and queue.renew_lease(queue_id, chunk, lease, now + lease_time):
+            return chunk * chunk_size, now + lease_time
+
+    return queue.claim_chunk(queue_id, chunk_size, now + lease_time), now + lease_time
+
+
+def mark_done(queue, queue_id, start, chunk_size, lease, n_done):
+    """
+    Record that the `n_done` (int) items of the chunk starting at order
+    `start` (int), claimed with `lease` (int, see `claim`), were processed.
+    Returns the total number of items processed so far, or None if the
+    lease was lost: the chunk was claimed again by another worker, which
+    will report it.
+    """
+    return queue.finish_chunk(queue_id, start // chunk_size, lease, n_done)
+
+
+def n_chunks(n_items, chunk_size):
+    """
+    Return the number of chunks of `chunk_size` (int) orders needed to
+    cover `n_items` (int) items.
+    """
+    return -(-n_items // chunk_size)
+
+
+def pending_leases(queue, queue_id, chunk_size, n_items):
+    """
+    Return the leases (list of ints) of the chunks of the queue `queue_id`
+    (str) that were claimed but not finished yet.
+    """
+    return [lease for lease in queue.get_leases(queue_id)[:n_chunks(n_items, chunk_size)] if lease != 0]
+
+
+def queue_params(backend, queue_id, n_items):
+    """
+    Return the payload (dict) for http-request to capture the `n_items` (int)
+    items in the queue `queue_id` (str) stored by `backend` (str), starting
+    from the last one.
+    """
+    params = {'queue_backend': backend, 'queue_id': queue_id, 'order': n_items - 1}
+    # The dynamodb-delete-table Lambda expects the table name here:
+    if backend == 'temp_table':
+        params['dynamo_table_name'] = queue_id
+    return params
@@ -0,0 +1,18 @@
+# Builds the capture-shared layer: the python modules in capture-shared/python/
+# used by many Lambda functions (cloud_clients, output_formats, http_sessions,
+# work_queue, captured_urls and keyword_matcher). Edit the modules there (they
+# are not copied into the Lambda functions' folders) and publish a new layer
+# version after any change, updating the layer version used by the functions.
+# To run the functions locally, add capture-shared/python to PYTHONPATH.
+package=capture-shared
+
+rm -f ${package}_lambda_layer.zip
+cd $package
+zip -r ../${package}_lambda_layer.zip ./python -x '*__pycache__*'
+cd ..
+#aws s3 cp ${package}_lambda_layer.zip s3://config-lambda/layers/$package/lambda_layer.zip
+#aws lambda publish-layer-version \
+#    --layer-name $package \
+#    --content S3Bucket=config-lambda,S3Key=layers/$package/lambda_layer.zip \
+#    --compatible-runtimes python3.6 python3.7
+#rm ${package}_lambda_layer.zip